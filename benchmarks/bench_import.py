@@ -0,0 +1,71 @@
+"""
+Cold start benchmark of the package, measured with `python -X importtime` in fresh interpreters.
+
+    python benchmarks/bench_import.py [--runs 5] [--top 10]
+
+`import szamlazz` alone should stay cheap: its names, and the dependencies behind them, are imported on first use.
+The other statements show what the first use of the clients costs.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+STATEMENTS = (
+    "import szamlazz",
+    "from szamlazz import Header, Item",
+    "from szamlazz import SzamlazzClient",
+    "from szamlazz import AsyncSzamlazzClient",
+)
+HEAVY = ("requests", "httpx", "jinja2", "lxml", "xmltodict")
+# the interpreters run in the repository root, so they import the szamlazz package of this checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)")
+
+
+def importtime(statement: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Runs `statement` in a fresh interpreter
+    :return: {module: (self µs, cumulative µs)} of every module imported
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, check=True, cwd=ROOT)
+    return {module: (int(own), int(cumulative)) for own, cumulative, module in _LINE.findall(result.stderr)}
+
+
+def cost(statement: str, baseline: Dict[str, Tuple[int, int]]) -> Tuple[int, Dict[str, Tuple[int, int]]]:
+    """
+    :return: Tuple[µs spent importing the modules of `statement` the bare interpreter does not import, those modules]
+    """
+    # the modules imported by the lazy attributes of szamlazz are not nested under it in the -X importtime report,
+    # so the self times of the new modules are summed up instead of reading a single cumulative figure
+    modules = {module: times for module, times in importtime(statement).items() if module not in baseline}
+    return sum(own for own, _ in modules.values()), modules
+
+
+def loaded(statement: str) -> List[str]:
+    code = f"import sys; {statement}; print(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=ROOT).stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per statement, the best run is reported")
+    parser.add_argument("--top", type=int, default=0, help="also list the N imports with the highest cumulative time of the best runs")
+    args = parser.parse_args()
+
+    baseline = importtime("pass")
+    print(f"{'statement':<42} {'ms':>8}  dependencies loaded")
+    for statement in STATEMENTS:
+        total, modules = min((cost(statement, baseline) for _ in range(args.runs)), key=lambda run: run[0])
+        print(f"{statement:<42} {total / 1000:>8.1f}  {', '.join(loaded(statement)) or '-'}")
+        for module, (_, cumulative) in sorted(modules.items(), key=lambda item: -item[1][1])[:args.top]:
+            print(f"    {module:<38} {cumulative / 1000:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
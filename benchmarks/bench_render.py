@@ -0,0 +1,86 @@
+"""
+Rendering benchmark of the "jinja2" (szamlazz.templates) and the "direct" (szamlazz.serializers) engines.
+
+    python benchmarks/bench_render.py [--number 2000]
+
+Both engines are checked to produce the very same document before they are timed.
+The pre-rendered fragments of the "direct" engine (see serializers.Fragments) are timed against the %-format
+of the element run they replace.
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+
+# run from a checkout: import the szamlazz package next to this directory, not an installed one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from szamlazz import SzamlazzClient, Header, Merchant, Buyer, Item, Disbursement, templates, serializers
+
+
+TODAY = datetime.today().strftime("%Y-%m-%d")
+
+
+def invoice_data(client: SzamlazzClient, items: int) -> dict:
+    header = Header(creating_date=TODAY, payment_date=TODAY, due_date=TODAY, invoice_comment="No Comment", invoice_prefix="DK")
+    merchant = Merchant(bank_name="OTP", bank_account_number="11111111-22222222-33333333", email_subject="Invoice notification")
+    buyer = Buyer(name="Kovacs Bt.", zip_code="2030", city="Érd", address="Tárnoki út 23.", tax_number="12345678-1-42")
+    item = Item(name="Eladó izé", quantity="2.0", quantity_unit="db", unit_price="10000", vat_rate="27",
+                net_price="20000.0", vat_amount="5400.0", gross_amount="25400.0", comment_for_item="lorem ipsum")
+    return client._invoice_template_data(client.get_basic_settings(), header, merchant, buyer, [item] * items)
+
+
+def cases(client: SzamlazzClient):
+    settings = client.get_basic_settings()
+    for items in (1, 10, 100):
+        yield f"generate_invoice ({items} items)", templates.generate_invoice, invoice_data(client, items)
+    reverse = invoice_data(client, 0)
+    reverse["header"] = reverse["header"]._replace(invoice_number="E-DK-2021-15")
+    yield "reverse_invoice", templates.reverse_invoice, {**reverse, "szamlaLetoltesPld": 1}
+    yield "credit_entry (3 disbursements)", templates.credit_entry, {
+        **settings, "szamlaszam": "E-DK-2021-15", "additiv": False,
+        "disbursements": [Disbursement(date=TODAY, title="átutalás", amount=1000.0)] * 3,
+    }
+    yield "generate_receipt (3 items)", templates.generate_receipt, {
+        **settings, "pdfLetoltes": True,
+        "fejlec": {"hivasAzonosito": "1", "elotag": "NYGTA", "fizmod": "készpénz", "penznem": "HUF"},
+        "tetelek": [{"megnevezes": "izé", "mennyiseg": 1.0, "mennyisegiEgyseg": "db", "nettoEgysegar": 100,
+                     "netto": 100, "afakulcs": "27", "afa": 27, "brutto": 127}] * 3,
+        "kifizetesek": [],
+    }
+
+
+def fragment_cases(client: SzamlazzClient):
+    data = invoice_data(client, 1)
+    yield "<beallitasok> (settings)", serializers._INVOICE_SETTINGS, "keys", data
+    yield "<elado> (Merchant)", serializers._INVOICE_MERCHANT, "attrs", data["merchant"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=500, help="renders per engine and case, best of 5 runs")
+    number = parser.parse_args().number
+
+    client = SzamlazzClient(agent_key="benchmark")
+    print(f"{'document':<32} {'jinja2 µs':>10} {'direct µs':>10} {'speedup':>8}")
+    for name, template, data in cases(client):
+        if templates.render(template, data) != serializers.render(template, data):
+            raise AssertionError(f"{name}: the engines rendered different documents")
+        jinja2 = min(timeit.repeat(lambda: templates.render(template, data), number=number, repeat=5)) / number * 1e6
+        direct = min(timeit.repeat(lambda: serializers.render(template, data), number=number, repeat=5)) / number * 1e6
+        print(f"{name:<32} {jinja2:>10.1f} {direct:>10.1f} {jinja2 / direct:>7.1f}x")
+
+    print(f"\n{'fragment':<32} {'format µs':>10} {'lookup µs':>10} {'speedup':>8}")
+    fragments = serializers.Fragments()
+    for name, elements, method, data in fragment_cases(client):
+        render, lookup = getattr(elements, method), getattr(fragments, method)
+        if render(data) != lookup(elements, data):
+            raise AssertionError(f"{name}: the fragment differs from the rendered elements")
+        formatted = min(timeit.repeat(lambda: render(data), number=number * 10, repeat=5)) / number / 10 * 1e6
+        looked_up = min(timeit.repeat(lambda: lookup(elements, data), number=number * 10, repeat=5)) / number / 10 * 1e6
+        print(f"{name:<32} {formatted:>10.2f} {looked_up:>10.2f} {formatted / looked_up:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,9 @@ setuptools.setup(
         'lxml>=5.4.0',
         'xmltodict>=0.14.2',
     ],
+    extras_require={
+        'async': ['httpx>=0.27.0'],
+    },
     classifiers=[
         'Environment :: Web Environment',
         'Intended Audience :: Developers',
@@ -1,4 +1,46 @@
-from .client import SzamlazzClient
-from .models import *
-from .templates import *
-from .xsd import *
+"""
+The public names of the package are imported on first access (PEP 562), so `import szamlazz` does not load
+requests, httpx, Jinja2, lxml and the compiled templates/schemas until they are needed.
+`python benchmarks/bench_import.py` tracks the cost of the import.
+"""
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .client import SzamlazzClient
+    from .async_client import AsyncSzamlazzClient
+    from .models import *
+    from .templates import *
+    from .xsd import *
+    from .prefork import warmup
+
+
+# public name -> submodule defining it, in the precedence of the former star imports (the last one wins)
+_EXPORTS = {
+    "SzamlazzClient": "client",
+    "AsyncSzamlazzClient": "async_client",
+    **dict.fromkeys(("Header", "Merchant", "BuyerLedger", "Buyer", "ItemLedger", "Item", "Disbursement", "SzamlazzResponse",
+                     "PdfDataMissingError", "EmailDetails", "QueryTaxpayerResponse", "InvoiceJob", "BatchResult"), "models"),
+    **dict.fromkeys(("generate_invoice", "reverse_invoice", "credit_entry", "query_invoice_pdf"), "templates"),
+    **dict.fromkeys(("validate", "validate_many", "ValidationResult"), "xsd"),
+    "warmup": "prefork",
+}
+_SUBMODULES = ("async_client", "batch", "cache", "client", "coalesce", "compact", "deadline", "hedge", "models", "prefork",
+               "retry", "serializers", "streaming", "templates", "throttle", "validation", "version", "xsd")
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name in _EXPORTS:
+        value = getattr(import_module(f".{_EXPORTS[name]}", __name__), name)
+    elif name in _SUBMODULES:
+        value = import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value  # later accesses do not go through __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | set(_SUBMODULES))
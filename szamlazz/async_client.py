@@ -0,0 +1,437 @@
+import asyncio
+import logging
+import time
+from functools import partial
+from typing import IO, Any, BinaryIO, Callable, Iterable, List, Optional, Union
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+from szamlazz import cache as caches
+from szamlazz import coalesce
+from szamlazz import deadline as deadlines
+from szamlazz import hedge as hedging
+from szamlazz import retry as retries
+from szamlazz import streaming
+from szamlazz import throttle as throttles
+from szamlazz import validation as validations
+from szamlazz.client import BaseSzamlazzClient
+from szamlazz.models import PDF_STREAM_CHUNK_SIZE, _StreamedBody
+from szamlazz.models import Header, Merchant, Buyer, Item, Disbursement, SzamlazzResponse, EmailDetails, QueryTaxpayerResponse
+
+
+__all__ = ["AsyncSzamlazzClient", ]
+logger = logging.getLogger(__name__)
+
+
+class AsyncSzamlazzClient(BaseSzamlazzClient):
+    """
+    asyncio flavour of SzamlazzClient. Every managed action is a coroutine returning the same response types.
+    The HTTP transport is an httpx.AsyncClient, install it with: pip install szamlazz.py[async]
+
+        async with AsyncSzamlazzClient(agent_key="...") as client:
+            response = await client.query_invoice_pdf(invoice_number="E-DK-2021-15")
+    """
+    def __init__(self,
+                 username: str = "",
+                 password: str = "",
+                 agent_key: str = "",
+                 response_version: int = 2,
+                 retry: Optional[retries.RetryPolicy] = None,
+                 throttle: Optional[throttles.Throttle] = None,
+                 engine: str = "jinja2",
+                 compact: bool = False,
+                 validation: Union[str, validations.ValidationPolicy] = "always",
+                 taxpayer_cache: Optional[caches.TaxpayerCache] = None,
+                 document_cache: Optional[caches.DocumentCache] = None,
+                 coalesce_reads: bool = True,
+                 hedge: Optional[hedging.HedgePolicy] = None,
+                 timeout: Union[None, float, deadlines.Timeouts] = None,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20,
+                 keep_alive_timeout: Optional[float] = 60.0,
+                 http_client: Optional["httpx.AsyncClient"] = None,
+                 ):
+        """
+        :param username: Számlázz.hu user
+        :param password: Számlázz.hu’s user password
+        :param agent_key: Számlázz.hu / Számla Agent Kulcs (key)
+        :param response_version: Text|PDF or XML+PDF answer. See SzamlazzClient
+        :param retry: [optional] RetryPolicy of failed calls. None = no retries (see szamlazz.retry)
+        :param throttle: [optional] client-side rate and concurrency limits per action (see szamlazz.throttle)
+        :param engine: renderer of the built-in requests, "jinja2" or "direct". See SzamlazzClient
+        :param compact: True = send compact requests. See SzamlazzClient
+        :param validation: ValidationPolicy or the name of its mode. See SzamlazzClient
+        :param taxpayer_cache: [optional] TaxpayerCache of the answers of `query_taxpayer`. See SzamlazzClient
+        :param document_cache: [optional] DocumentCache of the issued invoices. See SzamlazzClient
+        :param coalesce_reads: True = identical concurrent read-only requests share a single call. See SzamlazzClient
+        :param hedge: [optional] HedgePolicy of the read-only calls, the late ones are sent once more. See SzamlazzClient
+        :param timeout: [optional] Timeouts of every call, or the total seconds of a call. See SzamlazzClient
+        :param max_connections: Maximum number of concurrent connections. Further calls wait for a free connection
+        :param max_keepalive_connections: Maximum number of idle keep-alive connections kept in the pool
+        :param keep_alive_timeout: Seconds a pooled connection may stay idle before it is dropped. None = never
+        :param http_client: [optional] A preconfigured httpx.AsyncClient. It is not closed by `close()`
+        """
+        if httpx is None:
+            raise ImportError("AsyncSzamlazzClient requires httpx. Install it with: pip install szamlazz.py[async]")
+        super().__init__(username=username, password=password, agent_key=agent_key, response_version=response_version,
+                         retry=retry, throttle=throttle, engine=engine, compact=compact, validation=validation,
+                         taxpayer_cache=taxpayer_cache, document_cache=document_cache, hedge=hedge, timeout=timeout)
+        self.single_flight: Optional[coalesce.AsyncSingleFlight] = coalesce.AsyncSingleFlight() if coalesce_reads else None
+        self.__owns_http_client = http_client is None
+        self.__limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keep_alive_timeout,
+        )
+        if http_client is None:
+            http_client = self.__new_http_client()
+        self.__http_client: httpx.AsyncClient = http_client
+
+    def __new_http_client(self) -> "httpx.AsyncClient":
+        return httpx.AsyncClient(limits=self.__limits, timeout=None)  # set per request, see `_send`
+
+    def _after_fork(self):
+        super()._after_fork()
+        # the inherited pool belongs to the parent and to its event loop, it is dropped without closing its connections
+        # (their sockets are closed in this process when they are collected)
+        if self.single_flight is not None:
+            self.single_flight = coalesce.AsyncSingleFlight()  # the calls in flight were the parent's
+        if self.__owns_http_client:
+            self.__http_client = self.__new_http_client()
+        else:
+            logger.warning("AsyncSzamlazzClient inherited across a fork: its injected http_client still holds "
+                           "the connections of the parent process, replace it in the child")
+
+    def _rebuild_response(self, status_code: int, content: Union[str, bytes], headers: Optional[dict] = None) -> "httpx.Response":
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        return httpx.Response(status_code, headers=headers, content=content, request=httpx.Request("POST", self.url))
+
+    @staticmethod
+    def _timeout_phase(error: BaseException) -> Optional[str]:
+        if isinstance(error, (httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return "connect"
+        if isinstance(error, (httpx.ReadTimeout, httpx.WriteTimeout)):
+            return "read"
+        return None
+
+    async def __aenter__(self) -> "AsyncSzamlazzClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """
+        Releases the pooled connections. An injected `http_client` is left open for its owner to close.
+        """
+        if self.__owns_http_client:
+            await self.__http_client.aclose()
+
+    @property
+    def http_client(self) -> "httpx.AsyncClient":
+        """
+        The httpx.AsyncClient holding the client's connection pool
+        """
+        return self.__http_client
+
+    async def generate_invoice(self,
+                               header: Header,
+                               merchant: Merchant,
+                               buyer: Buyer,
+                               items: Iterable[Item],
+                               e_invoice: bool = True,
+                               invoice_download: bool = True,
+                               external_id: str = "",
+                               pdf_sink: Optional[BinaryIO] = None,
+                               timeout: Union[None, float, deadlines.Timeouts] = None,
+                               ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.generate_invoice
+        """
+        return await super().generate_invoice(header, merchant, buyer, items, e_invoice, invoice_download, external_id,
+                                              pdf_sink, timeout=timeout)
+
+    async def reverse_invoice(self,
+                              header: Header,
+                              merchant: Merchant,
+                              buyer: Buyer,
+                              e_invoice: bool = True,
+                              invoice_download: bool = True,
+                              invoice_download_copy: int = 1,
+                              timeout: Union[None, float, deadlines.Timeouts] = None,
+                              ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.reverse_invoice
+        """
+        return await super().reverse_invoice(header, merchant, buyer, e_invoice, invoice_download, invoice_download_copy, timeout=timeout)
+
+    async def register_credit_entry(self,
+                                    invoice_number: str,
+                                    disbursements: List[Disbursement],
+                                    additive: bool = False,
+                                    timeout: Union[None, float, deadlines.Timeouts] = None,
+                                    ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.register_credit_entry
+        """
+        return await super().register_credit_entry(invoice_number, disbursements, additive, timeout=timeout)
+
+    async def query_invoice_pdf(self,
+                                invoice_number: str,
+                                pdf_sink: Optional[BinaryIO] = None,
+                                timeout: Union[None, float, deadlines.Timeouts] = None,
+                                ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.query_invoice_pdf
+        """
+        return await super().query_invoice_pdf(invoice_number, pdf_sink, timeout=timeout)
+
+    async def query_invoice_xml(self,
+                                invoice_number: str = "",
+                                order_number: str = "",
+                                pdf: bool = True,
+                                pdf_sink: Optional[BinaryIO] = None,
+                                timeout: Union[None, float, deadlines.Timeouts] = None,
+                                ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.query_invoice_xml
+        """
+        return await super().query_invoice_xml(invoice_number, order_number, pdf, pdf_sink, timeout=timeout)
+
+    async def delete_pro_forma_invoice(self,
+                                       invoice_number: str = "",
+                                       order_number: str = "",
+                                       timeout: Union[None, float, deadlines.Timeouts] = None,
+                                       ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.delete_pro_forma_invoice
+        """
+        return await super().delete_pro_forma_invoice(invoice_number, order_number, timeout=timeout)
+
+    async def generate_receipt(self, payload: dict, timeout: Union[None, float, deadlines.Timeouts] = None) -> "httpx.Response":
+        """
+        See SzamlazzClient.generate_receipt
+        """
+        return await super().generate_receipt(payload, timeout)
+
+    async def reverse_receipt(self,
+                              receipt_number: str,
+                              pdf_template: str = "",
+                              timeout: Union[None, float, deadlines.Timeouts] = None,
+                              ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.reverse_receipt
+        """
+        return await super().reverse_receipt(receipt_number, pdf_template, timeout=timeout)
+
+    async def query_receipt(self,
+                            receipt_number: str,
+                            pdf_template: str = "",
+                            timeout: Union[None, float, deadlines.Timeouts] = None,
+                            ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.query_receipt
+        """
+        return await super().query_receipt(receipt_number, pdf_template, timeout=timeout)
+
+    async def send_receipt(self,
+                           email_details: EmailDetails,
+                           send_again_previous_email: bool = False,
+                           timeout: Union[None, float, deadlines.Timeouts] = None,
+                           ) -> SzamlazzResponse:
+        """
+        See SzamlazzClient.send_receipt
+        """
+        return await super().send_receipt(email_details, send_again_previous_email, timeout=timeout)
+
+    async def query_taxpayer(self, vat_number: str, timeout: Union[None, float, deadlines.Timeouts] = None) -> QueryTaxpayerResponse:
+        """
+        See SzamlazzClient.query_taxpayer
+        """
+        cache = self.taxpayer_cache
+        if cache is None:
+            return await self._query_taxpayer(vat_number, timeout)
+        # the SQLite file of the cache is read and written in a thread, only the memory is looked up on the event loop
+        cached = cache.recall(vat_number)
+        if cached is None:
+            load = partial(cache.load, vat_number, self._rebuild_response)
+            cached = await asyncio.to_thread(load) if cache.path is not None else load()
+        if cached is not None:
+            return cached
+        response = await self._query_taxpayer(vat_number, timeout)
+        if cache.path is not None:
+            await asyncio.to_thread(cache.store, vat_number, response)
+        else:
+            cache.store(vat_number, response)
+        return response
+
+    def _taxpayer_response(self, vat_number: str, r) -> QueryTaxpayerResponse:
+        return QueryTaxpayerResponse(r)  # stored by `query_taxpayer`, off the event loop
+
+    async def request_maker(self, action: str, template: str, template_data: dict, xsd_xml: str = "", payload_extra_attachments: dict = None,
+                            timeout: Union[None, float, deadlines.Timeouts] = None) -> "httpx.Response":
+        """
+        Custom, non-managed requests can be made against SzámlaAgent. See SzamlazzClient.request_maker
+        :return: httpx.Response
+        """
+        deadline = self._deadline(timeout)
+        output = self._render(action, template, template_data, xsd_xml, self.engine, self._fragments, self.compact,
+                              self._validator, deadline)
+        return await self._post(action, output, payload_extra_attachments, deadline=deadline)
+
+    async def _post(self, action: str, document: Union[str, bytes, IO[bytes]], payload_extra_attachments: dict = None,
+                    idempotent: Optional[bool] = None, stream: bool = False,
+                    deadline: Optional[deadlines.Deadline] = None) -> "httpx.Response":
+        """
+        Uploads an already rendered (and validated) XML document to Számla Agent, retrying as the RetryPolicy allows.
+        A spooled `document` (see `_render_spooled`) is uploaded in chunks, without extra attachments.
+        `stream` = the body of the returned response is not downloaded yet
+        `deadline` = the Deadline of the call. None = a new one, with the client's timeout
+        Identical concurrent reads share a single call, see `coalesce_reads`
+        :raises deadline.DeadlineExceeded: if the call times out
+        """
+        deadline = deadline if deadline is not None else self._deadline()
+        if self.single_flight is not None and self._coalesced(action, document, payload_extra_attachments, stream):
+            return await self.single_flight.do((action, document),
+                                               partial(self.__post, action, document, None, idempotent, False, deadline),
+                                               timeout=deadline.remaining(), timeout_error=partial(deadline.exceeded, "read"))
+        return await self.__post(action, document, payload_extra_attachments, idempotent, stream, deadline)
+
+    async def __post(self, action: str, document: Union[str, bytes, IO[bytes]], payload_extra_attachments: Optional[dict],
+                     idempotent: Optional[bool], stream: bool, deadline: deadlines.Deadline) -> "httpx.Response":
+        if hasattr(document, "read"):
+            payload = streaming.MultipartBody(action, document)
+        else:
+            payload = {action: (action, document)}
+            payload.update(payload_extra_attachments) if payload_extra_attachments else None
+        try:
+            if self.retry is None:
+                return await self.__attempt(action, payload, stream, deadline)
+            return await self.__retrying(action, payload, idempotent, stream, deadline)
+        except httpx.TimeoutException as e:
+            raise deadline.exceeded(self._timeout_phase(e) or "read") from e
+
+    async def __retrying(self, action: str, payload: Union[dict, streaming.MultipartBody], idempotent: Optional[bool],
+                         stream: bool, deadline: deadlines.Deadline) -> "httpx.Response":
+        idempotent = action in retries.READ_ACTIONS if idempotent is None else idempotent
+        self._retry_budget.deposit()
+        attempt = 1
+        while True:
+            backoff = self.retry.backoff(attempt)
+            try:
+                r = await self.__attempt(action, payload, stream, deadline)
+            except httpx.TransportError as e:
+                connect_error = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not self._should_retry(attempt, idempotent, error=e, connect_error=connect_error,
+                                          deadline=deadline, backoff=backoff):
+                    raise
+            else:
+                if not self._should_retry(attempt, idempotent, r.status_code, r.headers.get("szlahu_error_code"),
+                                          deadline=deadline, backoff=backoff):
+                    return r
+                await r.aclose()
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+    async def __attempt(self, action: str, payload: Union[dict, streaming.MultipartBody], stream: bool,
+                        deadline: deadlines.Deadline) -> "httpx.Response":
+        if not self._hedged(action, payload):
+            return await self._send(action, payload, stream, deadline)
+        return await self.hedger.asend(action, partial(self._send, action, payload, stream, deadline),
+                                       lambda r: r.aclose())
+
+    async def _send(self, action: str, payload: Union[dict, streaming.MultipartBody], stream: bool = False,
+                    deadline: Optional[deadlines.Deadline] = None) -> "httpx.Response":
+        """
+        A single HTTP attempt, within the limits of the client's Throttle and of the `deadline`
+        """
+        deadline = deadline if deadline is not None else self._deadline()
+        deadline.check("connect")
+        timeout = httpx.Timeout(None, connect=deadline.timeout("connect"), pool=deadline.timeout("connect"),
+                                read=deadline.timeout("read"), write=deadline.timeout("read"))
+        if isinstance(payload, streaming.MultipartBody):
+            # the length is known, so the body is not sent with chunked transfer encoding
+            request = self.__http_client.build_request("POST", self.url, content=payload.aiter(), timeout=timeout, headers={
+                "Content-Type": payload.content_type,
+                "Content-Length": str(len(payload)),
+            })
+        else:
+            request = self.__http_client.build_request("POST", self.url, files=payload, timeout=timeout)
+        if self.throttle is None:
+            return await self.__send(request, stream, deadline)
+        limiter = self.throttle.for_action(action)
+        ticket = await limiter.acquire_async(deadline.remaining())
+        if ticket is None:
+            raise deadline.exceeded("throttle")
+        started = time.monotonic()
+        try:
+            r = await self.__send(request, stream, deadline)
+        except asyncio.CancelledError:  # e.g. the attempt which lost a hedge: not a sign of congestion
+            limiter.abandon(ticket)
+            raise
+        except BaseException as e:
+            limiter.release(ticket, time.monotonic() - started, error=e)
+            raise
+        limiter.release(ticket, time.monotonic() - started, r.status_code, r.headers.get("szlahu_error_code"))
+        return r
+
+    async def __send(self, request: "httpx.Request", stream: bool, deadline: deadlines.Deadline) -> "httpx.Response":
+        # the timeouts of httpx bound every single network operation, the total is bounded here
+        try:
+            async with asyncio.timeout(deadline.remaining()):
+                return await self.__http_client.send(request, stream=stream)
+        except TimeoutError as e:
+            raise deadline.exceeded("read") from e
+
+    async def _call(self, action: str, template: str, template_data: dict, xsd_xml: str,
+                    response_factory: Optional[Callable[[Any], Any]] = None,
+                    idempotent: Optional[bool] = None,
+                    pdf_sink: Optional[BinaryIO] = None,
+                    streamed: bool = False,
+                    timeout: Union[None, float, deadlines.Timeouts] = None):
+        deadline = self._deadline(timeout)
+        if streamed:
+            with self._render_spooled(action, template, template_data, xsd_xml, self.engine, self._fragments,
+                                      self.compact, self._validator, deadline) as output:
+                return await self.__upload(action, output, response_factory, idempotent, pdf_sink, deadline)
+        output = self._render(action, template, template_data, xsd_xml, self.engine, self._fragments, self.compact,
+                              self._validator, deadline)
+        return await self.__upload(action, output, response_factory, idempotent, pdf_sink, deadline)
+
+    async def _cached_call(self, key: Optional[str], response_factory: Callable[..., Any], **call):
+        """
+        See BaseSzamlazzClient._cached_call
+        """
+        cached = None
+        if key is not None:  # the document_cache is read in a thread, not to block the event loop on the disk
+            cached = await asyncio.to_thread(self._cached_document, key, response_factory, call.get("pdf_sink"))
+        if cached is not None:
+            return cached
+        storing_factory = self._document_factory(response_factory, (lambda response: key) if key else None)
+        return await self._call(response_factory=storing_factory, **call)
+
+    async def __upload(self, action: str, output: Union[str, IO[bytes]], response_factory: Optional[Callable[[Any], Any]],
+                       idempotent: Optional[bool], pdf_sink: Optional[BinaryIO], deadline: deadlines.Deadline):
+        if pdf_sink is None:
+            r = await self._post(action, output, idempotent=idempotent, deadline=deadline)
+            if self.document_cache is not None:
+                # the response factory may store the answer in the document_cache (see _document_factory), in a thread
+                return await asyncio.to_thread(self._make_response, r, response_factory)
+            return self._make_response(r, response_factory)
+
+        r = await self._post(action, output, idempotent=idempotent, stream=True, deadline=deadline)
+        try:
+            body = _StreamedBody(r.headers, pdf_sink)
+            async with asyncio.timeout(deadline.remaining()):
+                async for chunk in r.aiter_bytes(PDF_STREAM_CHUNK_SIZE):
+                    body.feed(chunk)
+            body.close()
+        except (TimeoutError, httpx.TimeoutException) as e:
+            raise deadline.exceeded("read") from e
+        finally:
+            await r.aclose()
+        return self._make_response(r, partial(response_factory, streamed_body=body))
@@ -0,0 +1,146 @@
+import logging
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from szamlazz import serializers
+from szamlazz import templates
+from szamlazz import validation as validations
+from szamlazz import xsd
+from szamlazz.models import BatchResult, InvoiceJob
+
+
+__all__ = ["map_bounded", "render_invoices", ]
+logger = logging.getLogger(__name__)
+
+
+def map_bounded(fn: Callable[[Any], Any],
+                jobs: Iterable[Any],
+                max_workers: int = 8,
+                max_in_flight: Optional[int] = None,
+                ordered: bool = False,
+                ) -> Iterator[BatchResult]:
+    """
+    Calls `fn(job)` for every job on a thread pool and yields a BatchResult per job.
+
+    At most `max_in_flight` jobs are submitted at a time, so `jobs` may be a lazy iterable of any length.
+    An exception raised by `fn` is captured in BatchResult.error and does not abort the batch.
+    :param fn: callable executed for each job
+    :param jobs: iterable of jobs
+    :param max_workers: number of worker threads
+    :param max_in_flight: maximum number of submitted but not yet yielded jobs [default=2 * max_workers]
+    :param ordered: True = yield results in input order, False = yield results as they complete
+    :return: Iterator[BatchResult]
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="szamlazz-batch")
+    return _map_on_executor(executor, fn, jobs, max_in_flight or 2 * max_workers, ordered)
+
+
+def render_invoices(jobs: Iterable[InvoiceJob],
+                    settings: dict,
+                    processes: Optional[int] = None,
+                    max_in_flight: Optional[int] = None,
+                    ordered: bool = False,
+                    mp_context=None,
+                    engine: str = "jinja2",
+                    compact: bool = False,
+                    validation: Optional[validations.ValidationPolicy] = None,
+                    ) -> Iterator[BatchResult]:
+    """
+    Renders `templates.generate_invoice` and validates it against `xsd.generate_invoice` for every job
+    on a process pool, so the CPU-bound half of a bulk job uses every core.
+
+    Each worker process compiles the template and the schema once, when it starts.
+    The rendered documents are sent back as UTF-8 encoded bytes, ready to be uploaded as they are.
+    :param jobs: Iterable[InvoiceJob]
+    :param settings: SzamlazzClient.get_basic_settings() of the issuing client
+    :param processes: number of worker processes [default=os.cpu_count()]
+    :param max_in_flight: maximum number of submitted but not yet yielded jobs [default=2 * processes]
+    :param ordered: True = yield results in input order, False = yield results as they complete
+    :param mp_context: [optional] multiprocessing context of the pool
+    :param engine: "jinja2" or "direct", see SzamlazzClient
+    :param compact: True = compact documents, see SzamlazzClient
+    :param validation: [optional] ValidationPolicy of the workers, None = always validate. Their metrics are not collected
+    :return: Iterator[BatchResult] with the rendered document (bytes) in BatchResult.response
+    """
+    processes = processes or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=mp_context,
+                                   initializer=_init_render_worker, initargs=(settings, engine, compact, validation))
+    return _map_on_executor(executor, _render_invoice, jobs, max_in_flight or 2 * processes, ordered)
+
+
+def _map_on_executor(executor: Executor,
+                     fn: Callable[[Any], Any],
+                     jobs: Iterable[Any],
+                     max_in_flight: int,
+                     ordered: bool,
+                     ) -> Iterator[BatchResult]:
+    max_in_flight = max(max_in_flight, 1)
+    source = enumerate(jobs)
+    in_flight: Dict[Future, Tuple[int, Any]] = {}
+    queue = deque()  # futures in submission order, used when ordered=True
+
+    def submit_next() -> bool:
+        for index, job in source:
+            future = executor.submit(fn, job)
+            in_flight[future] = (index, job)
+            if ordered:
+                queue.append(future)
+            return True
+        return False
+
+    def result_of(future: Future) -> BatchResult:
+        index, job = in_flight.pop(future)
+        error = future.exception()
+        if error is not None:
+            logger.warning(f"batch job #{index} failed: {error!r}")
+            return BatchResult(index=index, job=job, error=error)
+        return BatchResult(index=index, job=job, response=future.result())
+
+    try:
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+        while in_flight:
+            if ordered:
+                done = [queue.popleft()]
+                wait(done)
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield result_of(future)
+                submit_next()
+    finally:
+        # the consumer may stop iterating early, drop whatever has not been started yet
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+# per-process state of the render_invoices workers
+_worker_settings: dict = {}
+_worker_engine = "jinja2"
+_worker_fragments = serializers.Fragments()
+_worker_compact = False
+_worker_validator: Optional[validations.Validator] = None
+
+
+def _init_render_worker(settings: dict, engine: str, compact: bool, validation: Optional[validations.ValidationPolicy]):
+    global _worker_engine, _worker_compact, _worker_validator
+    _worker_settings.update(settings)
+    _worker_engine = engine
+    _worker_compact = compact
+    _worker_validator = validations.Validator(validation) if validation is not None else None
+    # warm up, so the jobs only pay for rendering and validating
+    templates.get_template(templates.generate_invoice)
+    xsd.get_schema(xsd.generate_invoice)
+
+
+def _render_invoice(job: InvoiceJob) -> bytes:
+    from szamlazz.client import BaseSzamlazzClient  # imported here, szamlazz.client depends on this module
+
+    template_data = BaseSzamlazzClient._invoice_template_data(_worker_settings, *job)
+    output = BaseSzamlazzClient._render("action-xmlagentxmlfile", templates.generate_invoice, template_data, xsd.generate_invoice,
+                                        _worker_engine, _worker_fragments, _worker_compact,
+                                        _worker_validator)
+    return output
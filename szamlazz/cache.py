@@ -0,0 +1,405 @@
+"""
+Caches of Számla Agent answers:
+  * `TaxpayerCache` keeps the answers of `query_taxpayer` for a while, so validating the same buyers over and over
+    does not cost a round-trip to NAV (via Számla Agent) and an XML parse every time
+  * `DocumentCache` keeps the issued invoices (the answers of `query_invoice_pdf` / `query_invoice_xml`) on disk,
+    as they never change once issued
+
+    client = SzamlazzClient(agent_key="...",
+                            taxpayer_cache=TaxpayerCache(ttl=24 * 3600, path="/var/cache/szamlazz/taxpayers.sqlite3"),
+                            document_cache=DocumentCache("/var/cache/szamlazz/documents"))
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import closing
+from threading import Lock
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from szamlazz.models import QueryTaxpayerResponse, _response_ok
+
+
+__all__ = ["TaxpayerCache", "TaxpayerCacheStats", "DocumentCache", "DocumentCacheStats", "CachedDocument", ]
+logger = logging.getLogger(__name__)
+
+
+class TaxpayerCacheStats:
+    """
+    Thread-safe counters of a TaxpayerCache
+    """
+    def __init__(self):
+        self.hits = 0  # answered from memory
+        self.persistent_hits = 0  # answered from the SQLite file
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+        self.evicted = 0
+        self.__lock = Lock()
+
+    def _count(self, counter: str):
+        with self.__lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _after_fork(self):
+        self.__lock = Lock()
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.persistent_hits + self.misses
+        return (self.hits + self.persistent_hits) / lookups if lookups else 0.0
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+class TaxpayerCache:
+    """
+    TTL + LRU cache of QueryTaxpayerResponses by VAT number, shared by any number of clients and threads.
+
+    The parsed answers are kept in memory (the least recently used one is dropped above `max_size`). With a `path`,
+    their XML is also stored in an SQLite file, which outlives the process and is shared by the processes using it
+    (e.g. the workers of a server): an answer missing from memory is looked up there before Számla Agent is called.
+    The clients hand out the very same QueryTaxpayerResponse instance for the hits of a VAT number.
+    Answers with a funcCode other than OK are kept for `negative_ttl` only, failed HTTP calls are not kept at all.
+    """
+    def __init__(self,
+                 ttl: float = 24 * 3600,
+                 negative_ttl: float = 60,
+                 max_size: int = 10000,
+                 path: Optional[str] = None,
+                 ):
+        """
+        :param ttl: seconds an answer is kept for
+        :param negative_ttl: seconds an answer with an error (funcCode != OK) is kept for. 0 = not kept
+        :param max_size: answers kept in memory
+        :param path: [optional] SQLite file of the persistent cache, created if missing. None = memory only
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.path = path
+        self.stats = TaxpayerCacheStats()
+        self.__entries: "OrderedDict[str, Tuple[float, QueryTaxpayerResponse]]" = OrderedDict()  # VAT number: (expiry, answer)
+        self.__lock = Lock()
+        if path is not None:
+            with closing(self.__connect()) as db, db:
+                db.execute("PRAGMA journal_mode=WAL")  # readers do not wait for the writing workers
+                db.execute("CREATE TABLE IF NOT EXISTS taxpayers (vat_number TEXT PRIMARY KEY, status_code INTEGER NOT NULL, "
+                           "xml TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _after_fork(self):
+        # in the child of a fork: the lock may have been held by another thread of the parent. The answers are kept
+        self.__lock = Lock()
+        self.stats._after_fork()
+
+    def lookup(self, vat_number: str, rebuild: Callable[[int, str], Any]) -> Optional[QueryTaxpayerResponse]:
+        """
+        :param rebuild: makes an HTTP response object of a status code and a text, for the answers read from the SQLite file
+        :return: the cached answer, None if there is none or it has expired
+        """
+        response = self.recall(vat_number)
+        if response is None:
+            response = self.load(vat_number, rebuild)
+        return response
+
+    def recall(self, vat_number: str) -> Optional[QueryTaxpayerResponse]:
+        """
+        The in-memory half of `lookup`, it never blocks on I/O
+        :return: the answer kept in memory, None if there is none or it has expired (a miss is not counted)
+        """
+        now = time.time()
+        with self.__lock:
+            entry = self.__entries.get(vat_number)
+            if entry is not None:
+                if entry[0] > now:
+                    self.__entries.move_to_end(vat_number)
+                    self.stats._count("hits")
+                    return entry[1]
+                del self.__entries[vat_number]
+                self.stats._count("expired")
+        return None
+
+    def load(self, vat_number: str, rebuild: Callable[[int, str], Any]) -> Optional[QueryTaxpayerResponse]:
+        """
+        The persistent half of `lookup`, for an answer `recall` has not found: reads the SQLite file, if any
+        :return: the stored answer (kept in memory from now on), None if there is none or it has expired
+        """
+        now = time.time()
+        if self.path is not None:
+            with closing(self.__connect()) as db:
+                row = db.execute("SELECT status_code, xml, expires FROM taxpayers WHERE vat_number = ?", (vat_number,)).fetchone()
+            if row is not None and row[2] > now:
+                response = QueryTaxpayerResponse(rebuild(row[0], row[1]))
+                self.__remember(vat_number, row[2], response)
+                self.stats._count("persistent_hits")
+                return response
+        self.stats._count("misses")
+        return None
+
+    def store(self, vat_number: str, response: QueryTaxpayerResponse):
+        """
+        Keeps a fresh answer of Számla Agent, for `ttl` or `negative_ttl` seconds
+        """
+        if not _response_ok(response.response):
+            return
+        ttl = self.negative_ttl if response.has_errors else self.ttl
+        if ttl <= 0:
+            return
+        expires = time.time() + ttl
+        self.__remember(vat_number, expires, response)
+        self.stats._count("stores")
+        if self.path is not None:
+            with closing(self.__connect()) as db, db:
+                db.execute("INSERT OR REPLACE INTO taxpayers VALUES (?, ?, ?, ?)",
+                           (vat_number, response.response.status_code, response.raw_xml, expires))
+
+    def invalidate(self, vat_number: str):
+        """
+        Drops the answer of a VAT number, from memory and from the SQLite file
+        """
+        with self.__lock:
+            self.__entries.pop(vat_number, None)
+        if self.path is not None:
+            with closing(self.__connect()) as db, db:
+                db.execute("DELETE FROM taxpayers WHERE vat_number = ?", (vat_number,))
+
+    def purge(self) -> int:
+        """
+        Drops the expired answers of the SQLite file (the expired answers in memory are dropped when they are looked up)
+        :return: number of answers dropped
+        """
+        if self.path is None:
+            return 0
+        with closing(self.__connect()) as db, db:
+            return db.execute("DELETE FROM taxpayers WHERE expires <= ?", (time.time(),)).rowcount
+
+    def clear(self):
+        """
+        Drops every answer, from memory and from the SQLite file
+        """
+        with self.__lock:
+            self.__entries.clear()
+        if self.path is not None:
+            with closing(self.__connect()) as db, db:
+                db.execute("DELETE FROM taxpayers")
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __remember(self, vat_number: str, expires: float, response: QueryTaxpayerResponse):
+        with self.__lock:
+            self.__entries[vat_number] = (expires, response)
+            self.__entries.move_to_end(vat_number)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.stats._count("evicted")
+
+    def __connect(self) -> sqlite3.Connection:
+        # a connection per operation: connections must not cross threads, nor forks (see szamlazz.prefork)
+        return sqlite3.connect(self.path, timeout=10)
+
+
+class CachedDocument(NamedTuple):
+    """An HTTP answer of Számla Agent, as stored by a DocumentCache"""
+    status_code: int
+    headers: Dict[str, str]  # Content-Type and the szlahu_* headers
+    content: bytes
+
+
+class DocumentCacheStats:
+    """
+    Thread-safe counters of a DocumentCache, in the current process
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self.__lock = Lock()
+
+    def _count(self, counter: str, n: int = 1):
+        with self.__lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _after_fork(self):
+        self.__lock = Lock()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evicted": self.evicted,
+            }
+
+
+class DocumentCache:
+    """
+    Size-bounded on-disk cache of immutable documents, by key (see BaseSzamlazzClient._document_key).
+
+    Every document is a file of `directory`. It is written to a temporary file first and renamed over its final name,
+    so a reader (of any process sharing the directory) never sees a partial document. Reading a document marks it
+    as recently used (its mtime), and the least recently used documents are removed once the files add up to more
+    than `max_bytes`.
+
+    The size of the directory is kept as a running total, so storing a document does not list the directory. It is
+    listed (and the total corrected) when the total goes over `max_bytes`, and every `RESCAN_EVERY` stores, to catch
+    up with the documents stored and removed by the other processes sharing the directory.
+    """
+    SUFFIX = ".szamlazz"
+    RESCAN_EVERY = 100
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        :param directory: directory of the documents, created if missing
+        :param max_bytes: size of the documents kept, the least recently used ones are removed above that
+        """
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = DocumentCacheStats()
+        os.makedirs(directory, exist_ok=True)
+        self.__lock = Lock()
+        self.__bytes = self.size()  # running total of the documents, see `put`
+        self.__stores = 0
+
+    def _after_fork(self):
+        self.__lock = Lock()
+        self.stats._after_fork()
+
+    def get(self, key: str) -> Optional[CachedDocument]:
+        """
+        :return: the document stored under `key`, None if there is none
+        """
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                document = CachedDocument(meta["status_code"], meta["headers"], f.read())
+        except (OSError, ValueError, KeyError):  # missing, evicted meanwhile or unreadable
+            self.stats._count("misses")
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except OSError:
+            pass
+        self.stats._count("hits")
+        return document
+
+    def put(self, key: str, status_code: int, headers: Dict[str, str], content: bytes):
+        """
+        Stores a document, atomically. Documents larger than `max_bytes` are not stored
+        """
+        if len(content) > self.max_bytes:
+            return
+        meta = json.dumps({"status_code": status_code, "headers": headers}).encode("utf-8") + b"\n"
+        path = self.__path(key)
+        replaced = self.__size_of(path)
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(meta)
+                f.write(content)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+        self.stats._count("stores")
+        with self.__lock:
+            self.__bytes += len(meta) + len(content) - replaced
+            self.__stores += 1
+            rescan = self.__bytes > self.max_bytes or self.__stores % self.RESCAN_EVERY == 0
+        if rescan:
+            self.__evict()
+
+    def invalidate(self, key: str):
+        path = self.__path(key)
+        size = self.__size_of(path)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self.__lock:
+            self.__bytes -= size
+
+    def clear(self):
+        for _, _, path in self.__documents():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        with self.__lock:
+            self.__bytes = 0
+
+    def size(self) -> int:
+        """
+        :return: bytes taken by the documents
+        """
+        return sum(size for _, size, _ in self.__documents())
+
+    def __path(self, key: str) -> str:
+        # hashed: the keys contain the account of the client
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + self.SUFFIX)
+
+    @staticmethod
+    def __size_of(path: str) -> int:
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def __documents(self) -> List[Tuple[float, int, str]]:
+        # (mtime, size, path) of the documents
+        documents = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(self.SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # removed by another process
+                    continue
+                documents.append((stat.st_mtime, stat.st_size, entry.path))
+        return documents
+
+    def __evict(self):
+        documents = self.__documents()
+        size = sum(size for _, size, _ in documents)
+        if size <= self.max_bytes:
+            with self.__lock:
+                self.__bytes = size
+            return
+        evicted = 0
+        for _, document_size, path in sorted(documents):
+            try:
+                os.unlink(path)
+                evicted += 1
+            except FileNotFoundError:  # removed by another process
+                pass
+            size -= document_size
+            if size <= self.max_bytes:
+                break
+        with self.__lock:
+            self.__bytes = size
+        logger.debug(f"evicted {evicted} documents from {self.directory}")
+        self.stats._count("evicted", evicted)
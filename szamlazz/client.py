@@ -1,33 +1,100 @@
 import logging
-from typing import List, Tuple
+import os
+import time
+import uuid
+import weakref
+from collections.abc import Sized
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from typing import IO, Any, BinaryIO, Callable, Iterable, Iterator, List, Optional, Union
 
 import requests
-from jinja2 import Template
+from lxml import etree
+from requests.adapters import HTTPAdapter
 from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import NewConnectionError, ReadTimeoutError
 
+from szamlazz import batch
+from szamlazz import cache as caches
+from szamlazz import coalesce
+from szamlazz import compact as compaction
+from szamlazz import deadline as deadlines
+from szamlazz import hedge as hedging
+from szamlazz import retry as retries
+from szamlazz import serializers
+from szamlazz import streaming
 from szamlazz import templates
+from szamlazz import throttle as throttles
+from szamlazz import validation as validations
 from szamlazz import xsd
 from szamlazz.models import Header, Merchant, Buyer, Item, Disbursement, SzamlazzResponse, EmailDetails, QueryTaxpayerResponse
+from szamlazz.models import InvoiceJob, BatchResult, PDF_STREAM_CHUNK_SIZE, _StreamedBody
 
 
 __all__ = ["SzamlazzClient", ]
 logger = logging.getLogger(__name__)
 
 
-class SzamlazzClient:
+def _is_connect_error(e: requests.RequestException) -> bool:
+    # True if the connection could not be established, i.e. the request surely has not reached Számla Agent
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+# the live clients of the process, see BaseSzamlazzClient._after_fork
+_clients: "weakref.WeakSet[BaseSzamlazzClient]" = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for client in list(_clients):
+        client._after_fork()
+
+
+if hasattr(os, "register_at_fork"):  # POSIX only
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class BaseSzamlazzClient:
+    """
+    Builds, renders and validates the Számla Agent requests of every managed action.
+    Sending them is left to the subclasses, see SzamlazzClient and szamlazz.async_client.AsyncSzamlazzClient
+    """
     url = "https://www.szamlazz.hu/szamla/"
+    streaming_items_threshold = 1000  # invoices with more items (or with an unsized iterable of items) are streamed
 
     def __init__(self,
                  username: str = "",
                  password: str = "",
                  agent_key: str = "",
                  response_version: int = 2,
+                 retry: Optional[retries.RetryPolicy] = None,
+                 throttle: Optional[throttles.Throttle] = None,
+                 engine: str = "jinja2",
+                 compact: bool = False,
+                 validation: Union[str, validations.ValidationPolicy] = "always",
+                 taxpayer_cache: Optional[caches.TaxpayerCache] = None,
+                 document_cache: Optional[caches.DocumentCache] = None,
+                 hedge: Optional[hedging.HedgePolicy] = None,
+                 timeout: Union[None, float, deadlines.Timeouts] = None,
                  ):
         """
         :param username: Számlázz.hu user
         :param password: Számlázz.hu’s user password
         :param agent_key: Számlázz.hu / Számla Agent Kulcs (key)
         :param response_version: Text|PDF or XML+PDF answer.
+        :param retry: [optional] RetryPolicy of failed calls. None = no retries
+        :param throttle: [optional] client-side rate and concurrency limits per action. None = unlimited
+        :param engine: renderer of the built-in requests, "jinja2" (templates) or "direct" (serializers)
+        :param compact: True = send compact requests, without comments, indentation and empty optional elements
+        :param validation: ValidationPolicy or the name of its mode: "always", "sampled", "fast" or "off"
+        :param taxpayer_cache: [optional] TaxpayerCache of the answers of `query_taxpayer`. None = not cached
+        :param document_cache: [optional] DocumentCache of the issued invoices. None = not cached
+        :param hedge: [optional] HedgePolicy of the read-only calls. None = no hedging
+        :param timeout: [optional] Timeouts of the calls, or the total seconds of a call. None = deadline.Timeouts()
 
         response_version options:
             - 1: gives a simple text or PDF as answer.
@@ -37,12 +104,58 @@ class SzamlazzClient:
         self.password = password
         self.agent_key = agent_key
         self.response_version = response_version
+        self.retry = retry
+        self._retry_budget = retries.RetryBudget(retry.budget_ratio, retry.budget_reserve) if retry else None
+        self.throttle = throttle
+        if engine not in serializers.ENGINES:
+            raise ValueError(f"engine must be one of {serializers.ENGINES}, not {engine!r}")
+        self.engine = engine
+        self._fragments = serializers.Fragments()  # pre-rendered settings and merchant blocks of the "direct" engine
+        self.compact = compact
+        if isinstance(validation, str):
+            validation = validations.ValidationPolicy(mode=validation)
+        self.validation = validation
+        self._validator = validations.Validator(validation)
+        self.taxpayer_cache = taxpayer_cache
+        self.document_cache = document_cache
+        self.hedge = hedge
+        self.hedger = hedging.Hedger(hedge) if hedge else None
+        self.timeout: deadlines.Timeouts = deadlines.timeouts_of(timeout, deadlines.Timeouts())
 
         # authentication guards
         if all(v == "" for v in [self.username, self.password, self.agent_key]):
             raise AssertionError("A username/password combination OR the Agent Key (Számla Agent Kulcs) must be provided during initialisation")
         if all(v != "" for v in [self.username, self.password, self.agent_key]):
             raise AssertionError("Only one authentication method is allowed")
+        _clients.add(self)
+
+    def _after_fork(self):
+        """
+        Called in the child process of a fork (e.g. a pre-forked gunicorn or celery worker) for every client it inherited.
+        The connections of the parent must not be shared: the subclasses replace their connection pool here.
+        Another thread of the parent may have held a lock, or had a call in flight, when it forked: the locks of the
+        Throttle, the retry budget, the Hedger, the validator and the caches are renewed, and the Throttle forgets
+        the parent's calls in flight. What they have learnt (limits, latencies, cached answers) is kept, so are the
+        compiled templates and schemas, see szamlazz.prefork.warmup
+        """
+        if self.throttle is not None:
+            self.throttle._after_fork()
+        if self._retry_budget is not None:
+            self._retry_budget._after_fork()
+        if self.hedger is not None:
+            self.hedger._after_fork()
+        self._validator._after_fork()
+        if self.taxpayer_cache is not None:
+            self.taxpayer_cache._after_fork()
+        if self.document_cache is not None:
+            self.document_cache._after_fork()
+
+    @property
+    def validation_metrics(self) -> validations.ValidationMetrics:
+        """
+        Counters of the validations (and validation failures) of the client's requests, see szamlazz.validation
+        """
+        return self._validator.metrics
 
     @property
     def can_extract_pdf(self):
@@ -52,41 +165,52 @@ class SzamlazzClient:
                          header: Header,
                          merchant: Merchant,
                          buyer: Buyer,
-                         items: List[Item],
+                         items: Iterable[Item],
                          e_invoice: bool = True,
                          invoice_download: bool = True,
+                         external_id: str = "",
+                         pdf_sink: Optional[BinaryIO] = None,
+                         timeout: Union[None, float, deadlines.Timeouts] = None,
                          ) -> SzamlazzResponse:
         """
         https://docs.szamlazz.hu/#generating-invoices
+
+        `external_id` (<szamlaKulsoAzon>) identifies the invoice in your system and makes the call safe to re-send.
+        If a RetryPolicy is set and no `external_id` is given, a random one is generated.
+
+        `items` may be any iterable, e.g. a generator reading the items from a database. Invoices with more than
+        `streaming_items_threshold` items or with an unsized iterable are rendered, validated and uploaded in chunks
+        (see szamlazz.streaming), so memory use does not grow with the number of items.
         :param header: Header
         :param merchant: Merchant
         :param buyer: Buyer
-        :param items: List[Item]
+        :param items: Iterable[Item]
         :param e_invoice: bool (default=True)
         :param invoice_download: bool (default=True)
+        :param external_id: szamlaKulsoAzon
+        :param pdf_sink: [optional] binary file-like object. If set, the response is streamed and the PDF is written into it
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
-        settings = self.get_basic_settings()
-        settings["eszamla"] = e_invoice
-        settings["szamlaLetoltes"] = invoice_download
-        payload_xml = {
-            "header": header,
-            "merchant": merchant,
-            "buyer": buyer,
-            "items": items,
-            **settings,  # see SzamlazzClient.get_basic_settings() for details
-        }
-        r = self.request_maker(
+        if not external_id and self.retry is not None:
+            external_id = self._new_idempotency_key()
+        streamed = not isinstance(items, Sized) or len(items) > self.streaming_items_threshold
+        payload_xml = self._invoice_template_data(self.get_basic_settings(), header, merchant, buyer, items,
+                                                  e_invoice, invoice_download, external_id)
+        return self._call(
             action="action-xmlagentxmlfile",
             template=templates.generate_invoice,
             template_data=payload_xml,
             xsd_xml=xsd.generate_invoice,
+            idempotent=bool(external_id),
+            response_factory=self._document_factory(
+                partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/xmlszamlavalasz}"),
+                self._issued_pdf_key if invoice_download else None,
+            ),
+            pdf_sink=pdf_sink,
+            streamed=streamed,
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="{http://www.szamlazz.hu/xmlszamlavalasz}")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        logger.info(f"buyer_account_url = {response.buyer_account_url}")
-        return response
 
     def reverse_invoice(self,
                         header: Header,
@@ -95,6 +219,7 @@ class SzamlazzClient:
                         e_invoice: bool = True,
                         invoice_download: bool = True,  # True = Generated PDF will be returned
                         invoice_download_copy: int = 1,  # 1=PDF copy | 2=original
+                        timeout: Union[None, float, deadlines.Timeouts] = None,
                         ) -> SzamlazzResponse:
         """
         Reversing an invoice (storno)
@@ -110,6 +235,7 @@ class SzamlazzClient:
         :param e_invoice: True if E-Invoice
         :param invoice_download: True to retrieve the generated PDF
         :param invoice_download_copy: 1 = PDF copy | 2 = Original PDF
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         settings = self.get_basic_settings()
@@ -122,22 +248,20 @@ class SzamlazzClient:
             "buyer": buyer,
             **settings,  # see SzamlazzClient.get_basic_settings() for details
         }
-        r = self.request_maker(
+        return self._call(
             action="action-szamla_agent_st",
             template=templates.reverse_invoice,
             template_data=payload_xml,
             xsd_xml=xsd.reverse_invoice,
+            response_factory=partial(SzamlazzResponse, xml_namespace=""),
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        logger.info(f"buyer_account_url = {response.buyer_account_url}")
-        return response
 
     def register_credit_entry(self,
                               invoice_number: str,
                               disbursements: List[Disbursement],
                               additive: bool = False,
+                              timeout: Union[None, float, deadlines.Timeouts] = None,
                               ) -> SzamlazzResponse:
         """
         Registering a credit entry.
@@ -146,6 +270,7 @@ class SzamlazzClient:
         :param invoice_number: szamlaszam
         :param disbursements: List[Disbursement]
         :param additive: if it is True, then the former credit entries will be retained [default=False]
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         if len(disbursements) > 5:
@@ -158,20 +283,20 @@ class SzamlazzClient:
             "disbursements": disbursements,
             **settings,  # see SzamlazzClient.get_basic_settings() for details
         }
-        r = self.request_maker(
+        return self._call(
             action="action-szamla_agent_kifiz",
             template=templates.credit_entry,
             template_data=payload_xml,
             xsd_xml=xsd.credit_entry,
+            idempotent=not additive,  # a non-additive call replaces the credit entries of the invoice
+            response_factory=partial(SzamlazzResponse, xml_namespace=""),
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        logger.info(f"buyer_account_url = {response.buyer_account_url}")
-        return response
 
     def query_invoice_pdf(self,
                           invoice_number: str,
+                          pdf_sink: Optional[BinaryIO] = None,
+                          timeout: Union[None, float, deadlines.Timeouts] = None,
                           ) -> SzamlazzResponse:
         """
         There are two different types of the requested pdf:
@@ -182,26 +307,34 @@ class SzamlazzClient:
           * if it is 1 or not set, the response will be a PDF file
           * if it is 2, the response will be an XML file
 
+        Pass a `pdf_sink` (e.g. a file opened in "wb" mode) to stream the PDF into it in constant memory:
+            with open("invoice.pdf", "wb") as f:
+                response = client.query_invoice_pdf("E-DK-2021-15", pdf_sink=f)
+
         :param invoice_number: szamlaszam
+        :param pdf_sink: [optional] binary file-like object. If set, the response is streamed and the PDF is written into it
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         settings = self.get_basic_settings()
         settings["szamlaszam"] = invoice_number
-        r = self.request_maker(
+        return self._cached_call(
+            self._document_key("pdf", invoice_number),
             action="action-szamla_agent_pdf",
             template=templates.query_invoice_pdf,
             template_data=settings,
             xsd_xml=xsd.query_invoice_pdf,
+            response_factory=partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/xmlszamlavalasz}"),
+            pdf_sink=pdf_sink,
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="{http://www.szamlazz.hu/xmlszamlavalasz}")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        return response
 
     def query_invoice_xml(self,
                           invoice_number: str = "",
                           order_number: str = "",
                           pdf: bool = True,
+                          pdf_sink: Optional[BinaryIO] = None,
+                          timeout: Union[None, float, deadlines.Timeouts] = None,
                           ) -> SzamlazzResponse:
         """
         Order number can be used in the query. In this case the last receipt with this order number will be returned
@@ -209,6 +342,8 @@ class SzamlazzClient:
         :param invoice_number: szamlaszam
         :param order_number: rendelesSzam
         :param pdf: pdf
+        :param pdf_sink: [optional] binary file-like object. If set, the response is streamed and the PDF is written into it
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         if invoice_number == "" and order_number == "":
@@ -218,21 +353,21 @@ class SzamlazzClient:
         settings["szamlaszam"] = invoice_number
         settings["rendelesSzam"] = order_number
         settings["pdf"] = pdf
-        r = self.request_maker(
+        return self._cached_call(
+            self._document_key("xml", invoice_number, order_number, str(pdf)),
             action="action-szamla_agent_xml",
             template=templates.query_invoice_xml,
             template_data=settings,
-            xsd_xml=xsd.query_invoice_xml
-
+            xsd_xml=xsd.query_invoice_xml,
+            response_factory=partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/szamla}"),
+            pdf_sink=pdf_sink,
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="{http://www.szamlazz.hu/szamla}")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        return response
 
     def delete_pro_forma_invoice(self,
                                  invoice_number: str = "",
                                  order_number: str = "",
+                                 timeout: Union[None, float, deadlines.Timeouts] = None,
                                  ) -> SzamlazzResponse:
         """
         Order number can be used in the query. In this case the last receipt with this order number will be returned
@@ -241,6 +376,7 @@ class SzamlazzClient:
 
         :param invoice_number: szamlaszam - pro forma invoice's unique number
         :param order_number: rendelesszam - manually added to the pro forma invoice upon generation
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         if invoice_number == "" and order_number == "":
@@ -249,18 +385,16 @@ class SzamlazzClient:
         settings = self.get_basic_settings()
         settings["szamlaszam"] = invoice_number
         settings["rendelesszam"] = order_number
-        r = self.request_maker(
+        return self._call(
             action="action-szamla_agent_dijbekero_torlese",
             template=templates.delete_pro_forma_invoice,
             template_data=settings,
             xsd_xml=xsd.delete_pro_forma_invoice,
+            response_factory=partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/xmlszamladbkdelvalasz}"),
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="{http://www.szamlazz.hu/xmlszamladbkdelvalasz}")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        return response
 
-    def generate_receipt(self, payload: dict) -> Response:
+    def generate_receipt(self, payload: dict, timeout: Union[None, float, deadlines.Timeouts] = None) -> Response:
         """
         https://docs.szamlazz.hu/#generating-a-receipt
 
@@ -272,8 +406,10 @@ class SzamlazzClient:
         Note: You should use hivasAzonosito to make the call fault tolerant.
               If this field is in use, it needs to be unique, otherwise the API call will be unsuccessful.
               This ensures that if the same XML is posted multiple times, it will not duplicate an existing receipt.
+              If a RetryPolicy is set and hivasAzonosito is empty, a random one is generated.
 
         :payload: dict
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: requests.models.Response
         """
 
@@ -317,67 +453,71 @@ payload = {
 
 # pass payload to generate_receipt(payload=payload)
         """
+        fejlec = payload.get("fejlec", {})
+        if not fejlec.get("hivasAzonosito") and self.retry is not None:
+            payload = {**payload, "fejlec": {**fejlec, "hivasAzonosito": self._new_idempotency_key()}}
 
-        return self.request_maker(
+        return self._call(
             action="action-szamla_agent_nyugta_create",
             template=templates.generate_receipt,
             template_data=payload,
             xsd_xml=xsd.generate_receipt,
+            idempotent=bool(payload.get("fejlec", {}).get("hivasAzonosito")),
+            timeout=timeout,
         )
 
     def reverse_receipt(self,
                         receipt_number: str,
                         pdf_template: str = "",
+                        timeout: Union[None, float, deadlines.Timeouts] = None,
                         ) -> SzamlazzResponse:
         """
         https://docs.szamlazz.hu/#reversing-a-receipt-storno
         :param receipt_number: [string] <nyugtaszam>
         :param pdf_template: <pdfSablon>
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         settings = self.get_basic_settings()
         settings["nyugtaszam"] = receipt_number
         settings["pdfSablon"] = pdf_template
-        r = self.request_maker(
+        return self._call(
             action="action-szamla_agent_nyugta_storno",
             template=templates.reverse_receipt,
             template_data=settings,
             xsd_xml=xsd.reverse_receipt,
+            response_factory=partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/xmlnyugtavalasz}"),
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="{http://www.szamlazz.hu/xmlnyugtavalasz}")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        logger.info(f"buyer_account_url = {response.buyer_account_url}")
-        return response
 
     def query_receipt(self,
                       receipt_number: str,
                       pdf_template: str = "",
+                      timeout: Union[None, float, deadlines.Timeouts] = None,
                       ) -> SzamlazzResponse:
         """
         https://docs.szamlazz.hu/#querying-a-receipt
         :param receipt_number: [string] <nyugtaszam>
         :param pdf_template: <pdfSablon>
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         settings = self.get_basic_settings()
         settings["nyugtaszam"] = receipt_number
         settings["pdfSablon"] = pdf_template
-        r = self.request_maker(
+        return self._call(
             action="action-szamla_agent_nyugta_get",
             template=templates.query_receipt,
             template_data=settings,
             xsd_xml=xsd.query_receipt,
+            response_factory=partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/xmlnyugtavalasz}"),
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="{http://www.szamlazz.hu/xmlnyugtavalasz}")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        logger.info(f"buyer_account_url = {response.buyer_account_url}")
-        return response
 
     def send_receipt(self,
                      email_details: EmailDetails,
                      send_again_previous_email: bool = False,
+                     timeout: Union[None, float, deadlines.Timeouts] = None,
                      ) -> SzamlazzResponse:
         """
         https://docs.szamlazz.hu/#sending-a-receipt
@@ -388,6 +528,7 @@ payload = {
 
         :param email_details: [EmailDetails]
         :param send_again_previous_email: if True, the previous e-mail will be sent
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: SzamlazzResponse
         """
         settings = self.get_basic_settings()
@@ -396,19 +537,16 @@ payload = {
             "sendAgainPreviousEmail": send_again_previous_email,
             **settings,
         }
-        r = self.request_maker(
+        return self._call(
             action="action-szamla_agent_nyugta_send",
             template=templates.send_receipt,
             template_data=payload,
             xsd_xml=xsd.send_receipt,
+            response_factory=partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/xmlnyugtasendvalasz}"),
+            timeout=timeout,
         )
-        response = SzamlazzResponse(r, xml_namespace="{http://www.szamlazz.hu/xmlnyugtasendvalasz}")
-        logger.info(f"success = {response.http_request_success}")
-        logger.info(f"invoice_number = {response.invoice_number}")
-        logger.info(f"buyer_account_url = {response.buyer_account_url}")
-        return response
 
-    def query_taxpayer(self, vat_number: str):
+    def query_taxpayer(self, vat_number: str, timeout: Union[None, float, deadlines.Timeouts] = None):
         """
         This interface is used to query the validity of a VAT number. The data is from the Online Invoice Platform of NAV, the Hungarian National Tax and Customs Administration.
 
@@ -418,53 +556,43 @@ payload = {
 
         https://docs.szamlazz.hu/#querying-taxpayers
         :param vat_number: [str] VAT Number of the queried company. [0-9]{8} (e.g.: 13421739 that is 13421739-2-41 without VAT and Country codes)
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
         :return: Tuple[requests.models.Response, requests.models.Response.text]: (Response, returned XML string)
         """
+        cached = self._cached_taxpayer(vat_number)
+        if cached is not None:
+            return cached
+        return self._query_taxpayer(vat_number, timeout)
+
+    def _cached_taxpayer(self, vat_number: str) -> Optional[QueryTaxpayerResponse]:
+        if self.taxpayer_cache is None:
+            return None
+        return self.taxpayer_cache.lookup(vat_number, self._rebuild_response)
+
+    def _query_taxpayer(self, vat_number: str, timeout: Union[None, float, deadlines.Timeouts] = None):
         settings = self.get_basic_settings()
         payload = {
             "vat_number": vat_number,
             **settings,
         }
-        r = self.request_maker(
+        return self._call(
             action="action-szamla_agent_taxpayer",
             template=templates.tax_payer,
             template_data=payload,
             xsd_xml=xsd.tax_payer,
+            response_factory=partial(self._taxpayer_response, vat_number),
+            timeout=timeout,
         )
-        return QueryTaxpayerResponse(r)
+
+    def _taxpayer_response(self, vat_number: str, r) -> QueryTaxpayerResponse:
+        response = QueryTaxpayerResponse(r)
+        if self.taxpayer_cache is not None:
+            self.taxpayer_cache.store(vat_number, response)
+        return response
 
     def self_bill(self):
         raise NotImplementedError
 
-    def request_maker(self, action: str, template: str, template_data: dict, xsd_xml: str = "", payload_extra_attachments: dict = None) -> Response:
-        """
-        Custom, non-managed requests can be made against SzámlaAgent.
-        :param action: e.g.: action-xmlagentxmlfile
-        :param template: a Jinja2 compatible template XML string
-        :param template_data: (dict) Data injected into the Jinja2 compatible template XML template
-        :param xsd_xml: [optional] The XSD Scheme for XSD scheme compliance check
-        :param payload_extra_attachments: (dict) Extra data injected into the Jinja2 compatible template XML template
-        :return: requests.models.Response
-
-        Note: Use SzamlazzClient.get_basic_settings() as a skeleton while creating your own template_data. See `get_basic_settings` to learn what fields are available automatically
-        """
-        t = Template(template)
-        output = t.render(template_data)
-        logger.debug(f"request_maker / action: {action}")
-        logger.debug(f"request_maker / template: {template}")
-        logger.debug(f"request_maker / template_data: {template_data}")
-        logger.debug(f"request_maker / xsd_xml: {xsd_xml}")
-        logger.debug(f"request_maker / Rendered Template Output: {output}")
-
-        if xsd_xml != "":
-            ok, err = xsd.validate(xml=output, xsd=xsd_xml)
-            if not ok:
-                raise xsd.ValidationError(f"XML validation failed: " + err)
-
-        payload = {action: output}
-        payload.update(payload_extra_attachments) if payload_extra_attachments else None
-        return requests.post(self.url, files=payload)
-
     def get_basic_settings(self) -> dict:
         """
         get_basic_settings returns a dict containing the following key/value pairs:
@@ -486,3 +614,628 @@ payload = {
             "szamlaLetoltes": True,
             "valaszVerzio": self.response_version,
         }
+
+    @staticmethod
+    def _invoice_template_data(settings: dict,
+                               header: Header,
+                               merchant: Merchant,
+                               buyer: Buyer,
+                               items: List[Item],
+                               e_invoice: bool = True,
+                               invoice_download: bool = True,
+                               external_id: str = "",
+                               ) -> dict:
+        """
+        Template data of `templates.generate_invoice`. `settings` is the output of get_basic_settings()
+        """
+        settings = dict(settings)
+        settings["eszamla"] = e_invoice
+        settings["szamlaLetoltes"] = invoice_download
+        settings["szamlaKulsoAzon"] = external_id
+        return {
+            "header": header,
+            "merchant": merchant,
+            "buyer": buyer,
+            "items": items,
+            **settings,  # see SzamlazzClient.get_basic_settings() for details
+        }
+
+    @staticmethod
+    def _render(action: str, template: str, template_data: dict, xsd_xml: str = "", engine: str = "jinja2",
+                fragments: Optional[serializers.Fragments] = None, compact: bool = False,
+                validator: Optional[validations.Validator] = None, deadline: Optional[deadlines.Deadline] = None) -> bytes:
+        """
+        Renders `template` with `template_data` and validates the output against `xsd_xml` (if given)
+
+        The output is encoded once and parsed once: the validated tree is that of the returned bytes
+        (or, if `compact`, the returned bytes are serialised from the validated tree), which are uploaded as they are.
+        It is parsed strictly, like `_render_spooled` does: a document which is not well-formed is invalid.
+        :param engine: "direct" renders the built-in templates with szamlazz.serializers, custom ones with Jinja2 anyway
+        :param fragments: [optional] pre-rendered blocks of the "direct" engine, see serializers.Fragments
+        :param compact: True = the output is compacted with szamlazz.compact (pruned with `xsd_xml`)
+        :param validator: [optional] the ValidationPolicy to apply. None = always validate against `xsd_xml`
+        :param deadline: [optional] Deadline of the call, checked once rendered and once validated
+        :return: the rendered XML, UTF-8 encoded
+        """
+        if validator is not None:
+            validator.check(template_data)
+        if engine == "direct":
+            output = serializers.render(template, template_data, fragments)
+        else:
+            output = templates.render(template, template_data)
+        logger.debug(f"request_maker / action: {action}")
+        logger.debug(f"request_maker / template: {template}")
+        logger.debug(f"request_maker / template_data: {template_data}")
+        logger.debug(f"request_maker / xsd_xml: {xsd_xml}")
+        logger.debug(f"request_maker / Rendered Template Output: {output}")
+
+        document = output.encode("utf-8")
+        tree = None
+        if compact:
+            try:
+                tree = compaction.parse(document)
+            except etree.XMLSyntaxError as e:
+                raise xsd.ValidationError(f"XML validation failed: {e}")
+            if xsd_xml != "":
+                compaction.prune(tree, xsd_xml)
+            document = compaction.serialize(tree)
+        if deadline is not None:
+            deadline.check("render")
+
+        if xsd_xml != "" and (validator is None or validator.wants_schema(template)):
+            try:
+                ok, err = xsd.validate_tree(tree if tree is not None else xsd.parse(document, strict=True), xsd_xml)
+            except etree.XMLSyntaxError as e:
+                ok, err = False, str(e)
+            if validator is not None:
+                validator.schema_result(ok)
+            if not ok:
+                raise xsd.ValidationError(f"XML validation failed: " + err)
+            if deadline is not None:
+                deadline.check("validate")
+        return document
+
+    @staticmethod
+    def _render_spooled(action: str, template: str, template_data: dict, xsd_xml: str = "", engine: str = "jinja2",
+                        fragments: Optional[serializers.Fragments] = None, compact: bool = False,
+                        validator: Optional[validations.Validator] = None,
+                        deadline: Optional[deadlines.Deadline] = None) -> IO[bytes]:
+        """
+        `_render` in bounded memory: the output is generated in chunks, compacted (if `compact`, element by element,
+        see compact.compact_stream), validated incrementally and spooled
+        :return: the rendered XML in a spooled temporary file (see streaming.render_to_spool), to be closed by the caller
+        """
+        validate = xsd_xml != ""
+        if validator is not None:
+            template_data = validator.checked_items(template_data)
+            validate = validate and validator.wants_schema(template)
+        if engine == "direct":
+            chunks = serializers.generate(template, template_data, fragments)
+        else:
+            chunks = templates.generate(template, template_data)
+        logger.debug(f"request_maker / action: {action} (streamed)")
+        logger.debug(f"request_maker / template: {template}")
+        logger.debug(f"request_maker / xsd_xml: {xsd_xml}")
+        try:
+            spool = streaming.render_to_spool(chunks, xsd_xml, validate, compact)
+        except xsd.ValidationError:
+            if validator is not None and validate:
+                validator.schema_result(False)
+            raise
+        if validator is not None and validate:
+            validator.schema_result(True)
+        if deadline is not None and deadline.expired():
+            spool.close()
+            raise deadline.exceeded("render")  # rendered and validated at once
+        return spool
+
+    def _call(self, action: str, template: str, template_data: dict, xsd_xml: str,
+              response_factory: Optional[Callable[[Any], Any]] = None,
+              idempotent: Optional[bool] = None,
+              pdf_sink: Optional[BinaryIO] = None,
+              streamed: bool = False,
+              timeout: Union[None, float, deadlines.Timeouts] = None):
+        """
+        Sends a managed request and wraps the HTTP response with `response_factory` (see `_make_response`)
+        `idempotent` tells whether the request may be re-sent after a failure. None = only READ_ACTIONS
+        `pdf_sink` streams the response: its body is read with a _StreamedBody, passed to the factory as `streamed_body`
+        `streamed` streams the request: it is rendered with `_render_spooled` and uploaded as a streaming.MultipartBody
+        `timeout` overrides the client's timeout, see `_deadline`
+        """
+        raise NotImplementedError
+
+    def _deadline(self, timeout: Union[None, float, deadlines.Timeouts] = None) -> deadlines.Deadline:
+        """
+        Starts the Deadline of a call: `timeout` is a Timeouts, the total seconds of the call (with the connect and
+        read timeouts of the client) or None (the client's timeout)
+        """
+        return deadlines.Deadline(deadlines.timeouts_of(timeout, self.timeout))
+
+    @staticmethod
+    def _timeout_phase(error: BaseException) -> Optional[str]:
+        """
+        The phase (see deadline.PHASES) of a timeout error of the client's transport, None if `error` is not a timeout
+        """
+        return None
+
+    def _rebuild_response(self, status_code: int, content: Union[str, bytes], headers: Optional[dict] = None):
+        """
+        An HTTP response of the client's transport with a cached answer, see szamlazz.cache
+        """
+        raise NotImplementedError
+
+    def _document_key(self, *parts: str) -> Optional[str]:
+        """
+        Key of a document in the document_cache: invoice numbers are unique per account only. None = not cached
+        """
+        if self.document_cache is None:
+            return None
+        return "\0".join((self.agent_key or self.username, str(self.response_version), *parts))
+
+    def _issued_pdf_key(self, response: SzamlazzResponse) -> Optional[str]:
+        # a generate_invoice answer with the PDF is the query_invoice_pdf answer of the new invoice
+        return self._document_key("pdf", response.invoice_number) if response.invoice_number else None
+
+    def _cached_call(self, key: Optional[str], response_factory: Callable[..., Any], **call):
+        """
+        `_call` of an immutable document: answered from the document_cache if it holds `key`, stored in it otherwise
+        """
+        cached = self._cached_document(key, response_factory, call.get("pdf_sink"))
+        if cached is not None:
+            return cached
+        storing_factory = self._document_factory(response_factory, (lambda response: key) if key else None)
+        return self._call(response_factory=storing_factory, **call)
+
+    def _cached_document(self, key: Optional[str], response_factory: Callable[..., Any], pdf_sink: Optional[BinaryIO]):
+        if key is None:
+            return None
+        document = self.document_cache.get(key)
+        if document is None:
+            return None
+        r = self._rebuild_response(document.status_code, document.content, document.headers)
+        if pdf_sink is None:
+            return self._make_response(r, response_factory)
+        body = _StreamedBody(r.headers, pdf_sink)
+        body.feed(document.content)
+        body.close()
+        return self._make_response(r, partial(response_factory, streamed_body=body))
+
+    def _document_factory(self, response_factory: Callable[..., Any],
+                          key: Optional[Callable[[SzamlazzResponse], Optional[str]]]) -> Callable[..., Any]:
+        """
+        Wraps `response_factory`: the successful answers it makes are stored in the document_cache, under `key(answer)`.
+        Streamed answers (see `pdf_sink`) are not stored, their body is not kept
+        """
+        if self.document_cache is None or key is None:
+            return response_factory
+
+        def make(r, **kwargs) -> SzamlazzResponse:
+            response = response_factory(r, **kwargs)
+            if kwargs.get("streamed_body") is None and response.ok and not response.has_errors:
+                document_key = key(response)
+                if document_key is not None:
+                    headers = {name: value for name, value in r.headers.items()
+                               if name.lower() == "content-type" or name.lower().startswith("szlahu_")}
+                    self.document_cache.put(document_key, r.status_code, headers, r.content)
+            return response
+        return make
+
+    def _hedged(self, action: str, payload: Union[dict, streaming.MultipartBody]) -> bool:
+        # reads are hedged, unless they are uploaded from a spool: it cannot be read by two requests at once
+        return self.hedger is not None and action in retries.READ_ACTIONS and not isinstance(payload, streaming.MultipartBody)
+
+    @staticmethod
+    def _coalesced(action: str, document: Union[str, bytes, IO[bytes]], payload_extra_attachments: Optional[dict],
+                   stream: bool) -> bool:
+        # reads are coalesced by their rendered document. The body of a streamed response can be read only once
+        return (action in retries.READ_ACTIONS and not stream and not payload_extra_attachments
+                and isinstance(document, (str, bytes)))
+
+    @staticmethod
+    def _new_idempotency_key() -> str:
+        return uuid.uuid4().hex
+
+    def _should_retry(self, attempt: int, idempotent: bool, status_code: int = None, error_code: str = None,
+                      error: BaseException = None, connect_error: bool = False,
+                      deadline: Optional[deadlines.Deadline] = None, backoff: float = 0.0) -> bool:
+        """
+        Tells whether a failed attempt (an HTTP response or a transport `error`) is re-sent under the RetryPolicy.
+        `connect_error` = the request surely has not reached Számla Agent
+        `backoff` = the seconds to wait before the retry, which have to fit in the `deadline`
+        :raises deadline.DeadlineExceeded: if an `error` would be retried, but the deadline leaves no time for it
+        """
+        if self.retry is None or attempt >= self.retry.max_attempts:
+            return False
+        if error is not None:
+            retryable = connect_error or idempotent
+        else:
+            retryable = idempotent and self.retry.is_retryable_response(status_code, error_code)
+        if not retryable:
+            return False
+        reason = repr(error) if error is not None else f"HTTP {status_code}, szlahu_error_code={error_code}"
+        if deadline is not None and not deadline.allows(backoff):
+            logger.warning(f"attempt #{attempt} failed ({reason}), no time left to retry")
+            if error is not None:
+                raise deadline.exceeded(self._timeout_phase(error) or "retry") from error
+            return False
+        if not self._retry_budget.withdraw():
+            return False
+        logger.warning(f"attempt #{attempt} failed ({reason}), retrying")
+        return True
+
+    @staticmethod
+    def _make_response(r, response_factory: Optional[Callable[[Any], Any]] = None):
+        if response_factory is None:
+            return r
+        response = response_factory(r)
+        if isinstance(response, SzamlazzResponse) and logger.isEnabledFor(logging.INFO):
+            logger.info(f"success = {response.http_request_success}")
+            logger.info(f"invoice_number = {response.invoice_number}")
+            logger.info(f"buyer_account_url = {response.buyer_account_url}")
+        return response
+
+
+class SzamlazzClient(BaseSzamlazzClient):
+    def __init__(self,
+                 username: str = "",
+                 password: str = "",
+                 agent_key: str = "",
+                 response_version: int = 2,
+                 retry: Optional[retries.RetryPolicy] = None,
+                 throttle: Optional[throttles.Throttle] = None,
+                 engine: str = "jinja2",
+                 compact: bool = False,
+                 validation: Union[str, validations.ValidationPolicy] = "always",
+                 taxpayer_cache: Optional[caches.TaxpayerCache] = None,
+                 document_cache: Optional[caches.DocumentCache] = None,
+                 coalesce_reads: bool = True,
+                 hedge: Optional[hedging.HedgePolicy] = None,
+                 timeout: Union[None, float, deadlines.Timeouts] = None,
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 pool_block: bool = False,
+                 keep_alive_timeout: Optional[float] = 60.0,
+                 session: Optional[requests.Session] = None,
+                 adapter: Optional[HTTPAdapter] = None,
+                 ):
+        """
+        :param username: Számlázz.hu user
+        :param password: Számlázz.hu’s user password
+        :param agent_key: Számlázz.hu / Számla Agent Kulcs (key)
+        :param response_version: Text|PDF or XML+PDF answer.
+        :param retry: [optional] RetryPolicy of failed calls. None = no retries (see szamlazz.retry)
+        :param throttle: [optional] client-side rate and concurrency limits per action (see szamlazz.throttle)
+        :param engine: renderer of the built-in requests: "jinja2" (szamlazz.templates) or the faster,
+                       byte-identical "direct" (szamlazz.serializers)
+        :param compact: True = requests are sent without comments, indentation and empty optional elements
+                        (see szamlazz.compact). Smaller uploads, faster validation, the same invoices
+        :param validation: how requests are validated before they are sent, a ValidationPolicy or the name of its mode:
+                           "always" (XSD, the default), "sampled" (XSD, 1 in `sample_rate`), "fast" (type checks of
+                           the Header and Item fields) or "off". See szamlazz.validation and `validation_metrics`
+        :param taxpayer_cache: [optional] TaxpayerCache (see szamlazz.cache) answering repeated `query_taxpayer` calls
+                               from memory or from a local SQLite file. It may be shared by several clients
+        :param document_cache: [optional] DocumentCache (see szamlazz.cache) answering repeated `query_invoice_pdf` and
+                               `query_invoice_xml` calls from disk. The PDFs of `generate_invoice` are stored in it too
+        :param coalesce_reads: True = identical concurrent read-only requests (e.g. query_invoice_pdf of the same
+                               invoice) share a single call to Számla Agent and its response (see szamlazz.coalesce)
+        :param hedge: [optional] HedgePolicy (see szamlazz.hedge): a read-only call slower than the usual latency of its
+                      action is sent once more and the first response wins. The hedges run on a pool of threads
+        :param timeout: [optional] Timeouts (see szamlazz.deadline) of every call: connect, read and total time. A number
+                        is the total seconds of a call. None = Timeouts(): 10s to connect, 120s to read, no total limit.
+                        Each call may override it with its own `timeout`
+        :param pool_connections: Number of per-host connection pools to keep (see requests.adapters.HTTPAdapter)
+        :param pool_maxsize: Maximum number of keep-alive connections kept per host
+        :param pool_block: If True, callers wait for a free connection instead of opening a throwaway one above `pool_maxsize`
+        :param keep_alive_timeout: Seconds a pooled connection may stay idle before it is dropped. None = never
+        :param session: [optional] A preconfigured requests.Session. It is not closed by `close()`
+        :param adapter: [optional] A preconfigured HTTPAdapter mounted on https:// and http://. Overrides the pool_* arguments
+
+        response_version options:
+            - 1: gives a simple text or PDF as answer.
+            - 2: xml answer, in case you asked for the PDF as well, it will be included in the XML with base64 coding.
+
+        The client keeps its connections to Számla Agent alive between calls.
+        Call `close()` when you are done with it or use the client as a context manager:
+            with SzamlazzClient(agent_key="...") as client:
+                client.generate_invoice(...)
+        """
+        super().__init__(username=username, password=password, agent_key=agent_key, response_version=response_version,
+                         retry=retry, throttle=throttle, engine=engine, compact=compact, validation=validation,
+                         taxpayer_cache=taxpayer_cache, document_cache=document_cache, hedge=hedge, timeout=timeout)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.single_flight: Optional[coalesce.SingleFlight] = coalesce.SingleFlight() if coalesce_reads else None
+
+        # connection pooling
+        self.__owns_session = session is None
+        self.__session: requests.Session = session if session is not None else requests.Session()
+        if adapter is None and self.__owns_session:
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        if adapter is not None:
+            self.__session.mount("https://", adapter)
+            self.__session.mount("http://", adapter)
+        self.__session_lock = Lock()
+        self.__last_used: float = time.monotonic()
+        self.__closed = False
+        self.__hedge_pool_size = 2 * pool_maxsize  # a primary and a hedge per pooled connection
+        self.__hedge_executor = self.__new_hedge_executor()
+
+    def __new_hedge_executor(self) -> Optional[ThreadPoolExecutor]:
+        if self.hedger is None:
+            return None
+        return ThreadPoolExecutor(max_workers=self.__hedge_pool_size, thread_name_prefix="szamlazz-hedge")
+
+    def _after_fork(self):
+        super()._after_fork()
+        # fresh pool managers: the inherited ones, their connections and their locks (which another thread of the parent
+        # may have held when it forked) are left alone. Their sockets are closed in this process when they are collected
+        self.__session_lock = Lock()
+        if self.single_flight is not None:
+            self.single_flight = coalesce.SingleFlight()  # the calls in flight were the parent's
+        self.__hedge_executor = self.__new_hedge_executor()  # the threads of the parent do not exist here
+        for adapter in self.__session.adapters.values():
+            if isinstance(adapter, HTTPAdapter):
+                adapter.init_poolmanager(adapter._pool_connections, adapter._pool_maxsize, block=adapter._pool_block)
+                adapter.proxy_manager = {}
+        self.__last_used = time.monotonic()
+
+    def _rebuild_response(self, status_code: int, content: Union[str, bytes], headers: Optional[dict] = None) -> Response:
+        r = Response()
+        r.status_code = status_code
+        r.headers = CaseInsensitiveDict(headers or {})
+        r._content = content.encode("utf-8") if isinstance(content, str) else content
+        r.encoding = "utf-8"
+        r.url = self.url
+        return r
+
+    @staticmethod
+    def _timeout_phase(error: BaseException) -> Optional[str]:
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return "connect"
+        if isinstance(error, requests.exceptions.ReadTimeout):
+            return "read"
+        if isinstance(error, requests.ConnectionError) and error.args and isinstance(error.args[0], ReadTimeoutError):
+            return "read"  # raised while the body of a streamed response is read
+        return None
+
+    def __enter__(self) -> "SzamlazzClient":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Releases the pooled connections. An injected `session` is left open for its owner to close.
+        The client must not be used after it has been closed.
+        """
+        self.__closed = True
+        if self.__hedge_executor is not None:
+            self.__hedge_executor.shutdown(wait=False, cancel_futures=True)
+        if self.__owns_session:
+            self.__session.close()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The requests.Session holding the client's connection pool.
+        Pooled connections idle for longer than `keep_alive_timeout` are dropped before the session is handed out.
+        """
+        if self.__closed:
+            raise RuntimeError("SzamlazzClient has been closed")
+        with self.__session_lock:
+            now = time.monotonic()
+            if self.keep_alive_timeout is not None and now - self.__last_used > self.keep_alive_timeout:
+                logger.debug("keep-alive timeout expired, dropping idle pooled connections")
+                for adapter in self.__session.adapters.values():
+                    adapter.close()  # the pool manager reconnects on the next request
+            self.__last_used = now
+        return self.__session
+
+    def generate_invoices(self,
+                          jobs: Iterable[Union[InvoiceJob, tuple]],
+                          max_workers: int = 8,
+                          max_in_flight: Optional[int] = None,
+                          ordered: bool = False,
+                          render_processes: Optional[int] = None,
+                          timeout: Union[None, float, deadlines.Timeouts] = None,
+                          ) -> Iterator[BatchResult]:
+        """
+        Issues a batch of invoices concurrently over the client's connection pool.
+
+        Each job is an InvoiceJob or a plain (Header, Merchant, Buyer, items[, e_invoice[, invoice_download]]) tuple.
+        Jobs are rendered, validated and sent by `max_workers` threads, consuming `jobs` lazily.
+        A failing job (e.g.: xsd.ValidationError, connection error) is reported in BatchResult.error, the batch goes on.
+        Keep `pool_maxsize` >= `max_workers`, otherwise the extra connections are not kept alive.
+
+        With `render_processes` set, rendering and XSD validation (CPU-bound, GIL holding) run on a process pool
+        of that size (see batch.render_invoices) and the threads only upload the rendered documents.
+
+        for result in client.generate_invoices(jobs, max_workers=16):
+            if result.ok:
+                print(result.index, result.response.invoice_number)
+
+        :param jobs: Iterable[InvoiceJob]
+        :param max_workers: number of concurrent requests
+        :param max_in_flight: maximum number of jobs rendered/sent but not yet yielded [default=2 * max_workers]
+        :param ordered: True = yield results in input order, False = yield results as they complete
+        :param render_processes: [optional] number of worker processes rendering and validating the invoices
+        :param timeout: [optional] seconds or Timeouts of each invoice (see szamlazz.deadline). With `render_processes`,
+                        the deadline of an invoice starts once it is rendered. None = the client's timeout
+        :return: Iterator[BatchResult] with a SzamlazzResponse in BatchResult.response
+        """
+        def issue(job: InvoiceJob) -> SzamlazzResponse:
+            return self.generate_invoice(*job, timeout=timeout)
+
+        invoice_jobs = (job if isinstance(job, InvoiceJob) else InvoiceJob(*job) for job in jobs)
+        if self.retry is not None:
+            # set the idempotency keys here, so the render processes do not need to know about the RetryPolicy
+            invoice_jobs = (job if job.external_id else job._replace(external_id=self._new_idempotency_key())
+                            for job in invoice_jobs)
+        if not render_processes:
+            return batch.map_bounded(issue, invoice_jobs, max_workers=max_workers, max_in_flight=max_in_flight, ordered=ordered)
+
+        def upload(rendered: BatchResult) -> Optional[SzamlazzResponse]:
+            if rendered.error is not None:
+                return None  # passed through as it is, see below: the render stage has reported it already
+            r = self._post("action-xmlagentxmlfile", rendered.response, idempotent=bool(rendered.job.external_id),
+                           deadline=self._deadline(timeout))
+            return self._make_response(r, self._document_factory(
+                partial(SzamlazzResponse, xml_namespace="{http://www.szamlazz.hu/xmlszamlavalasz}"),
+                self._issued_pdf_key if rendered.job.invoice_download else None,
+            ))
+
+        rendered_jobs = batch.render_invoices(invoice_jobs, self.get_basic_settings(), processes=render_processes,
+                                              max_in_flight=max_in_flight, ordered=ordered, engine=self.engine,
+                                              compact=self.compact, validation=self.validation)
+        uploaded = batch.map_bounded(upload, rendered_jobs, max_workers=max_workers, max_in_flight=max_in_flight, ordered=ordered)
+        # map the results back to the original jobs
+        return (result.job if result.job.error is not None else result._replace(index=result.job.index, job=result.job.job)
+                for result in uploaded)
+
+    def request_maker(self, action: str, template: str, template_data: dict, xsd_xml: str = "", payload_extra_attachments: dict = None,
+                      timeout: Union[None, float, deadlines.Timeouts] = None) -> Response:
+        """
+        Custom, non-managed requests can be made against SzámlaAgent.
+        :param action: e.g.: action-xmlagentxmlfile
+        :param template: a Jinja2 compatible template XML string. Compiled templates are cached, see `templates.get_template`
+        :param template_data: (dict) Data injected into the Jinja2 compatible template XML template
+        :param xsd_xml: [optional] The XSD Scheme for XSD scheme compliance check
+        :param payload_extra_attachments: (dict) Extra data injected into the Jinja2 compatible template XML template
+        :param timeout: [optional] seconds or Timeouts of this call (see szamlazz.deadline). None = the client's timeout
+        :return: requests.models.Response
+
+        Note: Use SzamlazzClient.get_basic_settings() as a skeleton while creating your own template_data. See `get_basic_settings` to learn what fields are available automatically
+        """
+        deadline = self._deadline(timeout)
+        output = self._render(action, template, template_data, xsd_xml, self.engine, self._fragments, self.compact,
+                              self._validator, deadline)
+        return self._post(action, output, payload_extra_attachments, deadline=deadline)
+
+    def _post(self, action: str, document: Union[str, bytes, IO[bytes]], payload_extra_attachments: dict = None,
+              idempotent: Optional[bool] = None, stream: bool = False,
+              deadline: Optional[deadlines.Deadline] = None) -> Response:
+        """
+        Uploads an already rendered (and validated) XML document to Számla Agent, retrying as the RetryPolicy allows.
+        A spooled `document` (see `_render_spooled`) is uploaded in chunks, without extra attachments.
+        `stream` = the body of the returned response is not downloaded yet
+        `deadline` = the Deadline of the call. None = a new one, with the client's timeout
+        Identical concurrent reads share a single call, see `coalesce_reads`
+        :raises deadline.DeadlineExceeded: if the call times out
+        """
+        deadline = deadline if deadline is not None else self._deadline()
+        if self.single_flight is not None and self._coalesced(action, document, payload_extra_attachments, stream):
+            return self.single_flight.do((action, document),
+                                         partial(self.__post, action, document, None, idempotent, False, deadline),
+                                         timeout=deadline.remaining(), timeout_error=partial(deadline.exceeded, "read"))
+        return self.__post(action, document, payload_extra_attachments, idempotent, stream, deadline)
+
+    def __post(self, action: str, document: Union[str, bytes, IO[bytes]], payload_extra_attachments: Optional[dict],
+               idempotent: Optional[bool], stream: bool, deadline: deadlines.Deadline) -> Response:
+        if hasattr(document, "read"):
+            payload = streaming.MultipartBody(action, document)
+        else:
+            payload = {action: document}
+            payload.update(payload_extra_attachments) if payload_extra_attachments else None
+        try:
+            if self.retry is None:
+                return self.__attempt(action, payload, stream, deadline)
+            return self.__retrying(action, payload, idempotent, stream, deadline)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            phase = self._timeout_phase(e)
+            if phase is None:
+                raise
+            raise deadline.exceeded(phase) from e
+
+    def __retrying(self, action: str, payload: Union[dict, streaming.MultipartBody], idempotent: Optional[bool],
+                   stream: bool, deadline: deadlines.Deadline) -> Response:
+        idempotent = action in retries.READ_ACTIONS if idempotent is None else idempotent
+        self._retry_budget.deposit()
+        attempt = 1
+        while True:
+            backoff = self.retry.backoff(attempt)
+            try:
+                r = self.__attempt(action, payload, stream, deadline)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                connect_error = _is_connect_error(e)
+                if not self._should_retry(attempt, idempotent, error=e, connect_error=connect_error,
+                                          deadline=deadline, backoff=backoff):
+                    raise
+            else:
+                if not self._should_retry(attempt, idempotent, r.status_code, r.headers.get("szlahu_error_code"),
+                                          deadline=deadline, backoff=backoff):
+                    return r
+                r.close()
+            time.sleep(backoff)
+            attempt += 1
+
+    def __attempt(self, action: str, payload: Union[dict, streaming.MultipartBody], stream: bool,
+                  deadline: deadlines.Deadline) -> Response:
+        if not self._hedged(action, payload):
+            return self._send(action, payload, stream, deadline)
+        return self.hedger.send(action, partial(self._send, action, payload, stream, deadline), self.__hedge_executor,
+                                Response.close)
+
+    def _send(self, action: str, payload: Union[dict, streaming.MultipartBody], stream: bool = False,
+              deadline: Optional[deadlines.Deadline] = None) -> Response:
+        """
+        A single HTTP attempt, within the limits of the client's Throttle and of the `deadline`
+        """
+        deadline = deadline if deadline is not None else self._deadline()
+        deadline.check("connect")
+        if isinstance(payload, streaming.MultipartBody):
+            request = {"data": payload, "headers": {"Content-Type": payload.content_type}}
+        else:
+            request = {"files": payload}
+        if self.throttle is None:
+            return self.session.post(self.url, stream=stream, timeout=self.__timeouts(deadline), **request)
+        limiter = self.throttle.for_action(action)
+        ticket = limiter.acquire(deadline.remaining())
+        if ticket is None:
+            raise deadline.exceeded("throttle")
+        started = time.monotonic()
+        try:
+            r = self.session.post(self.url, stream=stream, timeout=self.__timeouts(deadline), **request)
+        except BaseException as e:  # the slot is handed back in any case, only transport errors are congestion
+            limiter.release(ticket, time.monotonic() - started, error=e)
+            raise
+        limiter.release(ticket, time.monotonic() - started, r.status_code, r.headers.get("szlahu_error_code"))
+        return r
+
+    @staticmethod
+    def __timeouts(deadline: deadlines.Deadline) -> tuple:
+        # (connect, read) timeouts of requests
+        return deadline.timeout("connect"), deadline.timeout("read")
+
+    def _call(self, action: str, template: str, template_data: dict, xsd_xml: str,
+              response_factory: Optional[Callable[[Any], Any]] = None,
+              idempotent: Optional[bool] = None,
+              pdf_sink: Optional[BinaryIO] = None,
+              streamed: bool = False,
+              timeout: Union[None, float, deadlines.Timeouts] = None):
+        deadline = self._deadline(timeout)
+        if streamed:
+            with self._render_spooled(action, template, template_data, xsd_xml, self.engine, self._fragments,
+                                      self.compact, self._validator, deadline) as output:
+                return self.__upload(action, output, response_factory, idempotent, pdf_sink, deadline)
+        output = self._render(action, template, template_data, xsd_xml, self.engine, self._fragments, self.compact,
+                              self._validator, deadline)
+        return self.__upload(action, output, response_factory, idempotent, pdf_sink, deadline)
+
+    def __upload(self, action: str, output: Union[str, IO[bytes]], response_factory: Optional[Callable[[Any], Any]],
+                 idempotent: Optional[bool], pdf_sink: Optional[BinaryIO], deadline: deadlines.Deadline):
+        if pdf_sink is None:
+            r = self._post(action, output, idempotent=idempotent, deadline=deadline)
+            return self._make_response(r, response_factory)
+
+        with self._post(action, output, idempotent=idempotent, stream=True, deadline=deadline) as r:
+            body = _StreamedBody(r.headers, pdf_sink)
+            try:
+                for chunk in r.iter_content(PDF_STREAM_CHUNK_SIZE):
+                    deadline.check("read")
+                    body.feed(chunk)
+            except requests.ConnectionError as e:
+                if self._timeout_phase(e) is None:
+                    raise
+                raise deadline.exceeded("read") from e
+            body.close()
+        return self._make_response(r, partial(response_factory, streamed_body=body))
@@ -0,0 +1,98 @@
+"""
+Request coalescing ("single flight"): concurrent identical calls share a single in-flight call and all of them get
+its result (or its exception). The clients coalesce the read-only actions (see retry.READ_ACTIONS), keyed by the
+action and the rendered request, so e.g. a burst of `query_invoice_pdf("E-XYZ-2024-1")` costs one round-trip.
+"""
+import asyncio
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+__all__ = ["SingleFlight", "AsyncSingleFlight", ]
+
+
+class _Flight:
+    def __init__(self):
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Thread-safe single flight of SzamlazzClient. `leaders` counts the calls made, `followers` the calls they answered
+    """
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self.__flights: Dict[Hashable, _Flight] = {}
+        self.__lock = Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None,
+           timeout_error: Callable[[], BaseException] = TimeoutError) -> Any:
+        """
+        Calls `fn()`, unless a call with the same `key` is in flight: then waits for it and returns its result
+        :param timeout: seconds to wait for a call in flight, then `timeout_error()` is raised. None = forever
+        :raises: the exception raised by the call
+        """
+        with self.__lock:
+            flight = self.__flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.__flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise timeout_error()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+            flight.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Single flight of AsyncSzamlazzClient, within an event loop. The call runs in a task of its own, so cancelling
+    the caller which started it does not cancel it for the others
+    """
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self.__flights: Dict[Hashable, "asyncio.Task"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None,
+                 timeout_error: Callable[[], BaseException] = TimeoutError) -> Any:
+        """
+        Awaits `fn()`, unless a call with the same `key` is in flight: then awaits that one
+        :param timeout: seconds to wait for a call in flight, then `timeout_error()` is raised. None = forever
+        :raises: the exception raised by the call
+        """
+        task = self.__flights.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = self.__flights[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self.__forget(key, done))
+            self.leaders += 1
+        else:
+            self.followers += 1
+            if timeout is not None:
+                done, _ = await asyncio.wait({task}, timeout=timeout)  # the call goes on for the others
+                if not done:
+                    raise timeout_error()
+        return await asyncio.shield(task)
+
+    def __forget(self, key: Hashable, task: "asyncio.Task"):
+        if self.__flights.get(key) is task:
+            del self.__flights[key]
+        if not task.cancelled():
+            task.exception()  # retrieved: every caller may have been cancelled meanwhile
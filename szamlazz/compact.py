@@ -0,0 +1,222 @@
+"""
+Compact rendering of the requests: comments and indentation are stripped and the empty optional elements
+(minOccurs="0" in the schema, e.g. <aggregator>, <fuvarlevel>, the blank fields of <tetelFokonyv>) are left out.
+The result stays valid against the schema it was pruned with. Enable it per client with `compact=True`.
+"""
+import io
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from lxml import etree
+
+from szamlazz import xsd
+
+
+__all__ = ["compact", "compact_stream", "parse", "prune", "serialize", ]
+
+_XS = "{http://www.w3.org/2001/XMLSchema}"
+_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+
+# complex type -> {child element's tag: (optional, complex type of the child or None)}
+_ContentModel = Dict[str, Dict[str, Tuple[bool, Optional[str]]]]
+
+
+@lru_cache(maxsize=xsd.CUSTOM_SCHEMA_CACHE_SIZE)
+def _content_model(xsd_xml: str) -> Tuple[Dict[str, Optional[str]], _ContentModel]:
+    """
+    Reads the element structure of a schema
+    :return: Tuple[complex type of the global elements (by tag), content model]
+    """
+    schema = etree.fromstring(xsd_xml.encode("utf-8"), xsd._new_parser())
+    tree = schema.getroottree()
+    namespace = schema.get("targetNamespace")
+    qualified = schema.get("elementFormDefault") == "qualified"
+
+    def tag(element: etree._Element, is_global: bool = False) -> str:
+        name = element.get("name")
+        return f"{{{namespace}}}{name}" if namespace and (qualified or is_global) else name
+
+    named = {node.get("name"): node for node in schema.iterfind(f"{_XS}complexType")}
+    model: _ContentModel = {}
+
+    def type_of(element: etree._Element) -> Optional[str]:
+        inline = element.find(f"{_XS}complexType")
+        if inline is not None:
+            return register(tree.getpath(inline), inline)
+        name = element.get("type", "").rpartition(":")[2]
+        return register(name, named[name]) if name in named else None  # None = simple type
+
+    def register(key: str, complex_type: etree._Element) -> str:
+        if key not in model:
+            model[key] = children = {}
+            for element in _child_elements(complex_type):
+                children[tag(element)] = (element.get("minOccurs") == "0", type_of(element))
+        return key
+
+    roots = {tag(element, is_global=True): type_of(element) for element in schema.iterfind(f"{_XS}element")}
+    return roots, model
+
+
+def _child_elements(node: etree._Element):
+    # the <element>s of a complex type, through its <sequence>/<all>/<choice> groups
+    for child in node:
+        if child.tag == f"{_XS}element":
+            yield child
+        elif child.tag in (f"{_XS}sequence", f"{_XS}all", f"{_XS}choice"):
+            yield from _child_elements(child)
+
+
+def _prune(element: etree._Element, complex_type: str, model: _ContentModel):
+    # depth first, so an optional element emptied by its pruned children goes too
+    children = model.get(complex_type, {})
+    empty = []
+    for child in element:
+        optional, child_type = children.get(child.tag, (False, None))
+        if child_type is not None:
+            _prune(child, child_type, model)
+        if optional and _is_empty(child):
+            empty.append(child)
+    for child in empty:
+        element.remove(child)
+
+
+def _is_empty(element: etree._Element) -> bool:
+    return not (element.text or "").strip() and not len(element) and not element.attrib
+
+
+def parse(xml: Union[str, bytes]) -> etree._Element:
+    """
+    Parses a rendered request without its comments and indentation
+    :raises etree.XMLSyntaxError: `xml` is not well-formed
+    """
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    return etree.fromstring(xml, etree.XMLParser(remove_comments=True, remove_blank_text=True))
+
+
+def prune(root: etree._Element, xsd_xml: str):
+    """
+    Removes the empty optional elements of a parsed request, in place
+    :param xsd_xml: the schema of the request
+    """
+    roots, model = _content_model(xsd_xml)
+    complex_type = roots.get(root.tag)
+    if complex_type is not None:
+        _prune(root, complex_type, model)
+
+
+def serialize(root: etree._Element) -> bytes:
+    """
+    :return: the UTF-8 encoded document, with an XML declaration
+    """
+    return _DECLARATION.encode("utf-8") + etree.tostring(root, encoding="utf-8")
+
+
+def compact(xml: Union[str, bytes], xsd_xml: str = "") -> str:
+    """
+    Strips the comments and the indentation of `xml` and, if its schema is given, prunes its empty optional elements
+    :param xml: a rendered request
+    :param xsd_xml: [optional] the schema of the request
+    :return: the compact XML
+    """
+    root = parse(xml)
+    if xsd_xml:
+        prune(root, xsd_xml)
+    return _DECLARATION + etree.tostring(root, encoding="unicode")
+
+
+def compact_stream(chunks: Iterable[bytes], xsd_xml: str = "") -> Iterator[bytes]:
+    """
+    `compact` of a document rendered in chunks (see szamlazz.streaming), in bounded memory: the grandchildren of
+    the root element (e.g. every <tetel> of <tetelek>) are compacted and written out one by one, once parsed.
+    Empty elements are written as <tag></tag>, the document is the same as that of `compact` otherwise.
+    :param chunks: the UTF-8 encoded document
+    :param xsd_xml: [optional] the schema of the request
+    :return: the UTF-8 encoded compact XML, in chunks
+    :raises etree.XMLSyntaxError: the document is not well-formed
+    """
+    roots, model = _content_model(xsd_xml) if xsd_xml else ({}, {})
+    parser = etree.XMLPullParser(events=("start", "end"), remove_comments=True, remove_blank_text=True)
+    output = io.BytesIO()
+    output.write(_DECLARATION.encode("utf-8"))
+    with etree.xmlfile(output, encoding="utf-8", buffered=False) as xf:
+        writer = _StreamWriter(xf, roots, model)
+        for data in chunks:
+            parser.feed(data)
+            for event, element in parser.read_events():
+                writer.on(event, element)
+            yield _drain(output)
+        parser.close()
+        for event, element in parser.read_events():
+            writer.on(event, element)
+    yield _drain(output)
+
+
+def _drain(output: io.BytesIO) -> bytes:
+    data = output.getvalue()
+    output.seek(0)
+    output.truncate()
+    return data
+
+
+class _StreamWriter:
+    """
+    The `compact_stream` of a parsed document. The root and its children are opened when their first child is
+    written, the deeper elements are written once parsed, with their own children, and dropped from the tree.
+    """
+    def __init__(self, xf, roots: Dict[str, Optional[str]], model: _ContentModel):
+        self.xf = xf
+        self.roots = roots
+        self.model = model
+        self.__path: List[Tuple[etree._Element, bool, Optional[str]]] = []  # (element, optional, complex type)
+        self.__opened: List = []  # element contexts of the opened part of __path
+        self.__parents: Set[etree._Element] = set()  # elements of __path with a child element
+
+    def on(self, event: str, element: etree._Element):
+        if event == "start":
+            if not self.__path:
+                self.__path.append((element, False, self.roots.get(element.tag)))
+            else:
+                parent, _, parent_type = self.__path[-1]
+                self.__parents.add(parent)
+                self.__path.append((element, *self.model.get(parent_type, {}).get(element.tag, (False, None))))
+            return
+        _, optional, complex_type = self.__path.pop()
+        if element in self.__parents:
+            self.__parents.discard(element)
+            if element.text is not None and not element.text.strip():
+                # indentation: the parser only drops the blank text it sees followed by a tag in the same chunk,
+                # and the text after a child which was written and removed is appended to the element's text
+                element.text = None
+        if len(self.__path) < len(self.__opened):  # an opened element is complete
+            self.__opened.pop().__exit__(None, None, None)
+        elif len(self.__path) <= 2:  # the root, one of its children or grandchildren, not opened: written as a whole
+            if complex_type is not None:
+                _prune(element, complex_type, self.model)
+            if not (optional and _is_empty(element)):
+                self.__open_path()
+                self.__write(element)
+        else:
+            return  # written with its ancestor
+        parent = element.getparent()
+        if parent is not None:
+            parent.remove(element)
+
+    def __open_path(self):
+        # opens the ancestors of the element to be written which are not open yet
+        for element, _, _ in self.__path[len(self.__opened):]:
+            parent = element.getparent()
+            inherited = parent.nsmap if parent is not None else {}
+            nsmap = {prefix: uri for prefix, uri in element.nsmap.items() if inherited.get(prefix) != uri}
+            context = self.xf.element(element.tag, dict(element.attrib), nsmap=nsmap or None)
+            context.__enter__()
+            self.__opened.append(context)
+
+    def __write(self, element: etree._Element):
+        with self.xf.element(element.tag, dict(element.attrib)):
+            if element.text:
+                self.xf.write(element.text)
+            for child in element:
+                self.__write(child)
+                if child.tail and child.tail.strip():
+                    self.xf.write(child.tail)
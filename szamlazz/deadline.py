@@ -0,0 +1,119 @@
+"""
+Timeouts of the client calls. Every call runs against a Deadline: its connect and read timeouts bound every network
+wait, and its `total` budget covers the whole call (rendering, validation, waiting for the Throttle, every attempt
+and the backoffs between the retries). The phase which blew the budget is reported by DeadlineExceeded:
+
+    client = SzamlazzClient(agent_key="...", timeout=Timeouts(connect=5, read=30, total=60))
+    try:
+        client.query_invoice_pdf("E-XYZ-2024-1", timeout=10)  # 10 seconds in total for this call
+    except DeadlineExceeded as e:
+        logger.warning(f"Számla Agent timed out ({e.phase})")
+"""
+import time
+from typing import NamedTuple, Optional, Union
+
+
+__all__ = ["Timeouts", "Deadline", "DeadlineExceeded", "PHASES", "timeouts_of", ]
+
+# phases of a call, as reported by DeadlineExceeded.phase
+PHASES = (
+    "render",  # rendering the request (incl. the checks of a "fast" ValidationPolicy)
+    "validate",  # XSD validation of the request
+    "throttle",  # waiting for the client's Throttle
+    "connect",  # connecting to Számla Agent, or waiting for a pooled connection
+    "read",  # uploading the request and reading the response
+    "retry",  # no time was left to retry a failed attempt
+)
+
+
+class Timeouts(NamedTuple):
+    """
+    Timeouts of SzamlazzClient / AsyncSzamlazzClient calls, in seconds. None = no limit
+    """
+    connect: Optional[float] = 10.0
+    read: Optional[float] = 120.0  # between two chunks of the upload or of the response, not for the whole response
+    total: Optional[float] = None  # of the whole call
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    A call ran out of time in `phase` (see PHASES). `timeout` is the limit which was hit, `elapsed` the seconds
+    since the call started. The transport's own timeout error, if any, is chained as __cause__
+    """
+    def __init__(self, phase: str, timeout: Optional[float], elapsed: float):
+        super().__init__(phase, timeout, elapsed)
+        self.phase = phase
+        self.timeout = timeout
+        self.elapsed = elapsed
+
+    def __str__(self) -> str:
+        return f"{self.phase} timed out after {self.elapsed:.3f}s (timeout: {self.timeout}s)"
+
+
+class Deadline:
+    """
+    The time budget of a single call, started when the call is made
+    """
+    def __init__(self, timeouts: Timeouts = Timeouts()):
+        self.timeouts = timeouts
+        self.started = time.monotonic()
+        self.expires = None if timeouts.total is None else self.started + timeouts.total
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> Optional[float]:
+        """
+        :return: seconds left of the total budget, None = unlimited
+        """
+        if self.expires is None:
+            return None
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def allows(self, seconds: float) -> bool:
+        """
+        True if `seconds` (e.g. a backoff) still fit in the budget
+        """
+        return self.expires is None or time.monotonic() + seconds < self.expires
+
+    def timeout(self, phase: str) -> Optional[float]:
+        """
+        :return: the "connect" or "read" timeout of the next network operation: the configured one, capped at
+                 the remaining budget
+        """
+        limit = getattr(self.timeouts, phase)
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        return remaining if limit is None else min(limit, remaining)
+
+    def check(self, phase: str):
+        """
+        :raises DeadlineExceeded: if the budget has run out, in `phase`
+        """
+        if self.expired():
+            raise self.exceeded(phase)
+
+    def exceeded(self, phase: str) -> DeadlineExceeded:
+        """
+        :return: the DeadlineExceeded of `phase`, to be raised by the caller
+        """
+        timeout = self.timeouts.total
+        if phase in ("connect", "read") and not self.expired():
+            timeout = getattr(self.timeouts, phase)
+        return DeadlineExceeded(phase, timeout, self.elapsed())
+
+
+def timeouts_of(timeout: Union[None, float, Timeouts], default: Timeouts) -> Timeouts:
+    """
+    Timeouts of a `timeout` argument: a Timeouts as it is, a number of seconds as the `total` of `default`,
+    None as `default`
+    """
+    if timeout is None:
+        return default
+    if isinstance(timeout, Timeouts):
+        return timeout
+    return default._replace(total=timeout)
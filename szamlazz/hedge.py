@@ -0,0 +1,205 @@
+"""
+Hedged requests: a read-only call (see retry.READ_ACTIONS) still running after the usual latency of its action is
+sent once more, the first response wins and the other call is cancelled. It cuts the tail latency of e.g.
+`query_invoice_pdf`, for a bounded amount of extra load.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional
+
+from szamlazz import retry as retries
+
+
+__all__ = ["HedgePolicy", "HedgeBudget", "LatencyTracker", "Hedger", ]
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy(NamedTuple):
+    """
+    Hedging settings of SzamlazzClient / AsyncSzamlazzClient.
+
+    A read-only call is sent once more if it has not completed within the `percentile`-th percentile of the latest
+    `window` latencies of its action (`initial_delay` until `min_samples` of them are known), but not earlier than
+    `min_delay`, and the HedgeBudget still allows it.
+    """
+    percentile: float = 95.0
+    min_delay: float = 0.05  # seconds
+    initial_delay: float = 1.0  # seconds
+    min_samples: int = 20
+    window: int = 500
+    budget_ratio: float = 0.05  # hedges may add at most this fraction of extra calls...
+    budget_reserve: float = 5.0  # ...plus a burst of this many hedges
+
+
+class HedgeBudget(retries.RetryBudget):
+    """
+    Caps the hedges to a fraction of the hedgeable calls. See retry.RetryBudget
+    """
+    def _exhausted(self):
+        logger.debug("hedge budget exhausted, not hedging")
+
+
+class LatencyTracker:
+    """
+    Thread-safe rolling window of the latencies of each action
+    """
+    def __init__(self, window: int = 500):
+        self.window = window
+        self.__latencies: Dict[str, Deque[float]] = {}
+        self.__lock = Lock()
+
+    def record(self, action: str, seconds: float):
+        with self.__lock:
+            latencies = self.__latencies.get(action)
+            if latencies is None:
+                latencies = self.__latencies[action] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def _after_fork(self):
+        self.__lock = Lock()
+
+    def percentile(self, action: str, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """
+        :return: the `percentile`-th percentile (nearest rank) of the latencies of `action`, None below `min_samples`
+        """
+        with self.__lock:
+            latencies = sorted(self.__latencies.get(action, ()))
+        if not latencies or len(latencies) < min_samples:
+            return None
+        return latencies[max(math.ceil(percentile / 100 * len(latencies)) - 1, 0)]
+
+
+class Hedger:
+    """
+    Applies a HedgePolicy to the attempts of a client: `send` for threads, `asend` for asyncio.
+    `hedged` counts the hedges sent, `won` the ones which answered first
+    """
+    def __init__(self, policy: HedgePolicy = HedgePolicy()):
+        if not 0 < policy.percentile <= 100:
+            raise ValueError("percentile must be in (0, 100]")
+        self.policy = policy
+        self.latencies = LatencyTracker(policy.window)
+        self.budget = HedgeBudget(policy.budget_ratio, policy.budget_reserve)
+        self.hedged = 0
+        self.won = 0
+        self.__lock = Lock()
+
+    def _after_fork(self):
+        # in the child of a fork: renews the locks, the latencies learnt by the parent and the counters are kept
+        self.__lock = Lock()
+        self.latencies._after_fork()
+        self.budget._after_fork()
+
+    def delay(self, action: str) -> float:
+        """
+        Seconds after which a call of `action` is hedged
+        """
+        latency = self.latencies.percentile(action, self.policy.percentile, self.policy.min_samples)
+        return max(self.policy.min_delay, self.policy.initial_delay if latency is None else latency)
+
+    def send(self, action: str, attempt: Callable[[], Any], executor: Executor,
+             discard: Callable[[Any], None] = lambda response: None) -> Any:
+        """
+        Runs `attempt()` on `executor`, hedged with a second one if it is late.
+        The first successful response is returned, `discard(response)` is called with the response of the other
+        attempt (a running attempt of a thread cannot be interrupted, it is discarded once it completes)
+        The hedge delay counts from the start of the first attempt: the time it is queued on a busy `executor` is
+        the client's own saturation, a hedge would only add to it
+        :raises: the exception of the first attempt, if both failed
+        """
+        self.budget.deposit()
+        started = Event()
+        primary = executor.submit(self.__timed, action, attempt, started)
+        primary.add_done_callback(lambda future: started.set())  # e.g. cancelled by the shutdown of the executor
+        started.wait()
+        done, _ = wait([primary], timeout=self.delay(action))
+        if done or not self.budget.withdraw():
+            return primary.result()
+        hedge = executor.submit(self.__timed, action, attempt)
+        self.__count_hedge()
+        pending = {primary, hedge}
+        errors: List[BaseException] = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f is not primary):
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                if future is hedge:
+                    self.__count_win()
+                for other in (primary, hedge):
+                    if other is not future:
+                        other.cancel()  # if it has not started yet
+                        other.add_done_callback(lambda f: self.__discard(f, discard))
+                return future.result()
+        raise errors[0]
+
+    async def asend(self, action: str, attempt: Callable[[], Awaitable[Any]],
+                    discard: Callable[[Any], Awaitable[None]] = None) -> Any:
+        """
+        `send` of a coroutine function. The attempt which lost is cancelled, or discarded if it has completed too
+        """
+        self.budget.deposit()
+        started = asyncio.Event()
+        tasks = [asyncio.ensure_future(self.__atimed(action, attempt, started))]
+        tasks[0].add_done_callback(lambda task: started.set())
+        try:
+            await started.wait()  # the delay counts from the start of the attempt, not from a busy event loop
+            done, _ = await asyncio.wait(tasks, timeout=self.delay(action))
+            if not done and self.budget.withdraw():
+                tasks.append(asyncio.ensure_future(self.__atimed(action, attempt)))
+                self.__count_hedge()
+            pending = set(tasks)
+            errors: List[BaseException] = []
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=tasks.index):
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    if task is not tasks[0]:
+                        self.__count_win()
+                    for other in done - {task}:
+                        if other.exception() is None and discard is not None:
+                            await discard(other.result())
+                    return task.result()
+            raise errors[0]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def __timed(self, action: str, attempt: Callable[[], Any], started: Optional[Event] = None) -> Any:
+        if started is not None:
+            started.set()
+        began = time.monotonic()
+        response = attempt()
+        self.latencies.record(action, time.monotonic() - began)
+        return response
+
+    async def __atimed(self, action: str, attempt: Callable[[], Awaitable[Any]],
+                       started: Optional[asyncio.Event] = None) -> Any:
+        if started is not None:
+            started.set()
+        began = time.monotonic()
+        response = await attempt()
+        self.latencies.record(action, time.monotonic() - began)
+        return response
+
+    @staticmethod
+    def __discard(future: Future, discard: Callable[[Any], None]):
+        if not future.cancelled() and future.exception() is None:
+            discard(future.result())
+
+    def __count_hedge(self):
+        with self.__lock:
+            self.hedged += 1
+
+    def __count_win(self):
+        with self.__lock:
+            self.won += 1
@@ -1,24 +1,35 @@
 import json
 import base64
 import logging
-import xmltodict
+from functools import cached_property
 from pathlib import Path
-from requests.models import Response
-from typing import NamedTuple, Tuple
+from typing import TYPE_CHECKING, Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple
 from urllib.parse import unquote
+from xml.parsers import expat
 # noinspection PyPep8Naming
 import xml.etree.ElementTree as ET
 
+if TYPE_CHECKING:  # requests is imported by the clients, on first use (see szamlazz/__init__.py)
+    from requests.models import Response
+
 
 __all__ = ["Header", "Merchant", "BuyerLedger", "Buyer", "ItemLedger", "Item", "Disbursement", "SzamlazzResponse",
-           "PdfDataMissingError", "EmailDetails", "QueryTaxpayerResponse", ]  # "WayBill"
+           "PdfDataMissingError", "EmailDetails", "QueryTaxpayerResponse", "InvoiceJob", "BatchResult", ]  # "WayBill"
 logger = logging.getLogger(__name__)
 
+PDF_STREAM_CHUNK_SIZE = 64 * 1024  # bytes read at once from a streamed response
+
 
 class PdfDataMissingError(Exception):
     pass
 
 
+def _response_ok(response) -> bool:
+    # requests.Response has `ok`, httpx.Response (see AsyncSzamlazzClient) has `is_error` instead
+    ok = getattr(response, "ok", None)
+    return (not response.is_error) if ok is None else ok
+
+
 class Header(NamedTuple):
     """<fejlec>"""
     creating_date: str = ""  # <keltDatum>2020-01-20</keltDatum>
@@ -142,64 +153,175 @@ class EmailDetails(NamedTuple):
     body_text: str = ""
 
 
+class InvoiceJob(NamedTuple):
+    """A single invoice of a SzamlazzClient.generate_invoices batch"""
+    header: Header
+    merchant: Merchant
+    buyer: Buyer
+    items: List[Item]
+    e_invoice: bool = True
+    invoice_download: bool = True
+    external_id: str = ""  # <szamlaKulsoAzon>
+
+
+class BatchResult(NamedTuple):
+    """Outcome of a single job of a batch. Exactly one of `response` and `error` is set"""
+    index: int  # position of the job in the input batch
+    job: Any
+    response: Any = None  # SzamlazzResponse for invoice batches
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class _StreamedBody:
+    """
+    Incremental reader of a streamed Számla Agent answer, fed chunk by chunk with `feed()`.
+    The PDF is decoded into `pdf_sink` as it arrives, so it is never held in memory as a whole:
+      * XML answer (Content-Type: application/octet-stream): the base64 <pdf> tag is decoded in 4-character blocks,
+        the text of the other top-level tags (e.g. <sikeres>) is kept in `tags` by their local name
+      * raw PDF answer: the body is copied as is
+    """
+    def __init__(self, headers, pdf_sink: BinaryIO):
+        self.pdf_sink = pdf_sink
+        self.pdf_size = 0
+        self.tags: Dict[str, str] = {}
+        self.__parser = None
+        if "application/octet-stream" in headers.get("Content-Type", ""):
+            self.__parser = expat.ParserCreate(namespace_separator="}")
+            self.__parser.StartElementHandler = self.__start
+            self.__parser.EndElementHandler = self.__end
+            self.__parser.CharacterDataHandler = self.__data
+            self.__depth = 0
+            self.__tag: Optional[str] = None  # top-level tag being read
+            self.__text: List[str] = []
+            self.__base64 = ""  # undecoded tail of <pdf>, shorter than 4 characters
+
+    def feed(self, chunk: bytes):
+        if self.__parser is None:
+            self.__write(chunk)
+        else:
+            self.__parser.Parse(chunk, False)
+
+    def close(self):
+        if self.__parser is not None:
+            self.__parser.Parse(b"", True)
+
+    def __write(self, data: bytes):
+        self.pdf_sink.write(data)
+        self.pdf_size += len(data)
+
+    def __start(self, name: str, attrs):
+        self.__depth += 1
+        if self.__depth == 2:
+            self.__tag = name.rpartition("}")[2]
+            self.__text = []
+
+    def __end(self, name: str):
+        if self.__depth == 2:
+            if self.__tag == "pdf":
+                if self.__base64:
+                    self.__write(base64.b64decode(self.__base64))
+                    self.__base64 = ""
+            else:
+                self.tags[self.__tag] = "".join(self.__text)
+            self.__tag = None
+        self.__depth -= 1
+
+    def __data(self, data: str):
+        if self.__depth != 2:
+            return
+        if self.__tag != "pdf":
+            self.__text.append(data)
+            return
+        data = self.__base64 + "".join(data.split())
+        usable = len(data) - len(data) % 4
+        if usable:
+            self.__write(base64.b64decode(data[:usable]))
+        self.__base64 = data[usable:]
+
+
+class _Header:
+    """
+    Attribute of SzamlazzResponse backed by a szlahu_* response header. It is decoded on first access and memoized
+    """
+    def __init__(self, header: str, unquoted: bool = False):
+        self.header = header
+        self.unquoted = unquoted
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.response.headers.get(self.header)
+        if value and self.unquoted:
+            value = unquote(value)
+        instance.__dict__[self.name] = value  # shadows the descriptor from now on
+        return value
+
+
 class SzamlazzResponse:
+    """
+    Answer of Számla Agent. Headers are decoded and the XML body is parsed lazily, on first access, then memoized:
+    checking `has_errors` and `invoice_number` does not touch the body at all.
+    """
+    # Error Handling
+    error_code: str = _Header("szlahu_error_code")
+    error_message: str = _Header("szlahu_error", unquoted=True)
+
+    # Extract Details
+    invoice_number: str = _Header("szlahu_szamlaszam")
+    invoice_net_price: str = _Header("szlahu_nettovegosszeg")
+    invoice_gross_price: str = _Header("szlahu_bruttovegosszeg")
+    receivables: str = _Header("szlahu_kintlevoseg")
+    buyer_account_url: str = _Header("szlahu_vevoifiokurl", unquoted=True)
+    payment_method: str = _Header("szlahu_fizetesmod")
+
     def __init__(self,
-                 response: Response,
+                 response: "Response",
                  xml_namespace: str,
+                 streamed_body: Optional[_StreamedBody] = None,
                  ):
+        """
+        :param response: HTTP response of Számla Agent
+        :param xml_namespace: XML namespace of the answer's tags, e.g.: {http://www.szamlazz.hu/xmlszamlavalasz}
+        :param streamed_body: [optional] the already consumed body of a streamed response, see `pdf_sink` of the client
+        """
         self.xml_namespace = xml_namespace
         self.__response = response
-        self.__action_success: bool = False
-        content_type = response.headers.get("Content-Type", "")
-        if "application/octet-stream" in content_type:
-            # Parse XML and map into class members
-            root = ET.fromstring(self.__response.text)
-            self.__pdf: str = self.__get_tag_text(root, "pdf")
-            self.__pdf_bytes: bytes = b""
-            self.__action_success: bool = True if (self.__get_tag_text(root, "sikeres") == "true") else False
-        else:
-            self.__pdf_bytes: bytes = response.content
-            self.__pdf: str = base64.b64encode(self.__pdf_bytes).decode("ascii")
-
-        # Error Handling
-        self.error_code: str = response.headers.get("szlahu_error_code")
-        self.error_message: str = response.headers.get("szlahu_error")
-        if self.error_message:
-            self.error_message = unquote(self.error_message)
-        self.http_request_success: str = "false" if self.error_code else "true"
-
-        # Extract Details
-        self.invoice_number: str = response.headers.get("szlahu_szamlaszam")
-        self.invoice_net_price: str = response.headers.get("szlahu_nettovegosszeg")
-        self.invoice_gross_price: str = response.headers.get("szlahu_bruttovegosszeg")
-        self.receivables: str = response.headers.get("szlahu_kintlevoseg")
-        self.buyer_account_url: str = response.headers.get("szlahu_vevoifiokurl")
-        if self.buyer_account_url:
-            self.buyer_account_url = unquote(response.headers.get("szlahu_vevoifiokurl"))
-        self.payment_method: str = response.headers.get("szlahu_fizetesmod")
-
-        self.__has_errors = self.error_code or self.error_message
+        self.__streamed_body = streamed_body
+        self.pdf_size: Optional[int] = None  # size of the PDF written to `pdf_sink`, streamed responses only
+        if streamed_body is not None:
+            self.pdf_size = streamed_body.pdf_size
         if self.has_errors:
             logger.error(f"Error Code: {self.error_code}")
             logger.error(f"Error Message: {self.error_message}")
 
+    @cached_property
+    def http_request_success(self) -> str:
+        return "false" if self.error_code else "true"
+
     @property
     def action_success(self) -> bool:
-        return self.__action_success
+        return self.__parsed_body[1]
 
     @property
     def has_errors(self):
-        return self.__has_errors
+        return self.error_code or self.error_message
 
     @property
     def ok(self):
         """
         Shortcut to the original response's attribute with the same name
         """
-        return self.__response.ok
+        return _response_ok(self.__response)
 
     @property
-    def response(self) -> Response:
+    def response(self) -> "Response":
         """
         Original HTTP Response object returned by the requests package
         :return: requests.models.Response
@@ -209,7 +331,7 @@ class SzamlazzResponse:
     @property
     def text(self) -> str:
         """
-        Shortcut to the original response's attribute with the same name
+        Shortcut to the original response's attribute with the same name. Not available for streamed responses
         """
         return self.__response.text
 
@@ -219,13 +341,26 @@ class SzamlazzResponse:
         :return: PDF (in Base64 format)
         :rtype: str
         """
-        if (not self.__pdf) and (not self.__pdf_bytes):
+        if self.__streamed_body is not None:
+            raise PdfDataMissingError("The PDF was streamed into pdf_sink, it is not kept in memory")
+        pdf = self.__pdf_base64
+        if not pdf:
             raise PdfDataMissingError("No PDF was returned. Check the value of szamlaLetoltes|invoice_download")
-        return self.__pdf
+        return pdf
 
     def get_pdf_bytes(self) -> bytes:
-        pdf_base64 = self.get_pdf_base64()
-        return base64.b64decode(pdf_base64) if pdf_base64 else self.__pdf_bytes
+        """
+        Get PDF from response as bytes. A raw PDF response (response_version=1) is returned without copying
+        """
+        if self.__is_raw_pdf and self.__response.content:
+            return self.__response.content
+        return base64.b64decode(self.get_pdf_base64())
+
+    def get_pdf_memoryview(self) -> memoryview:
+        """
+        Zero-copy, read-only view of the PDF, e.g. for slicing or writing it out in parts
+        """
+        return memoryview(self.get_pdf_bytes())
 
     def write_pdf_to_disk(self, pdf_output_path: Path):
         if not pdf_output_path.parent.exists():
@@ -244,16 +379,40 @@ class SzamlazzResponse:
             print("error_message:", self.error_message)
         return self.error_code, self.error_message
 
+    @cached_property
+    def __is_raw_pdf(self) -> bool:
+        # response_version=1 answers the PDF itself, response_version=2 an XML (Content-Type: application/octet-stream)
+        return (self.__streamed_body is None
+                and "application/octet-stream" not in self.__response.headers.get("Content-Type", ""))
+
+    @cached_property
+    def __parsed_body(self) -> Tuple[Optional[str], bool]:
+        # (<pdf>, <sikeres>) of an XML answer
+        if self.__streamed_body is not None:
+            return None, self.__streamed_body.tags.get("sikeres") == "true"
+        if self.__is_raw_pdf:
+            return None, False
+        root = ET.fromstring(self.__response.content)
+        return self.__get_tag_text(root, "pdf"), self.__get_tag_text(root, "sikeres") == "true"
+
+    @cached_property
+    def __pdf_base64(self) -> Optional[str]:
+        if self.__is_raw_pdf:
+            # the body is kept as is, its base64 form is only built on demand
+            return base64.b64encode(self.__response.content).decode("ascii") if self.__response.content else None
+        return self.__parsed_body[0]
+
     def __get_tag_text(self, root: ET.Element, tag_name):
         tag = root.find(f"{self.xml_namespace}{tag_name}")
         return tag.text if tag is not None else None
 
 
 class QueryTaxpayerResponse:
-    def __init__(self, response: Response):
+    def __init__(self, response: "Response"):
         self.__response = response
 
         # Parse XML
+        import xmltodict  # deferred, it is only needed by query_taxpayer
         self.__parsed_xml = xmltodict.parse(self.__response.text, encoding="utf-8", process_namespaces=False)
         logger.debug(json.dumps(self.__parsed_xml, indent=2, ensure_ascii=False))
 
@@ -279,10 +438,10 @@ class QueryTaxpayerResponse:
         """
         Shortcut to the original response's attribute with the same name
         """
-        return self.__response.ok
+        return _response_ok(self.__response)
 
     @property
-    def response(self) -> Response:
+    def response(self) -> "Response":
         """
         Original HTTP Response object returned by the requests package
         :return: requests.models.Response
@@ -0,0 +1,40 @@
+"""
+Support of pre-forking servers (gunicorn --preload, celery's prefork pool, multiprocessing's "fork" start method).
+
+`warmup()` in the parent compiles what every worker would otherwise compile on its first requests, so the workers
+share it copy-on-write instead of holding a copy each. After a fork, the child keeps the compiled templates and
+schemas, but not the connections of the clients it inherited: their connection pools are recreated in the child
+(see BaseSzamlazzClient._after_fork), so the processes never share a socket. Their locks and the Throttle's calls
+in flight are renewed too, so the parent does not have to be idle when it forks.
+"""
+import gc
+import logging
+
+from szamlazz import compact as compaction
+from szamlazz import serializers
+from szamlazz import templates
+from szamlazz import xsd
+
+
+__all__ = ["warmup", ]
+logger = logging.getLogger(__name__)
+
+
+def warmup(compact: bool = True, freeze: bool = False):
+    """
+    Compiles every built-in template of `szamlazz.templates` and every built-in schema of `szamlazz.xsd` into their
+    process-wide registries, and imports the clients' rendering engines.
+    Call it before the workers are forked, e.g. in the config module of gunicorn with --preload.
+    :param compact: also read the content models of the schemas, used by `compact=True` clients
+    :param freeze: gc.freeze() the objects of the process once warmed up, so the garbage collector of the children
+                   does not write to (and copy) the pages shared with the parent
+    """
+    for name in templates._builtin_names:
+        templates.get_template(name)
+        serializers.get_serializer(name)  # the tag tables of the "direct" engine are built on import
+        xsd.get_schema(name)
+        if compact:
+            compaction._content_model(getattr(xsd, name))
+    logger.debug(f"compiled {len(templates._builtin_names)} built-in templates and schemas")
+    if freeze:
+        gc.freeze()
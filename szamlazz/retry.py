@@ -0,0 +1,75 @@
+import logging
+import random
+from threading import Lock
+from typing import FrozenSet, NamedTuple
+
+
+__all__ = ["RetryPolicy", "RetryBudget", "READ_ACTIONS", ]
+logger = logging.getLogger(__name__)
+
+# Actions which only read data from Számla Agent, hence they are always safe to re-send
+READ_ACTIONS: FrozenSet[str] = frozenset({
+    "action-szamla_agent_pdf",
+    "action-szamla_agent_xml",
+    "action-szamla_agent_nyugta_get",
+    "action-szamla_agent_taxpayer",
+})
+
+
+class RetryPolicy(NamedTuple):
+    """
+    Retry settings of SzamlazzClient / AsyncSzamlazzClient.
+
+    A failed call is re-sent if
+      * the connection could not be established (any action), or
+      * the request is idempotent (see READ_ACTIONS and the idempotency keys set by the client) and
+        it failed on the network, returned one of `retry_statuses` or one of `retry_error_codes` in `szlahu_error_code`
+    and the client's RetryBudget still allows it.
+    """
+    max_attempts: int = 3  # including the first attempt
+    backoff_base: float = 0.5  # seconds, doubled on every attempt
+    backoff_max: float = 8.0  # seconds
+    retry_statuses: FrozenSet[int] = frozenset({429, 500, 502, 503, 504})
+    retry_error_codes: FrozenSet[str] = frozenset()  # szlahu_error_code values considered transient
+    budget_ratio: float = 0.2  # retries may add at most this fraction of extra calls...
+    budget_reserve: float = 10.0  # ...plus a burst of this many retries
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter before re-sending after the `attempt`-th (1-based) failed attempt
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def is_retryable_response(self, status_code: int, error_code: str = None) -> bool:
+        return status_code in self.retry_statuses or (error_code is not None and error_code in self.retry_error_codes)
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the regular traffic, so a partial outage is not amplified by the retries themselves.
+    Every call deposits `ratio` tokens (up to `reserve`), every retry withdraws one.
+    """
+    def __init__(self, ratio: float = 0.2, reserve: float = 10.0):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.__tokens = reserve
+        self.__lock = Lock()
+
+    def deposit(self):
+        with self.__lock:
+            self.__tokens = min(self.reserve, self.__tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.__lock:
+            if self.__tokens < 1:
+                self._exhausted()
+                return False
+            self.__tokens -= 1
+            return True
+
+    def _after_fork(self):
+        # in the child of a fork: the lock may have been held by another thread of the parent. The tokens are kept
+        self.__lock = Lock()
+
+    def _exhausted(self):
+        logger.warning("retry budget exhausted, not retrying")
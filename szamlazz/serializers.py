@@ -0,0 +1,708 @@
+"""
+Direct serializers of the built-in documents: the same XML as the templates of szamlazz.templates,
+byte for byte, but built with precomputed tag tables and a single str.join instead of Jinja2.
+
+The serializers mirror the Jinja2 semantics the templates rely on: `{{ obj.field }}` looks up an attribute,
+then an item; missing values render as ""; `| lower` lowercases the text form; `{% if %}` tests truthiness;
+the trailing newline of a template is not rendered.
+Select them per client with `engine="direct"` (see SzamlazzClient).
+
+The blocks that hardly ever change, the <beallitasok> settings of a client and the <elado> block of a Merchant,
+can be cached as pre-rendered fragments: pass a `Fragments` instance to `render` / `generate`. The Jinja2 engine
+does not use them, see benchmarks/bench_render.py for what a fragment saves.
+"""
+from operator import attrgetter, itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from jinja2.exceptions import UndefinedError
+
+from szamlazz import templates
+
+
+__all__ = ["ENGINES", "Fragments", "get_serializer", "render", "generate", ]
+
+# Rendering engines a client can be configured with
+ENGINES = ("jinja2", "direct")
+
+_UNDEFINED = object()  # a missing value, Jinja2's Undefined
+_STR_ATTRIBUTES = frozenset(dir(str))
+_DICT_ATTRIBUTES = frozenset(dir(dict))
+
+def _get(obj: Any, name: str) -> Any:
+    # `obj.name` of Jinja2: attribute first, then item
+    if obj is _UNDEFINED:
+        raise UndefinedError(f"undefined value has no attribute '{name}'")
+    if type(obj) is str and name not in _STR_ATTRIBUTES:
+        return _UNDEFINED  # e.g. the "" default of Buyer.buyer_ledger and Item.item_ledger
+    if type(obj) is dict and name not in _DICT_ATTRIBUTES:
+        return obj.get(name, _UNDEFINED)  # e.g. the items of generate_receipt's payload
+    try:
+        return getattr(obj, name)
+    except AttributeError:
+        pass
+    try:
+        return obj[name]
+    except (TypeError, LookupError, AttributeError):
+        return _UNDEFINED
+
+
+def _text(value: Any) -> str:
+    return "" if value is _UNDEFINED else str(value)
+
+
+def _lower(value: Any) -> str:
+    return _text(value).lower()
+
+
+def _truthy(value: Any) -> bool:
+    return value is not _UNDEFINED and bool(value)
+
+
+def _length(value: Any) -> int:
+    return 0 if value is _UNDEFINED else len(value)
+
+
+class _Elements:
+    """
+    A run of simple `<tag>{{ obj.field }}</tag>` elements, rendered with a single %-format (its %s is str(), like Jinja2).
+    The values are fetched with one attrgetter (or itemgetter) call, the Jinja2 lookup rules only apply if that fails.
+    """
+    def __init__(self, table: Iterable[Tuple[str, str, str]], lower: Iterable[str] = ()):
+        """
+        :param table: (opening markup, field, closing markup) of the elements
+        :param lower: fields rendered with `| lower`
+        """
+        table = tuple(table)
+        self.fields = tuple(field for _, field, _ in table)
+        self.lower = tuple(index for index, field in enumerate(self.fields) if field in lower)
+        attrs, items = attrgetter(*self.fields), itemgetter(*self.fields)
+        if len(self.fields) == 1:
+            self.__attrs, self.__items = (lambda obj: (attrs(obj), )), (lambda obj: (items(obj), ))
+        else:
+            self.__attrs, self.__items = attrs, items
+        # a mapping's items can only be read directly if none of the fields is shadowed by a dict attribute
+        self.__mapping_safe = not any(field in _DICT_ATTRIBUTES for field in self.fields)
+        self.__format = "".join(f"{_escape(opening)}%s{_escape(closing)}" for opening, _, closing in table)
+        # rendered from a str placeholder (e.g. the "" default of Item.item_ledger): every field is undefined
+        self.__placeholder = None
+        if not any(field in _STR_ATTRIBUTES for field in self.fields):
+            self.__placeholder = self.__format % (("", ) * len(self.fields))
+
+    def attrs(self, obj: Any) -> str:
+        """`{{ obj.field }}`: attribute first, then item"""
+        if type(obj) is str and self.__placeholder is not None:
+            return self.__placeholder
+        try:
+            if type(obj) is dict and self.__mapping_safe:
+                values = self.__items(obj)
+            else:
+                values = self.__attrs(obj)
+        except (AttributeError, LookupError):
+            values = tuple([_text(_get(obj, field)) for field in self.fields])
+        return self.render(values)
+
+    def keys(self, data: dict) -> str:
+        """`{{ field }}`: a variable of the template context"""
+        return self.render(self.key_values(data))
+
+    def key_values(self, data: dict) -> tuple:
+        """the values of `keys`"""
+        try:
+            return self.__items(data)
+        except LookupError:
+            return tuple([_text(data.get(field, _UNDEFINED)) for field in self.fields])
+
+    def render(self, values: tuple) -> str:
+        if self.lower:
+            values = list(values)
+            for index in self.lower:
+                values[index] = str(values[index]).lower()
+            values = tuple(values)
+        return self.__format % values
+
+
+def _escape(markup: str) -> str:
+    return markup.replace("%", "%%")
+
+
+class Fragments:
+    """
+    Pre-rendered fragments of the documents: the rendered output of an element run, keyed by its input.
+    Settings blocks are keyed by their values (credentials, flags), object blocks by the object, e.g. a Merchant.
+    A client keeps one (see SzamlazzClient), so its fragments are not shared with other clients.
+    Objects that are not hashable (e.g. a dict) are rendered every time.
+    """
+    def __init__(self, max_size: int = 256):
+        """
+        :param max_size: cached fragments, the oldest one is dropped above that
+        """
+        self.max_size = max_size
+        self.__fragments: Dict[tuple, str] = {}
+
+    def keys(self, elements: _Elements, data: dict) -> str:
+        """`elements.keys(data)`, cached by the values it renders"""
+        values = elements.key_values(data)
+        key = (elements, values)
+        try:
+            fragment = self.__fragments.get(key)
+        except TypeError:
+            return elements.render(values)
+        if fragment is None:
+            fragment = self.__store(key, elements.render(values))
+        return fragment
+
+    def attrs(self, elements: _Elements, obj: Any) -> str:
+        """`elements.attrs(obj)`, cached by `obj`. It has to be immutable, like the NamedTuples of szamlazz.models"""
+        key = (elements, type(obj), obj)
+        try:
+            fragment = self.__fragments.get(key)
+        except TypeError:
+            return elements.attrs(obj)
+        if fragment is None:
+            fragment = self.__store(key, elements.attrs(obj))
+        return fragment
+
+    def __len__(self) -> int:
+        return len(self.__fragments)
+
+    def clear(self):
+        self.__fragments.clear()
+
+    def __store(self, key: tuple, fragment: str) -> str:
+        if len(self.__fragments) >= self.max_size:
+            try:
+                del self.__fragments[next(iter(self.__fragments))]
+            except (KeyError, RuntimeError, StopIteration):  # evicted concurrently
+                pass
+        self.__fragments[key] = fragment
+        return fragment
+
+
+def _settings(elements: _Elements, data: dict, fragments: Optional[Fragments]) -> str:
+    # `elements.keys(data)` of a <beallitasok> block, from the client's fragments if any
+    return elements.keys(data) if fragments is None else fragments.keys(elements, data)
+
+
+def _object(elements: _Elements, obj: Any, fragments: Optional[Fragments]) -> str:
+    # `elements.attrs(obj)` of an invariant block (e.g. <elado>), from the client's fragments if any
+    return elements.attrs(obj) if fragments is None else fragments.attrs(elements, obj)
+
+
+def _lines(indent: str, table: Tuple[Tuple[str, str], ...], lower: Iterable[str] = ()) -> _Elements:
+    """
+    Consecutive `<tag>{{ field }}</tag>` lines indented with `indent`
+    :param table: (tag, field) pairs
+    """
+    return _Elements(((f"\n{indent}<{tag}>", field, f"</{tag}>") for tag, field in table), lower)
+
+
+_CREDENTIALS = (("felhasznalo", "felhasznalo"), ("jelszo", "jelszo"), ("szamlaagentkulcs", "szamlaagentkulcs"))
+
+
+# generate_invoice: <xmlszamla>
+_INVOICE_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<xmlszamla xmlns="http://www.szamlazz.hu/xmlszamla"\n'
+                 '           xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                 '           xsi:schemaLocation="http://www.szamlazz.hu/xmlszamla https://www.szamlazz.hu/szamla/docs/xsds/agent/xmlszamla.xsd">\n'
+                 '    <beallitasok>')
+_INVOICE_SETTINGS = _lines(" " * 8, (
+    *_CREDENTIALS,
+    ("eszamla", "eszamla"),
+    ("szamlaLetoltes", "szamlaLetoltes"),
+    ("valaszVerzio", "valaszVerzio"),
+), lower={"eszamla", "szamlaLetoltes"})
+_INVOICE_HEADER = _lines(" " * 8, (
+    ("keltDatum", "creating_date"),
+    ("teljesitesDatum", "payment_date"),
+    ("fizetesiHataridoDatum", "due_date"),
+    ("fizmod", "payment_type"),
+    ("penznem", "currency"),
+    ("szamlaNyelve", "invoice_language"),
+    ("megjegyzes", "invoice_comment"),
+    ("arfolyamBank", "name_of_bank"),
+    ("arfolyam", "exchange_rate"),
+    ("rendelesSzam", "order_number"),
+    ("dijbekeroSzamlaszam", "pro_forma_number_ref"),
+    ("elolegszamla", "deposit_invoice"),
+    ("vegszamla", "invoice_after_deposit_invoice"),
+    ("elolegSzamlaszam", "down_payment_invoice_number"),
+    ("helyesbitoszamla", "correction_invoice"),
+    ("helyesbitettSzamlaszam", "number_of_corrected_invoice"),
+    ("dijbekero", "proforma_invoice"),
+    ("szamlaszamElotag", "invoice_prefix"),
+), lower={"deposit_invoice", "invoice_after_deposit_invoice", "correction_invoice", "proforma_invoice"})
+_INVOICE_MERCHANT = _lines(" " * 8, (
+    ("bank", "bank_name"),
+    ("bankszamlaszam", "bank_account_number"),
+    ("emailReplyto", "reply_email_address"),
+    ("emailTargy", "email_subject"),
+    ("emailSzoveg", "email_text"),
+))
+_INVOICE_BUYER = _lines(" " * 8, (
+    ("nev", "name"),
+    ("orszag", "country"),
+    ("irsz", "zip_code"),
+    ("telepules", "city"),
+    ("cim", "address"),
+    ("email", "email"),
+    ("sendEmail", "send_email"),
+    ("adoalany", "tax_subject"),
+    ("adoszam", "tax_number"),
+    ("csoportazonosito", "group_id"),
+    ("adoszamEU", "tax_number_eu"),
+    ("postazasiNev", "delivery_name"),
+    ("postazasiOrszag", "delivery_country"),
+    ("postazasiIrsz", "delivery_zip"),
+    ("postazasiTelepules", "delivery_city"),
+    ("postazasiCim", "delivery_address"),
+), lower={"send_email"})
+_INVOICE_BUYER_TAIL = _lines(" " * 8, (
+    ("azonosito", "identification"),
+    ("alairoNeve", "signatory_name"),
+    ("telefonszam", "phone_number"),
+    ("megjegyzes", "comment"),
+))
+_INVOICE_ITEM = _lines(" " * 12, (
+    ("megnevezes", "name"),
+    ("mennyiseg", "quantity"),
+    ("mennyisegiEgyseg", "quantity_unit"),
+    ("nettoEgysegar", "unit_price"),
+    ("afakulcs", "vat_rate"),
+    ("nettoErtek", "net_price"),
+    ("afaErtek", "vat_amount"),
+    ("bruttoErtek", "gross_amount"),
+    ("megjegyzes", "comment_for_item"),
+))
+_INVOICE_ITEM_LEDGER = _lines(" " * 14, (
+    ("gazdasagiEsem", "economic_event"),
+    ("gazdasagiEsemAfa", "economic_event_tax"),
+    ("arbevetelFokonyviSzam", "sales_ledger_number"),
+    ("afaFokonyviSzam", "vat_ledger_number"),
+))
+
+
+def _optional(out: List[str], value: Any, indent: str, tag: str, trailing_indent: str, formatter=_text):
+    # `{% if value %}\n<indent><tag>{{ value }}</tag>\n<trailing_indent>{% endif %}` of the templates
+    if _truthy(value):
+        out.append(f"\n{indent}<{tag}>")
+        out.append(formatter(value))
+        out.append(f"</{tag}>\n{trailing_indent}")
+
+
+def _invoice_head(out: List[str], data: dict, fragments: Optional[Fragments]):
+    # everything of <xmlszamla> before its first <tetel>
+    out.append(_INVOICE_OPEN)
+    out.append(_settings(_INVOICE_SETTINGS, data, fragments))
+    out.append("\n        <aggregator>\n        </aggregator>")
+    external_id = data.get("szamlaKulsoAzon", _UNDEFINED)
+    if _truthy(external_id):
+        out.append("\n        <szamlaKulsoAzon>")
+        out.append(_text(external_id))
+        out.append("</szamlaKulsoAzon>")
+    out.append("\n    </beallitasok>\n    <fejlec>")
+    out.append(_INVOICE_HEADER.attrs(data.get("header", _UNDEFINED)))
+    out.append("\n    </fejlec>\n    <elado>")
+    out.append(_object(_INVOICE_MERCHANT, data.get("merchant", _UNDEFINED), fragments))
+    out.append("\n    </elado>\n    <vevo>")
+    buyer = data.get("buyer", _UNDEFINED)
+    out.append(_INVOICE_BUYER.attrs(buyer))
+    ledger = _get(buyer, "buyer_ledger")
+    out.append("\n        <vevoFokonyv>\n          ")
+    _optional(out, _get(ledger, "accounting_date"), " " * 12, "konyvelesDatum", " " * 10)
+    out.append("\n          <vevoAzonosito>")
+    out.append(_text(_get(ledger, "buyer_identifier")))
+    out.append("</vevoAzonosito>\n          <vevoFokonyviSzam>")
+    out.append(_text(_get(ledger, "buyer_ledger_number")))
+    out.append("</vevoFokonyviSzam>\n          ")
+    _optional(out, _get(ledger, "continuous_performance"), " " * 12, "folyamatosTelj", " " * 10, _lower)
+    out.append("\n          ")
+    _optional(out, _get(ledger, "settlement_date_from"), " " * 12, "elszDatumTol", " " * 10)
+    out.append("\n          ")
+    _optional(out, _get(ledger, "settlement_date_to"), " " * 12, "elszDatumIg", " " * 10)
+    out.append("\n        </vevoFokonyv>")
+    out.append(_INVOICE_BUYER_TAIL.attrs(buyer))
+    out.append("\n    </vevo>\n    <fuvarlevel>\n        <uticel> </uticel>\n        <futarSzolgalat> </futarSzolgalat>"
+               "\n    </fuvarlevel>\n    <tetelek>")
+
+
+def _invoice_item(out: List[str], item: Any):
+    out.append("\n        <tetel>")
+    out.append(_INVOICE_ITEM.attrs(item))
+    ledger = _get(item, "item_ledger")
+    if type(ledger) is str:
+        out.append(_INVOICE_ITEM_NO_LEDGER)
+        return
+    out.append("\n            <tetelFokonyv>")
+    out.append(_INVOICE_ITEM_LEDGER.attrs(ledger))
+    out.append("\n              ")
+    _optional(out, _get(ledger, "settlement_date_from"), " " * 16, "elszDatumTol", " " * 14)
+    out.append("\n              ")
+    _optional(out, _get(ledger, "settlement_date_to"), " " * 16, "elszDatumIg", " " * 14)
+    out.append("\n            </tetelFokonyv>\n        </tetel>\n    ")
+
+
+# <tetelFokonyv> of an item without an ItemLedger (the "" default of Item.item_ledger): every field is empty
+_INVOICE_ITEM_NO_LEDGER = ("\n            <tetelFokonyv>" + _INVOICE_ITEM_LEDGER.attrs("")
+                           + "\n              \n              \n            </tetelFokonyv>\n        </tetel>\n    ")
+_INVOICE_CLOSE = "</tetelek>\n</xmlszamla>"
+
+
+def generate_invoice(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = []
+    _invoice_head(out, data, fragments)
+    items = data.get("items", _UNDEFINED)
+    for item in (() if items is _UNDEFINED else items):
+        _invoice_item(out, item)
+    out.append(_INVOICE_CLOSE)
+    return "".join(out)
+
+
+def _generate_invoice(data: dict, fragments: Optional[Fragments] = None) -> Iterator[str]:
+    # generate_invoice, one <tetel> at a time
+    out = []
+    _invoice_head(out, data, fragments)
+    yield "".join(out)
+    items = data.get("items", _UNDEFINED)
+    for item in (() if items is _UNDEFINED else items):
+        out = []
+        _invoice_item(out, item)
+        yield "".join(out)
+    yield _INVOICE_CLOSE
+
+
+# reverse_invoice: <xmlszamlast>
+_REVERSE_INVOICE_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                         '<xmlszamlast xmlns="http://www.szamlazz.hu/xmlszamlast"\n'
+                         '             xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                         '             xsi:schemaLocation="http://www.szamlazz.hu/xmlszamlast https://www.szamlazz.hu/szamla/docs/xsds/agentst/xmlszamlast.xsd">\n'
+                         '    <beallitasok>')
+_REVERSE_INVOICE_SETTINGS = _lines(" " * 8, (
+    *_CREDENTIALS,
+    ("eszamla", "eszamla"),
+    ("szamlaLetoltes", "szamlaLetoltes"),
+    ("szamlaLetoltesPld", "szamlaLetoltesPld"),
+    ("valaszVerzio", "valaszVerzio"),
+), lower={"eszamla", "szamlaLetoltes"})
+_REVERSE_INVOICE_HEADER = _lines(" " * 8, (
+    ("szamlaszam", "invoice_number"),
+    ("keltDatum", "creating_date"),
+    ("teljesitesDatum", "payment_date"),
+))
+_REVERSE_INVOICE_MERCHANT = _lines(" " * 8, (
+    ("emailReplyto", "reply_email_address"),
+    ("emailTargy", "email_subject"),
+    ("emailSzoveg", "email_text"),
+))
+_REVERSE_INVOICE_BUYER = _lines(" " * 8, (
+    ("email", "email"),
+    ("adoszam", "tax_number"),
+    ("adoszamEU", "tax_number_eu"),
+))
+
+
+def reverse_invoice(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_REVERSE_INVOICE_OPEN]
+    out.append(_settings(_REVERSE_INVOICE_SETTINGS, data, fragments))
+    out.append("\n    </beallitasok>\n    <fejlec>")
+    header = data.get("header", _UNDEFINED)
+    out.append(_REVERSE_INVOICE_HEADER.attrs(header))
+    out.append("\n        <tipus>SS</tipus>\n        <szamlaSablon>")
+    out.append(_text(_get(header, "invoice_template")))
+    out.append("</szamlaSablon>  <!-- Codomain: 'SzlaMost' | 'SzlaAlap' | 'SzlaNoEnv' | 'Szla8cm' | 'SzlaTomb' | 'SzlaFuvarlevelesAlap' -->"
+               "\n    </fejlec>\n    <elado>")
+    out.append(_object(_REVERSE_INVOICE_MERCHANT, data.get("merchant", _UNDEFINED), fragments))
+    out.append("\n    </elado>\n    <vevo>")
+    out.append(_REVERSE_INVOICE_BUYER.attrs(data.get("buyer", _UNDEFINED)))
+    out.append("\n    </vevo>\n</xmlszamlast>")
+    return "".join(out)
+
+
+# credit_entry: <xmlszamlakifiz>
+_CREDIT_ENTRY_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<xmlszamlakifiz xmlns="http://www.szamlazz.hu/xmlszamlakifiz"\n'
+                      '                xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                      '                xsi:schemaLocation="http://www.szamlazz.hu/xmlszamlakifiz https://www.szamlazz.hu/szamla/docs/xsds/agentkifiz/xmlszamlakifiz.xsd">\n'
+                      '  <beallitasok> <!-- settings -->')
+_CREDIT_ENTRY_SETTINGS = _lines(" " * 4, (
+    *_CREDENTIALS,
+    ("szamlaszam", "szamlaszam"),
+    ("additiv", "additiv"),
+), lower={"additiv"})
+_CREDIT_ENTRY_DISBURSEMENT = _lines(" " * 4, (
+    ("datum", "date"),
+    ("jogcim", "title"),
+    ("osszeg", "amount"),
+    ("leiras", "description"),
+))
+
+
+def credit_entry(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_CREDIT_ENTRY_OPEN]
+    out.append(_settings(_CREDIT_ENTRY_SETTINGS, data, fragments))
+    out.append("\n  </beallitasok>")
+    disbursements = data.get("disbursements", _UNDEFINED)
+    for disbursement in (() if disbursements is _UNDEFINED else disbursements):
+        out.append("\n  <kifizetes>")
+        out.append(_CREDIT_ENTRY_DISBURSEMENT.attrs(disbursement))
+        out.append("\n  </kifizetes>\n  ")
+    out.append("</xmlszamlakifiz>")
+    return "".join(out)
+
+
+# query_invoice_pdf: <xmlszamlapdf>
+_QUERY_INVOICE_PDF_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                           '<xmlszamlapdf xmlns="http://www.szamlazz.hu/xmlszamlapdf"\n'
+                           '              xmlns:xsi="http://www.w3.org/2001/XMLSchemainstance"\n'
+                           '              >')
+_QUERY_INVOICE_PDF_FIELDS = _lines(" " * 2, (
+    *_CREDENTIALS,
+    ("szamlaszam", "szamlaszam"),
+    ("valaszVerzio", "valaszVerzio"),
+))
+
+
+def query_invoice_pdf(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_QUERY_INVOICE_PDF_OPEN]
+    out.append(_settings(_QUERY_INVOICE_PDF_FIELDS, data, fragments))
+    out.append("\n</xmlszamlapdf>")
+    return "".join(out)
+
+
+# query_invoice_xml: <xmlszamlaxml>
+_QUERY_INVOICE_XML_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                           '<xmlszamlaxml xmlns="http://www.szamlazz.hu/xmlszamlaxml"\n'
+                           '              xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                           '              xsi:schemaLocation="http://www.szamlazz.hu/xmlszamlaxml https://www.szamlazz.hu/szamla/docs/xsds/agentxml/xmlszamlaxml.xsd">')
+_QUERY_INVOICE_XML_CREDENTIALS = _lines(" " * 2, _CREDENTIALS)
+
+
+def query_invoice_xml(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_QUERY_INVOICE_XML_OPEN]
+    out.append(_settings(_QUERY_INVOICE_XML_CREDENTIALS, data, fragments))
+    out.append("\n  ")
+    order_number = data.get("rendelesSzam", _UNDEFINED)
+    if _length(order_number):
+        out.append("\n  <rendelesSzam>")
+        out.append(_text(order_number))
+        out.append("</rendelesSzam>\n  ")
+    else:
+        out.append("\n  <szamlaszam>")
+        out.append(_text(data.get("szamlaszam", _UNDEFINED)))
+        out.append("</szamlaszam>\n  ")
+    out.append("\n  <pdf>")
+    out.append(_lower(data.get("pdf", _UNDEFINED)))
+    out.append("</pdf>\n </xmlszamlaxml>")
+    return "".join(out)
+
+
+# delete_pro_forma_invoice: <xmlszamladbkdel>
+_DELETE_PRO_FORMA_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<xmlszamladbkdel xmlns="http://www.szamlazz.hu/xmlszamladbkdel"\n'
+                          '                 xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                          '                 xsi:schemaLocation="http://www.szamlazz.hu/xmlszamladbkdel http://www.szamlazz.hu/docs/xsds/szamladbkdel/xmlszamladbkdel.xsd">\n'
+                          '  <beallitasok>')
+_DELETE_PRO_FORMA_CREDENTIALS = _lines(" " * 4, _CREDENTIALS)
+
+
+def delete_pro_forma_invoice(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_DELETE_PRO_FORMA_OPEN]
+    out.append(_settings(_DELETE_PRO_FORMA_CREDENTIALS, data, fragments))
+    out.append("\n  </beallitasok>\n  <fejlec>\n    ")
+    order_number = data.get("rendelesszam", _UNDEFINED)
+    if _length(order_number):
+        out.append("\n    <rendelesszam>")
+        out.append(_text(order_number))
+        out.append("</rendelesszam>\n    ")
+    else:
+        out.append("\n    <szamlaszam>")
+        out.append(_text(data.get("szamlaszam", _UNDEFINED)))
+        out.append("</szamlaszam>\n    ")
+    out.append("\n  </fejlec>\n</xmlszamladbkdel>")
+    return "".join(out)
+
+
+# generate_receipt: <xmlnyugtacreate>
+_RECEIPT_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<xmlnyugtacreate xmlns="http://www.szamlazz.hu/xmlnyugtacreate" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.szamlazz.hu/xmlnyugtacreate http://www.szamlazz.hu/docs/xsds/nyugta/xmlnyugtacreate.xsd">\n'
+                 '  <beallitasok>                                                      <!-- REQ         -->')
+_RECEIPT_SETTINGS = _lines(" " * 4, (*_CREDENTIALS, ("pdfLetoltes", "pdfLetoltes")))
+# the receipt template documents its fields with trailing comments, they are part of the closing markup here
+_RECEIPT_HEADER = _Elements((f"\n    <{tag}>", tag, f"</{tag}>{comment}") for tag, comment in (
+    ("hivasAzonosito", "     <!--     string  --> <!-- unique identifier of the call, duplication must be avoided-->"),
+    ("elotag", "                    <!-- REQ string  --> <!-- receipt number prefix, required ==> NYGTA-2017-111 -->"),
+    ("fizmod", "               <!-- REQ string  --> <!-- payment method, free text field, values ​​used on the interface are: átutalás, készpénz, bankkártya, csekk, utánvét, ajándékutalvány, barion, barter, csoportos beszedés, OTP Simple, kompenzáció, kupon, PayPal,PayU, SZÉP kártya, utalvány -->"),
+    ("penznem", "                   <!-- REQ string  --> <!-- currency: Ft, HUF, EUR, USD stb. -->"),
+    ("devizabank", "         <!--     string  --> <!-- in case of foreign bill (not Ft/HUF) the name of the Bank -->"),
+    ("devizaarf", "                 <!--     string  --> <!-- exchange rate -->"),
+    ("megjegyzes", "             <!--     string  --> <!-- free text description,  shown on the receipt -->"),
+    ("pdfSablon", "                   <!--     string  --> <!--  in case of custom PDF template, the identifier of the used template-->"),
+    ("fokonyvVevo", "                      <!--     string  --> <!-- general ledger ID of the customer -->"),
+))
+_RECEIPT_ITEM = _Elements((f"\n      <{tag}>", tag, f"</{tag}>{comment}") for tag, comment in (
+    ("megnevezes", "         <!-- REQ string  --> <!-- name of the receipt -->"),
+    ("azonosito", "                                        <!--     string  --> <!-- ID of the receipt -->"),
+    ("mennyiseg", "                               <!-- REQ double  --> <!-- item quantity -->"),
+    ("mennyisegiEgyseg", "          <!-- REQ string  --> <!-- unit of quantity -->"),
+    ("nettoEgysegar", "                <!-- REQ double  --> <!-- net unit price -->"),
+    ("netto", "                                 <!-- REQ double  --> <!-- net value (quantity * net unit price) -->"),
+    ("afakulcs", "                                 <!-- REQ string  --> <!-- VAT rate, values: 0, 5, 10, 27, AAM, TAM, EU, EUK, MAA, F.AFA, K.AFA, ÁKK,HO, EUE, EUFADE, EUFAD37, ATK, NAM, EAM, KBAUK, KBAET -->"),
+    ("afa", "                                                <!-- REQ double  --> <!-- VAT total value -->"),
+    ("brutto", "                                      <!-- REQ double  --> <!-- gross total value -->"),
+))
+_RECEIPT_ITEM_LEDGER = _Elements((
+    ("\n        <arbevetel>", "fokonyv_arbevetel", "</arbevetel>                                   <!--     string  --> <!-- sales general ledger ID  -->"),
+    ("\n        <afa>", "fokonyv_afa", "</afa>                                                     <!--     string  --> <!-- VAT general ledger ID -->"),
+))
+_RECEIPT_PAYMENT = _lines(" " * 6, (
+    ("fizetoeszkoz", "fizetoeszkoz"),
+    ("osszeg", "osszeg"),
+    ("leiras", "leiras"),
+))
+
+
+def generate_receipt(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_RECEIPT_OPEN]
+    out.append(_settings(_RECEIPT_SETTINGS, data, fragments))
+    out.append("\n  </beallitasok>\n  <fejlec>                                                <!-- REQ         -->")
+    out.append(_RECEIPT_HEADER.attrs(data.get("fejlec", _UNDEFINED)))
+    out.append("\n  </fejlec>\n  <tetelek>")
+    items = data.get("tetelek", _UNDEFINED)
+    for item in (() if items is _UNDEFINED else items):
+        out.append("\n    <tetel>                                         <!-- REQ         --> <!-- at least one item is required to issue a receipt  -->")
+        out.append(_RECEIPT_ITEM.attrs(item))
+        out.append("\n      <fokonyv>                                                             <!--             --> <!-- general ledger information -->")
+        out.append(_RECEIPT_ITEM_LEDGER.attrs(item))
+        out.append("\n      </fokonyv>\n    </tetel>\n  ")
+    out.append("</tetelek>\n  <!--\n    The <kifizetesek> section (payments) is not mandatory, but if present,\n"
+               "    then the sum of the values should be equal with the total amount of the receipt.\n  -->\n  ")
+    payments = data.get("kifizetesek", _UNDEFINED)
+    if _length(payments):
+        out.append("\n  <kifizetesek>")
+        for payment in payments:
+            out.append("\n    <kifizetes>")
+            out.append(_RECEIPT_PAYMENT.attrs(payment))
+            out.append("\n    </kifizetes>\n  ")
+        out.append("</kifizetesek>\n  ")
+    out.append("\n</xmlnyugtacreate>")
+    return "".join(out)
+
+
+def _receipt_lookup(root: str, schema: str, settings_close: str) -> Callable[[dict], str]:
+    # reverse_receipt and query_receipt only differ in their root element
+    opening = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               f'<{root} xmlns="http://www.szamlazz.hu/{root}"\n'
+               f'{" " * (len(root) + 2)}xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+               f'{" " * (len(root) + 2)}xsi:schemaLocation="http://www.szamlazz.hu/{root} {schema}">\n'
+               '  <beallitasok>')
+    closing = f"\n  </fejlec>\n</{root}>"
+
+    def serialize(data: dict, fragments: Optional[Fragments] = None) -> str:
+        out = [opening]
+        out.append(_settings(_RECEIPT_SETTINGS, data, fragments))
+        out.append(settings_close)
+        out.append("\n  <fejlec>\n    <nyugtaszam>")
+        out.append(_text(data.get("nyugtaszam", _UNDEFINED)))
+        out.append("</nyugtaszam>\n    ")
+        pdf_template = data.get("pdfSablon", _UNDEFINED)
+        if _length(pdf_template):
+            out.append("\n    <pdfSablon>")
+            out.append(_text(pdf_template))
+            out.append("</pdfSablon>\n    ")
+        out.append(closing)
+        return "".join(out)
+    return serialize
+
+
+# reverse_receipt: <xmlnyugtast>, query_receipt: <xmlnyugtaget>
+reverse_receipt = _receipt_lookup("xmlnyugtast", "http://www.szamlazz.hu/docs/xsds/nyugtast/xmlnyugtast.xsd", "\n  </beallitasok> ")
+query_receipt = _receipt_lookup("xmlnyugtaget", "http://www.szamlazz.hu/docs/xsds/nyugtaget/xmlnyugtaget.xsd", "\n  </beallitasok>")
+
+
+# send_receipt: <xmlnyugtasend>
+_SEND_RECEIPT_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                      '<xmlnyugtasend xmlns="http://www.szamlazz.hu/xmlnyugtasend"\n'
+                      '               xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                      '               xsi:schemaLocation="http://www.szamlazz.hu/xmlnyugtasend http://www.szamlazz.hu/docs/xsds/nyugtasend/xmlnyugtasend.xsd">\n'
+                      '  <beallitasok>')
+_SEND_RECEIPT_CREDENTIALS = _lines(" " * 4, _CREDENTIALS)
+_SEND_RECEIPT_EMAIL = _lines(" " * 4, (
+    ("email", "addresses"),
+    ("emailReplyto", "reply_to_address"),
+    ("emailTargy", "subject"),
+    ("emailSzoveg", "body_text"),
+))
+
+
+def send_receipt(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_SEND_RECEIPT_OPEN]
+    out.append(_settings(_SEND_RECEIPT_CREDENTIALS, data, fragments))
+    out.append("\n  </beallitasok>\n  <fejlec>\n    <nyugtaszam>")
+    out.append(_text(data.get("nyugtaszam", _UNDEFINED)))
+    out.append("</nyugtaszam>\n  </fejlec>\n  ")
+    if _truthy(data.get("sendAgainPreviousEmail", _UNDEFINED)):
+        out.append("\n  <!-- e-mail details, if not defined, the previous e-mail will be sent  -->\n  <emailKuldes>")
+        out.append(_SEND_RECEIPT_EMAIL.attrs(data.get("email_details", _UNDEFINED)))
+        out.append("\n  </emailKuldes>\n  ")
+    out.append("\n</xmlnyugtasend>")
+    return "".join(out)
+
+
+# tax_payer: <xmltaxpayer>
+_TAX_PAYER_OPEN = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   '<xmltaxpayer xmlns="http://www.szamlazz.hu/xmltaxpayer"\n'
+                   '             xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"\n'
+                   '             xsi:schemaLocation="http://www.szamlazz.hu/xmltaxpayer http://www.szamlazz.hu/docs/xsds/agent/xmltaxpayer.xsd">\n'
+                   '    <beallitasok>')
+_TAX_PAYER_CREDENTIALS = _lines(" " * 8, _CREDENTIALS)
+
+
+def tax_payer(data: dict, fragments: Optional[Fragments] = None) -> str:
+    out = [_TAX_PAYER_OPEN]
+    out.append(_settings(_TAX_PAYER_CREDENTIALS, data, fragments))
+    out.append("\n    </beallitasok>\n    <torzsszam>")
+    out.append(_text(data.get("vat_number", _UNDEFINED)))
+    out.append("</torzsszam>\n</xmltaxpayer>")
+    return "".join(out)
+
+
+# built-in template name -> serializer
+_serializers: Dict[str, Callable[[dict, Optional[Fragments]], str]] = {name: globals()[name] for name in templates._builtin_names}
+# also keyed by the template sources, as the client refers to the built-in templates by their source
+_serializers.update({getattr(templates, name): serializer for name, serializer in list(_serializers.items())})
+
+
+def get_serializer(template: str) -> Optional[Callable[[dict, Optional[Fragments]], str]]:
+    """
+    Returns the direct serializer of a built-in template (given by its name or its source), None for other templates
+    """
+    return _serializers.get(template)
+
+
+# serializers yielding their document in pieces
+_generators: Dict[str, Callable[[dict, Optional[Fragments]], Iterator[str]]] = {
+    "generate_invoice": _generate_invoice,
+    templates.generate_invoice: _generate_invoice,
+}
+
+
+def render(template: str, template_data: dict, fragments: Optional[Fragments] = None) -> str:
+    """
+    Renders a built-in document with its direct serializer. Custom templates fall back to szamlazz.templates.render
+    :param fragments: [optional] cache of the pre-rendered settings and merchant blocks
+    """
+    serializer = _serializers.get(template)
+    if serializer is None:
+        return templates.render(template, template_data)
+    return serializer(template_data, fragments)
+
+
+def generate(template: str, template_data: dict, fragments: Optional[Fragments] = None) -> Iterator[str]:
+    """
+    Renders a document piece by piece, e.g. generate_invoice one item at a time. See `render`
+    """
+    generator = _generators.get(template)
+    if generator is not None:
+        return generator(template_data, fragments)
+    if template in _serializers:
+        return iter((_serializers[template](template_data, fragments), ))
+    return templates.generate(template, template_data)
@@ -0,0 +1,101 @@
+"""
+Bounded-memory rendering and uploading of very large requests, e.g. consolidated invoices with tens of thousands of items.
+
+The document is rendered piece by piece into a SpooledTemporaryFile (kept in memory up to SPOOL_MAX_SIZE bytes,
+then on disk) while it is validated (and compacted) incrementally, then it is uploaded from the spool as a streamed
+multipart body.
+"""
+import io
+import logging
+import uuid
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, IO, Iterable, Iterator
+
+from lxml import etree
+
+from szamlazz import compact as compaction
+from szamlazz import xsd
+
+
+__all__ = ["render_to_spool", "MultipartBody", ]
+logger = logging.getLogger(__name__)
+
+SPOOL_MAX_SIZE = 8 * 1024 * 1024  # rendered bytes kept in memory before the spool is moved to a temporary file
+CHUNK_SIZE = 64 * 1024  # bytes encoded, validated and uploaded at once
+
+
+def render_to_spool(chunks: Iterable[str], xsd_xml: str = "", validate: bool = True, compact: bool = False) -> IO[bytes]:
+    """
+    Writes the UTF-8 encoded `chunks` into a spooled temporary file, validating them against `xsd_xml` (if given)
+    :param validate: False = `xsd_xml` is only used to compact the document
+    :param compact: True = the document is compacted on the fly (see compact.compact_stream), then validated
+    :return: the spool, positioned at its end (its size). The caller has to close it
+    :raises xsd.ValidationError: the document is invalid, rendering stops at the first error
+    """
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    validator = xsd.IncrementalValidator(xsd_xml) if xsd_xml and validate else None
+    try:
+        encoded = (block.encode("utf-8") for block in _blocks(chunks))
+        for data in compaction.compact_stream(encoded, xsd_xml) if compact else encoded:
+            spool.write(data)
+            if validator is not None and not validator.feed(data):
+                break
+        if validator is not None:
+            ok, err = validator.close()
+            if not ok:
+                raise xsd.ValidationError(f"XML validation failed: " + err)
+    except etree.XMLSyntaxError as e:  # not well-formed, it could not be compacted
+        spool.close()
+        raise xsd.ValidationError(f"XML validation failed: {e}")
+    except BaseException:
+        spool.close()
+        raise
+    logger.debug(f"rendered {spool.tell()} bytes")
+    return spool
+
+
+def _blocks(chunks: Iterable[str]) -> Iterator[str]:
+    # joins the (often tiny) rendered pieces into blocks of about CHUNK_SIZE characters
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+class MultipartBody:
+    """
+    multipart/form-data body with a single file field read from `file` in chunks. It is the same body as
+    `requests.post(files={name: data})` would send, but its content is never held in memory as a whole.
+    It can be iterated (or async iterated with `aiter()`) any number of times, e.g. to retry the upload.
+    """
+    def __init__(self, name: str, file: IO[bytes]):
+        self.file = file
+        self.size = file.seek(0, io.SEEK_END)
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.__head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}"\r\n\r\n'
+                       .encode("utf-8"))
+        self.__tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.__head) + self.size + len(self.__tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        self.file.seek(0)
+        yield self.__head
+        while True:
+            data = self.file.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+        yield self.__tail
+
+    async def aiter(self) -> AsyncIterator[bytes]:
+        # reads the spool synchronously: it is in memory up to SPOOL_MAX_SIZE, a local file above
+        for data in self:
+            yield data
@@ -1,5 +1,52 @@
+from functools import lru_cache
+from typing import Dict, Iterator
+
+from jinja2 import Environment, Template
+
+
 __all__ = ["generate_invoice", "reverse_invoice", "credit_entry", "query_invoice_pdf", ]
 
+# Size of the LRU cache holding compiled custom (non built-in) templates
+CUSTOM_TEMPLATE_CACHE_SIZE = 64
+
+# Same defaults as a bare jinja2.Template(source), so the rendered output does not change
+environment = Environment()
+_compiled_builtins: Dict[str, Template] = {}
+_compile_custom = lru_cache(maxsize=CUSTOM_TEMPLATE_CACHE_SIZE)(environment.from_string)
+
+
+def get_template(template: str) -> Template:
+    """
+    Returns the compiled jinja2.Template for a template source string or for the name of a built-in template.
+
+    Built-in templates of this module are compiled once and kept for the lifetime of the process.
+    Any other template source goes through a bounded LRU cache (see CUSTOM_TEMPLATE_CACHE_SIZE).
+    :param template: Jinja2 template source or a built-in template's name (e.g.: "generate_invoice")
+    :return: jinja2.Template
+    """
+    compiled = _compiled_builtins.get(template)
+    if compiled is None:
+        source = _builtin_sources.get(template)
+        if source is None:
+            return _compile_custom(template)
+        compiled = _compiled_builtins.get(source) or environment.from_string(source)
+        _compiled_builtins[source] = _compiled_builtins[template] = compiled
+    return compiled
+
+
+def render(template: str, template_data: dict) -> str:
+    """
+    Renders a template source string (or the name of a built-in template) through the compiled template cache
+    """
+    return get_template(template).render(template_data)
+
+
+def generate(template: str, template_data: dict) -> Iterator[str]:
+    """
+    Renders a template piece by piece (see jinja2.Template.generate), for documents too large to build at once
+    """
+    return get_template(template).generate(template_data)
+
 
 # language=XML
 generate_invoice: str = """<?xml version="1.0" encoding="UTF-8"?>
@@ -15,6 +62,9 @@ generate_invoice: str = """<?xml version="1.0" encoding="UTF-8"?>
         <valaszVerzio>{{ valaszVerzio }}</valaszVerzio>
         <aggregator>
         </aggregator>
+        {%- if szamlaKulsoAzon %}
+        <szamlaKulsoAzon>{{ szamlaKulsoAzon }}</szamlaKulsoAzon>
+        {%- endif %}
     </beallitasok>
     <fejlec>
         <keltDatum>{{ header.creating_date }}</keltDatum>
@@ -356,3 +406,13 @@ tax_payer = """<?xml version="1.0" encoding="UTF-8"?>
     </beallitasok>
     <torzsszam>{{ vat_number }}</torzsszam>
 </xmltaxpayer>"""
+
+
+_builtin_names = ("generate_invoice", "reverse_invoice", "credit_entry", "query_invoice_pdf", "query_invoice_xml",
+                  "delete_pro_forma_invoice", "generate_receipt", "reverse_receipt", "query_receipt", "send_receipt",
+                  "tax_payer", )
+# maps both the names and the sources of the built-in templates to their source
+_builtin_sources: Dict[str, str] = {
+    **{name: globals()[name] for name in _builtin_names},
+    **{globals()[name]: globals()[name] for name in _builtin_names},
+}
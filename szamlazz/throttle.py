@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import sys
+import time
+from threading import Condition, Lock
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from szamlazz import deadline as deadlines
+
+
+__all__ = ["ActionLimits", "Throttle", "TokenBucket", "AdaptiveConcurrencyLimit", ]
+logger = logging.getLogger(__name__)
+
+
+class ActionLimits(NamedTuple):
+    """
+    Traffic shaping settings of a Számla Agent action (e.g.: action-xmlagentxmlfile).
+
+    Calls are started at most at `rate` per second (with bursts of `burst`) and at most `concurrency` calls run at once.
+    The concurrency limit is adaptive (AIMD): it grows by ~1 for every `concurrency` successful calls and
+    is multiplied by `decrease_factor` when Számla Agent shows signs of congestion:
+      * a transport error (timeout, connection reset...) or a DeadlineExceeded,
+      * an HTTP status in `congestion_statuses` or a `szlahu_error_code` in `congestion_error_codes`,
+      * a latency above `latency_spike_ratio` times the moving average latency.
+    """
+    rate: Optional[float] = None  # calls per second, None = unlimited
+    burst: int = 1
+    initial_concurrency: int = 8
+    min_concurrency: int = 1
+    max_concurrency: int = 64
+    decrease_factor: float = 0.5
+    latency_spike_ratio: Optional[float] = 3.0  # None = latency is not a congestion signal
+    congestion_statuses: FrozenSet[int] = frozenset({429, 500, 502, 503, 504})
+    congestion_error_codes: FrozenSet[str] = frozenset()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. `reserve()` takes a token and tells how long the caller has to wait before using it
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.__tokens = float(self.burst)
+        self.__updated = time.monotonic()
+        self.__lock = Lock()
+
+    def reserve(self) -> float:
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            self.__tokens -= 1
+            return 0.0 if self.__tokens >= 0 else -self.__tokens / self.rate
+
+    def refund(self):
+        """
+        Gives back the token of a `reserve()` which has not been used
+        """
+        with self.__lock:
+            self.__tokens = min(self.burst, self.__tokens + 1)
+
+    def _after_fork(self):
+        self.__lock = Lock()
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD concurrency limit. `try_acquire()` returns a ticket (or None if the limit is reached),
+    which has to be handed back to `release()` together with the outcome of the call.
+    """
+    _LATENCY_SMOOTHING = 0.1
+    _LATENCY_WARMUP = 10  # calls before latency spikes are detected
+
+    def __init__(self, limits: ActionLimits):
+        self.limits = limits
+        self.__limit = float(limits.initial_concurrency)
+        self.__in_flight = 0
+        self.__epoch = 0  # incremented on every decrease, so a congestion episode only shrinks the limit once
+        self.__latency: Optional[float] = None
+        self.__samples = 0
+        self.__condition = Condition(Lock())
+        self.__waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []  # of acquire_async, woken by release
+
+    @property
+    def limit(self) -> int:
+        return int(self.__limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self.__in_flight
+
+    def _after_fork(self):
+        # in the child of a fork: the calls in flight (and the event loops waiting for a slot) were the parent's,
+        # their tickets are never released here. The learnt limit and latency are kept
+        self.__condition = Condition(Lock())
+        self.__in_flight = 0
+        self.__waiters = []
+
+    def try_acquire(self) -> Optional[int]:
+        with self.__condition:
+            if self.__in_flight >= int(self.__limit):
+                return None
+            self.__in_flight += 1
+            return self.__epoch
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Waits for a free slot, at most `timeout` seconds (None = forever)
+        :return: the ticket, None if the timeout expired
+        """
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__in_flight < int(self.__limit), timeout):
+                return None
+            self.__in_flight += 1
+            return self.__epoch
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        See `acquire`
+        """
+        loop = asyncio.get_running_loop()
+        expires = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.__condition:
+                if self.__in_flight < int(self.__limit):
+                    self.__in_flight += 1
+                    return self.__epoch
+                remaining = None if expires is None else expires - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                waiter = (loop, loop.create_future())
+                self.__waiters.append(waiter)
+            try:
+                await asyncio.wait({waiter[1]}, timeout=remaining)
+            finally:
+                with self.__condition:
+                    if waiter in self.__waiters:
+                        self.__waiters.remove(waiter)
+
+    def release(self, ticket: int, congested: bool, latency: float):
+        with self.__condition:
+            self.__in_flight -= 1
+            if not congested and self.__is_latency_spike(latency):
+                congested = True
+            self.__track_latency(latency)
+            if congested:
+                if ticket == self.__epoch:
+                    self.__limit = max(float(self.limits.min_concurrency), self.__limit * self.limits.decrease_factor)
+                    self.__epoch += 1
+                    logger.info(f"congestion detected, concurrency limit decreased to {self.limit}")
+            else:
+                self.__limit = min(float(self.limits.max_concurrency), self.__limit + 1 / self.__limit)
+            self.__notify()
+
+    def abandon(self, ticket: int):
+        """
+        Hands back the ticket of a call which has not completed (e.g. it was cancelled): its slot is freed, but it tells
+        nothing about Számla Agent, so neither the limit nor the latency is updated
+        """
+        with self.__condition:
+            self.__in_flight -= 1
+            self.__notify()
+
+    def __notify(self):
+        # a slot is free: wakes the threads and the event loops waiting for it. Called with the condition held
+        self.__condition.notify_all()
+        for loop, future in self.__waiters:
+            try:
+                loop.call_soon_threadsafe(self.__wake, future)
+            except RuntimeError:  # the loop of the waiter is closed
+                pass
+        self.__waiters.clear()
+
+    @staticmethod
+    def __wake(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    def __is_latency_spike(self, latency: float) -> bool:
+        ratio = self.limits.latency_spike_ratio
+        return ratio is not None and self.__samples >= self._LATENCY_WARMUP and latency > ratio * self.__latency
+
+    def __track_latency(self, latency: float):
+        self.__samples += 1
+        if self.__latency is None:
+            self.__latency = latency
+        else:
+            self.__latency += self._LATENCY_SMOOTHING * (latency - self.__latency)
+
+
+def _is_transport_error(error: BaseException) -> bool:
+    if isinstance(error, deadlines.DeadlineExceeded):
+        return True
+    # requests / httpx are not imported here: an error of theirs can only be raised once they have been imported
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(error, requests.RequestException):
+        return True
+    httpx = sys.modules.get("httpx")
+    return httpx is not None and isinstance(error, httpx.TransportError)
+
+
+class _ActionThrottle:
+    def __init__(self, limits: ActionLimits):
+        self.limits = limits
+        self.bucket = TokenBucket(limits.rate, limits.burst) if limits.rate else None
+        self.concurrency = AdaptiveConcurrencyLimit(limits)
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Waits for the rate and the concurrency limits, at most `timeout` seconds (None = forever)
+        :return: the ticket to release, None if the timeout expired
+        """
+        started = time.monotonic()
+        delay = self.__reserve(timeout)
+        if delay is None:
+            return None
+        try:
+            if delay:
+                time.sleep(delay)
+            ticket = self.concurrency.acquire(self.__remaining(timeout, started))
+        except BaseException:
+            self.__refund()
+            raise
+        if ticket is None:
+            self.__refund()  # the call is not made, its token is not used either
+        return ticket
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> Optional[int]:
+        started = time.monotonic()
+        delay = self.__reserve(timeout)
+        if delay is None:
+            return None
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            ticket = await self.concurrency.acquire_async(self.__remaining(timeout, started))
+        except BaseException:  # e.g. the call has been cancelled
+            self.__refund()
+            raise
+        if ticket is None:
+            self.__refund()
+        return ticket
+
+    def __reserve(self, timeout: Optional[float]) -> Optional[float]:
+        """
+        Takes a token of the rate limit
+        :return: seconds to wait before using it, None if that is more than `timeout` (the token is given back)
+        """
+        if self.bucket is None:
+            return 0.0
+        delay = self.bucket.reserve()
+        if timeout is not None and delay > timeout:
+            self.bucket.refund()
+            return None
+        return delay
+
+    def __refund(self):
+        if self.bucket is not None:
+            self.bucket.refund()
+
+    @staticmethod
+    def __remaining(timeout: Optional[float], started: float) -> Optional[float]:
+        return None if timeout is None else max(timeout - (time.monotonic() - started), 0.0)
+
+    def _after_fork(self):
+        if self.bucket is not None:
+            self.bucket._after_fork()
+        self.concurrency._after_fork()
+
+    def release(self, ticket: int, latency: float, status_code: int = None, error_code: str = None, error: BaseException = None):
+        if error is not None and not _is_transport_error(error):
+            self.abandon(ticket)  # e.g. cancelled by the caller: tells nothing about Számla Agent
+            return
+        congested = (error is not None
+                     or status_code in self.limits.congestion_statuses
+                     or (error_code is not None and error_code in self.limits.congestion_error_codes))
+        self.concurrency.release(ticket, congested, latency)
+
+    def abandon(self, ticket: int):
+        self.concurrency.abandon(ticket)
+
+
+class Throttle:
+    """
+    Client-side rate limiter and adaptive concurrency controller of SzamlazzClient / AsyncSzamlazzClient.
+
+        throttle = Throttle(
+            default=ActionLimits(rate=10, max_concurrency=16),
+            per_action={"action-szamla_agent_pdf": ActionLimits(rate=50, max_concurrency=32)},
+        )
+        client = SzamlazzClient(agent_key="...", throttle=throttle)
+
+    A Throttle may be shared by several clients, they are then limited together.
+    """
+    def __init__(self, default: ActionLimits = ActionLimits(), per_action: Dict[str, ActionLimits] = None):
+        self.default = default
+        self.per_action = dict(per_action or {})
+        self.__throttles: Dict[str, _ActionThrottle] = {}
+        self.__lock = Lock()
+
+    def for_action(self, action: str) -> _ActionThrottle:
+        throttle = self.__throttles.get(action)
+        if throttle is None:
+            with self.__lock:
+                throttle = self.__throttles.get(action)
+                if throttle is None:
+                    throttle = _ActionThrottle(self.per_action.get(action, self.default))
+                    self.__throttles[action] = throttle
+        return throttle
+
+    def _after_fork(self):
+        """
+        Called in the child process of a fork for the Throttle of every client it inherited (see
+        BaseSzamlazzClient._after_fork): renews the locks and forgets the calls the parent had in flight
+        """
+        self.__lock = Lock()
+        for throttle in self.__throttles.values():
+            throttle._after_fork()
+
+    def concurrency_limit(self, action: str) -> int:
+        """
+        Current adaptive concurrency limit of `action`
+        """
+        return self.for_action(action).concurrency.limit
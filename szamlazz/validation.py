@@ -0,0 +1,210 @@
+import re
+from datetime import date
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple
+
+from szamlazz import xsd
+
+
+__all__ = ["ValidationPolicy", "ValidationMetrics", "Validator", "MODES", "check_invoice", ]
+
+# Validation modes of a ValidationPolicy
+MODES = ("always", "sampled", "fast", "off")
+
+
+class ValidationPolicy(NamedTuple):
+    """
+    Validation settings of the requests of SzamlazzClient / AsyncSzamlazzClient.
+
+      * "always": every request is validated against its XSD schema
+      * "sampled": 1 in `sample_rate` requests is validated against its schema, as well as the first request of
+        every template
+      * "fast": no schema validation, the Header and the Items of the request are checked by `check_invoice` instead
+      * "off": requests are not validated at all, Számla Agent rejects the invalid ones
+    """
+    mode: str = "always"
+    sample_rate: int = 100
+
+
+class ValidationMetrics:
+    """
+    Thread-safe counters of the validations of a client
+    """
+    def __init__(self):
+        self.schema_validated = 0
+        self.schema_failed = 0
+        self.skipped = 0  # requests not validated against their schema
+        self.fast_checked = 0
+        self.fast_failed = 0
+        self.__lock = Lock()
+
+    def _count(self, counter: str, failed_counter: str = "", failed: bool = False):
+        with self.__lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if failed:
+                setattr(self, failed_counter, getattr(self, failed_counter) + 1)
+
+    def _after_fork(self):
+        self.__lock = Lock()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.__lock:
+            return {
+                "schema_validated": self.schema_validated,
+                "schema_failed": self.schema_failed,
+                "skipped": self.skipped,
+                "fast_checked": self.fast_checked,
+                "fast_failed": self.fast_failed,
+            }
+
+
+class Validator:
+    """
+    Applies a ValidationPolicy to the requests of a client and counts the outcomes in `metrics`
+    """
+    def __init__(self, policy: ValidationPolicy = ValidationPolicy()):
+        if policy.mode not in MODES:
+            raise ValueError(f"validation mode must be one of {MODES}, not {policy.mode!r}")
+        if policy.sample_rate < 1:
+            raise ValueError("sample_rate must be at least 1")
+        self.policy = policy
+        self.metrics = ValidationMetrics()
+        self.__requests = 0
+        self.__templates = set()  # hashes of the templates already validated once
+        self.__lock = Lock()
+
+    def _after_fork(self):
+        # in the child of a fork: the locks may have been held by another thread of the parent
+        self.__lock = Lock()
+        self.metrics._after_fork()
+
+    def wants_schema(self, template: str) -> bool:
+        """
+        Tells whether the next request rendered from `template` is validated against its schema
+        """
+        mode = self.policy.mode
+        if mode == "always":
+            return True
+        if mode == "sampled":
+            key = hash(template)
+            with self.__lock:
+                self.__requests += 1
+                if key not in self.__templates:
+                    self.__templates.add(key)
+                    return True
+                if self.__requests % self.policy.sample_rate == 0:
+                    return True
+        self.metrics._count("skipped")
+        return False
+
+    def schema_result(self, ok: bool):
+        self.metrics._count("schema_validated", "schema_failed", not ok)
+
+    def check(self, template_data: dict):
+        """
+        The "fast" check of `template_data`: its header and its items (if they are a sized collection)
+        :raises xsd.ValidationError: listing the invalid fields
+        """
+        if self.policy.mode != "fast":
+            return
+        items = template_data.get("items", ())
+        errors = check_invoice(template_data.get("header"), items if hasattr(items, "__len__") else ())
+        self.__fast_result(errors)
+
+    def checked_items(self, template_data: dict) -> dict:
+        """
+        `check` of a request whose items are consumed while it is rendered (see SzamlazzClient._render_spooled):
+        the header is checked now, the items as they are rendered
+        :return: template_data with its items wrapped
+        """
+        if self.policy.mode != "fast":
+            return template_data
+        self.__fast_result(check_invoice(template_data.get("header"), ()))
+        return {**template_data, "items": self.__check_items(template_data.get("items", ()))}
+
+    def __check_items(self, items: Iterable[Any]) -> Iterator[Any]:
+        for index, item in enumerate(items):
+            errors = _check_item(item, index)
+            if errors:
+                self.__fast_result(errors)
+            yield item
+
+    def __fast_result(self, errors: List[str]):
+        self.metrics._count("fast_checked", "fast_failed", bool(errors))
+        if errors:
+            raise xsd.ValidationError("Fast validation failed: " + "; ".join(errors))
+
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}\Z")
+_HEADER_DATES = ("creating_date", "payment_date", "due_date")
+_HEADER_FLAGS = ("deposit_invoice", "invoice_after_deposit_invoice", "correction_invoice", "proforma_invoice")
+_BOOLEANS = (True, False, "true", "false", "True", "False", "1", "0")  # rendered with `| lower`
+_ITEM_REQUIRED = ("name", "quantity_unit", "vat_rate")
+_ITEM_NUMBERS = ("quantity", "unit_price", "net_price", "vat_amount", "gross_amount")
+
+
+def _field(obj: Any, name: str) -> Any:
+    return obj.get(name, "") if isinstance(obj, dict) else getattr(obj, name, "")
+
+
+def _is_number(value: Any) -> bool:
+    if isinstance(value, bool):
+        return False
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _is_date(value: Any) -> bool:
+    if not isinstance(value, str) or not _DATE.match(value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def _check_header(header: Any) -> List[str]:
+    errors = []
+    for name in _HEADER_DATES:
+        value = _field(header, name)
+        if value != "" and not _is_date(value):
+            errors.append(f"header.{name}: {value!r} is not a YYYY-MM-DD date")
+    for name in _HEADER_FLAGS:
+        value = _field(header, name)
+        if value not in _BOOLEANS or isinstance(value, int) and not isinstance(value, bool):
+            errors.append(f"header.{name}: {value!r} is not a bool")
+    exchange_rate = _field(header, "exchange_rate")
+    if exchange_rate != "" and not _is_number(exchange_rate):
+        errors.append(f"header.exchange_rate: {exchange_rate!r} is not a number")
+    return errors
+
+
+def _check_item(item: Any, index: int) -> List[str]:
+    errors = []
+    for name in _ITEM_REQUIRED:
+        if _field(item, name) in ("", None):
+            errors.append(f"items[{index}].{name} is missing")
+    for name in _ITEM_NUMBERS:
+        value = _field(item, name)
+        if not _is_number(value):
+            errors.append(f"items[{index}].{name}: {value!r} is not a number")
+    margin_tax_base = _field(item, "margin_tax_base")
+    if margin_tax_base != "" and not _is_number(margin_tax_base):
+        errors.append(f"items[{index}].margin_tax_base: {margin_tax_base!r} is not a number")
+    return errors
+
+
+def check_invoice(header: Any, items: Iterable[Any] = ()) -> List[str]:
+    """
+    Cheap structural and type check of the fields the schema of an invoice is most often violated with:
+    the dates and flags of the Header, the required and numeric fields of the Items
+    :return: the errors found, empty if none
+    """
+    errors = _check_header(header) if header is not None else []
+    for index, item in enumerate(items):
+        errors.extend(_check_item(item, index))
+    return errors
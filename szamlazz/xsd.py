@@ -1,26 +1,238 @@
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
 from lxml import etree
-from typing import Tuple
 
 
-__all__ = ["validate", ]
+__all__ = ["validate", "validate_many", "ValidationResult", ]
+
+# Size of the LRU cache holding compiled custom (non built-in) schemas
+CUSTOM_SCHEMA_CACHE_SIZE = 32
 
 
 class ValidationError(Exception):
     pass
 
 
-def validate(xml: str, xsd: str) -> Tuple[bool, str]:
-    parser = etree.XMLParser(ns_clean=True, recover=True, encoding='utf-8')
-    # XSD
-    xmlschema_doc = etree.fromstring(xsd.encode('utf-8'), parser=parser)
-    xmlschema = etree.XMLSchema(xmlschema_doc)
+class _SchemaToken:
+    """Identity of a _CompiledSchema in the state of the threads, see _thread_schema"""
+    __slots__ = ("__weakref__", )
+
+
+class _CompiledSchema(NamedTuple):
+    schema: etree.XMLSchema  # shared, see `get_schema`. lxml keeps the error log on the instance: see _thread_schema
+    source: str
+    token: _SchemaToken
+
+
+class _ThreadSchema(NamedTuple):
+    schema: etree.XMLSchema
+    parser: etree.XMLParser  # validating parser of `schema`
+
+
+def _new_parser() -> etree.XMLParser:
+    return etree.XMLParser(ns_clean=True, recover=True, encoding='utf-8')
+
+
+def _parse_schema(xsd: str) -> etree.XMLSchema:
+    return etree.XMLSchema(etree.fromstring(xsd.encode('utf-8'), parser=_new_parser()))
+
+
+def _compile(xsd: str) -> _CompiledSchema:
+    return _CompiledSchema(_parse_schema(xsd), xsd, _SchemaToken())
+
+
+_registry_lock = Lock()
+_compiled_builtins: Dict[str, _CompiledSchema] = {}
+_compile_custom = lru_cache(maxsize=CUSTOM_SCHEMA_CACHE_SIZE)(_compile)
+
 
-    # XML
-    xml_doc = etree.fromstring(xml.encode('utf-8'), parser=parser)
-    result = xmlschema.validate(xml_doc)
+def _get_compiled(xsd: str) -> _CompiledSchema:
+    compiled = _compiled_builtins.get(xsd)
+    if compiled is None:
+        source = _builtin_sources.get(xsd)
+        if source is None:
+            return _compile_custom(xsd)
+        with _registry_lock:
+            compiled = _compiled_builtins.get(source) or _compile(source)
+            _compiled_builtins[source] = _compiled_builtins[xsd] = compiled
+    return compiled
 
+
+def _reinit_locks():
+    # runs in the child of a fork: a lock held by another thread of the parent at that moment would never be released.
+    # The compiled schemas are kept (shared copy-on-write with the parent)
+    global _registry_lock
+    _registry_lock = Lock()
+
+
+if hasattr(os, "register_at_fork"):  # POSIX only
+    os.register_at_fork(after_in_child=_reinit_locks)
+
+
+def get_schema(xsd: str) -> etree.XMLSchema:
+    """
+    Returns the compiled etree.XMLSchema for an XSD source string or for the name of a built-in schema.
+
+    Built-in schemas of this module are compiled once and kept for the lifetime of the process.
+    Any other XSD source goes through a bounded LRU cache (see CUSTOM_SCHEMA_CACHE_SIZE).
+    The returned object is shared, use `validate` to validate against it from multiple threads.
+    :param xsd: XSD source or a built-in schema's name (e.g.: "generate_invoice")
+    :return: lxml.etree.XMLSchema
+    """
+    return _get_compiled(xsd).schema
+
+
+def parse(xml: Union[str, bytes], strict: bool = False) -> etree._Element:
+    """
+    Parses a document the way `validate` does, for `validate_tree`
+    :param xml: the document, str or UTF-8 encoded bytes (used as they are)
+    :param strict: True = a document which is not well-formed is not recovered
+    :raises etree.XMLSyntaxError: `strict` and the document is not well-formed
+    """
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    if strict:
+        return etree.fromstring(xml, parser=etree.XMLParser(ns_clean=True, encoding='utf-8'))
+    return etree.fromstring(xml, parser=_new_parser())
+
+
+def validate(xml: Union[str, bytes], xsd: str) -> Tuple[bool, str]:
+    return validate_tree(parse(xml), xsd)
+
+
+def validate_tree(xml_doc: etree._Element, xsd: str) -> Tuple[bool, str]:
+    """
+    `validate` of an already parsed document
+    """
+    schema = _thread_schema(_get_compiled(xsd)).schema
+    result = schema.validate(xml_doc)
     # xmlschema.error_log.last_error => lxml.etree._LogEntry
-    return result, str(xmlschema.error_log.last_error)
+    last_error = schema.error_log.last_error
+    return result, str(last_error)
+
+
+class ValidationResult(NamedTuple):
+    """A document's result of `validate_many`"""
+    valid: bool
+    errors: Tuple[str, ...] = ()  # every entry of the error log, e.g. "<string>:84:0:ERROR:SCHEMASV:..."
+
+
+_thread_state = threading.local()
+
+
+def _thread_schema(compiled: _CompiledSchema) -> _ThreadSchema:
+    # the error log of an XMLSchema, and lxml parsers, must not be shared by threads: every thread validates with
+    # a schema and a validating parser of its own, no lock is needed. The main thread uses the shared schema, so
+    # the schemas compiled by `szamlazz.warmup` before a fork are not compiled again by single-threaded workers.
+    # They are dropped with the _CompiledSchema (e.g. evicted from the cache of the custom schemas): they are
+    # held by a weak reference to its token
+    schemas = getattr(_thread_state, "schemas", None)
+    if schemas is None:
+        schemas = _thread_state.schemas = weakref.WeakKeyDictionary()
+    own = schemas.get(compiled.token)
+    if own is None:
+        main = threading.current_thread() is threading.main_thread()
+        schema = compiled.schema if main else _parse_schema(compiled.source)
+        own = schemas[compiled.token] = _ThreadSchema(schema, etree.XMLParser(ns_clean=True, encoding='utf-8', schema=schema))
+    return own
+
+
+def _validate_one(xml: Union[str, bytes], compiled: _CompiledSchema) -> ValidationResult:
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    own = _thread_schema(compiled)
+    # fast path: validated while parsed, with the thread's own validation context. No lock, the GIL is released
+    try:
+        etree.fromstring(xml, own.parser)
+        return ValidationResult(True)
+    except etree.XMLSyntaxError:
+        pass
+    # diagnostics: `validate`'s recovering parse and the thread's schema instance, whose error log has the line numbers
+    # (the log of a parser holds its last parse only, unlike the exception's, which is the thread's global log)
+    parser = _new_parser()
+    try:
+        xml_doc = etree.fromstring(xml, parser=parser)
+    except etree.XMLSyntaxError:
+        xml_doc = None
+    if xml_doc is None:  # not even recoverable
+        return ValidationResult(False, tuple(str(entry) for entry in parser.error_log))
+    result = own.schema.validate(xml_doc)
+    return ValidationResult(result, tuple(str(entry) for entry in own.schema.error_log))
+
+
+def validate_many(documents: Iterable[Union[str, bytes]], xsd: str, workers: Optional[int] = None) -> List[ValidationResult]:
+    """
+    Validates a batch of documents against the same schema on a pool of threads, e.g. the pre-flight check of
+    a month-end batch. lxml releases the GIL while it parses and validates, so the validations run in parallel.
+
+    Valid documents are validated while they are parsed, every thread with its own parser. Invalid ones are
+    re-validated like `validate` does, to report every entry of the error log with its line number.
+    :param documents: rendered documents, str or UTF-8 encoded bytes
+    :param xsd: XSD source or a built-in schema's name (see `get_schema`)
+    :param workers: number of threads [default=os.cpu_count()]
+    :return: List[ValidationResult] in the order of `documents`
+    """
+    compiled = _get_compiled(xsd)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return [_validate_one(document, compiled) for document in documents]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="szamlazz-validate") as executor:
+        return list(executor.map(partial(_validate_one, compiled=compiled), documents))
+
+
+class IncrementalValidator:
+    """
+    Validates an XML document fed in chunks, without building it in memory: elements are dropped once parsed.
+    Used to validate streamed requests (see szamlazz.streaming), its parser has its own validation context and
+    error log, so it can run next to the validations of `validate` in any thread.
+    """
+    def __init__(self, xsd: str):
+        self.__parser = etree.XMLPullParser(events=("end", ), schema=_get_compiled(xsd).schema, ns_clean=True)
+        self.__error = ""
+
+    def feed(self, data: bytes) -> bool:
+        """
+        :return: False once the document turned out to be invalid, further data is ignored then
+        """
+        if self.__error:
+            return False
+        try:
+            self.__parser.feed(data)
+        except etree.XMLSyntaxError as e:
+            self.__error = self.__describe(e)
+            return False
+        self.__drop_parsed()
+        return True
+
+    def close(self) -> Tuple[bool, str]:
+        """
+        :return: Tuple[valid, last error] like `validate`
+        """
+        if not self.__error:
+            try:
+                self.__parser.close()
+            except etree.XMLSyntaxError as e:
+                self.__error = self.__describe(e)
+        return not self.__error, self.__error or "None"
+
+    def __drop_parsed(self):
+        for _, element in self.__parser.read_events():
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+    @staticmethod
+    def __describe(e: etree.XMLSyntaxError) -> str:
+        last_error = e.error_log.last_error
+        return str(last_error) if last_error is not None else str(e)
 
 
 # language=XSD
@@ -599,3 +811,13 @@ tax_payer = """<?xml version="1.0" encoding="UTF-8"?>
         </complexType>
     </element>
 </schema>"""
+
+
+_builtin_names = ("generate_invoice", "reverse_invoice", "credit_entry", "query_invoice_pdf", "query_invoice_xml",
+                  "delete_pro_forma_invoice", "generate_receipt", "reverse_receipt", "query_receipt", "send_receipt",
+                  "tax_payer", )
+# maps both the names and the sources of the built-in schemas to their source
+_builtin_sources: Dict[str, str] = {
+    **{name: globals()[name] for name in _builtin_names},
+    **{globals()[name]: globals()[name] for name in _builtin_names},
+}
@@ -0,0 +1,133 @@
+import base64
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import pytest
+
+from szamlazz import SzamlazzClient
+from szamlazz.models import Header, Merchant, Buyer, Item
+
+
+PDF = b"%PDF-1.4 test" * 100
+INVOICE_ANSWER = (
+    '<?xml version="1.0" encoding="UTF-8"?><xmlszamlavalasz xmlns="http://www.szamlazz.hu/xmlszamlavalasz">'
+    '<sikeres>true</sikeres><szamlaszam>E-TEST-2024-1</szamlaszam><pdf>%s</pdf></xmlszamlavalasz>'
+    % base64.b64encode(PDF).decode()
+).encode("utf-8")
+
+
+class FakeAgent:
+    """
+    Számla Agent on localhost. Every request is recorded in `requests` (its multipart body) and answered with a
+    successful invoice answer (or `answer`), unless `statuses` holds an HTTP status to answer the next request with.
+    Each request is answered after the next value of `delays` (or `delay`) seconds.
+    `in_flight` / `max_in_flight` count the requests being answered
+    """
+    def __init__(self):
+        self.requests: List[bytes] = []
+        self.statuses: List[int] = []
+        self.delays: List[float] = []
+        self.delay = 0.0
+        self.answer = INVOICE_ANSWER
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, needle: bytes) -> int:
+        """Number of requests whose body contains `needle`"""
+        with self.lock:
+            return sum(needle in body for body in self.requests)
+
+    def _answer(self, body: bytes):
+        with self.lock:
+            self.requests.append(body)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            status: Optional[int] = self.statuses.pop(0) if self.statuses else None
+            delay = self.delays.pop(0) if self.delays else self.delay
+        try:
+            time.sleep(delay)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        return status
+
+    def _handler(self):
+        agent = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                status = agent._answer(body)
+                try:
+                    if status is not None:
+                        self.send_response(status)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(agent.answer)))
+                    self.send_header("szlahu_szamlaszam", "E-TEST-2024-1")
+                    self.end_headers()
+                    self.wfile.write(agent.answer)
+                except (BrokenPipeError, ConnectionResetError):  # the client has given up on the request
+                    pass
+
+        return Handler
+
+
+@pytest.fixture
+def agent():
+    fake = FakeAgent()
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def client_of():
+    """
+    `client_of(url, **kwargs)`: a SzamlazzClient of the Számla Agent at `url` (e.g. `agent.url`), which does not
+    coalesce reads unless `kwargs` say so. The clients are closed after the test
+    """
+    clients = []
+
+    def make(url: str, **kwargs) -> SzamlazzClient:
+        client = SzamlazzClient(**{"agent_key": "KEY", "coalesce_reads": False, **kwargs})
+        client.url = url
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def invoice():
+    """(header, merchant, buyer, items) of a valid invoice"""
+    header = Header(creating_date="2024-01-02", payment_date="2024-01-02", due_date="2024-01-10", invoice_prefix="DK",
+                    invoice_number="E-TEST-2024-1")
+    merchant = Merchant(bank_name="OTP", bank_account_number="11111111-22222222-33333333")
+    buyer = Buyer(name="Kovacs Bt.", zip_code="2030", city="Érd", address="Tárnoki út 23.", tax_number="12345678-1-42")
+    item = Item(name="Eladó izé", quantity="2.0", quantity_unit="db", unit_price="10000", vat_rate="27",
+                net_price="20000.0", vat_amount="5400.0", gross_amount="25400.0")
+    return header, merchant, buyer, [item]
@@ -0,0 +1,125 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from szamlazz import SzamlazzClient
+from szamlazz.cache import DocumentCache, TaxpayerCache
+
+
+TAXPAYER_ANSWER = (
+    '<?xml version="1.0" encoding="UTF-8"?><ns2:QueryTaxpayerResponse xmlns="http://schemas.nav.gov.hu/OSA/2.0/api" '
+    'xmlns:ns2="http://schemas.nav.gov.hu/OSA/2.0/data"><result><funcCode>OK</funcCode></result>'
+    '<taxpayerValidity>true</taxpayerValidity></ns2:QueryTaxpayerResponse>'
+).encode("utf-8")
+
+
+@pytest.fixture
+def sqlite_threads(monkeypatch):
+    """names of the threads connecting to SQLite"""
+    threads = []
+    connect = sqlite3.connect
+
+    def recording_connect(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return connect(*args, **kwargs)
+
+    monkeypatch.setattr(sqlite3, "connect", recording_connect)
+    return threads
+
+
+def test_taxpayer_answers_are_shared_through_the_file(agent, tmp_path):
+    agent.answer = TAXPAYER_ANSWER
+    path = str(tmp_path / "taxpayers.sqlite3")
+    client = SzamlazzClient(agent_key="KEY", taxpayer_cache=TaxpayerCache(path=path))
+    client.url = agent.url
+    assert client.query_taxpayer("13421739").ok
+    other = SzamlazzClient(agent_key="KEY", taxpayer_cache=TaxpayerCache(path=path))
+    other.url = agent.url
+    assert other.query_taxpayer("13421739").ok
+    assert len(agent.requests) == 1
+    assert other.taxpayer_cache.stats.persistent_hits == 1
+
+
+def test_async_client_does_not_touch_sqlite_on_the_event_loop(agent, tmp_path, sqlite_threads):
+    from szamlazz import AsyncSzamlazzClient
+
+    agent.answer = TAXPAYER_ANSWER
+    cache = TaxpayerCache(path=str(tmp_path / "taxpayers.sqlite3"))
+    sqlite_threads.clear()
+
+    async def main():
+        async with AsyncSzamlazzClient(agent_key="KEY", taxpayer_cache=cache) as client:
+            client.url = agent.url
+            first = await client.query_taxpayer("13421739")  # looked up in the file, then stored in it
+            cache._TaxpayerCache__entries.clear()
+            second = await client.query_taxpayer("13421739")  # read back from the file
+            third = await client.query_taxpayer("13421739")  # from memory
+            return first, second, third, threading.current_thread().name
+
+    first, second, third, loop_thread = asyncio.run(main())
+    assert first.ok and not second.has_errors and third is second
+    assert len(agent.requests) == 1
+    assert cache.stats.snapshot()["persistent_hits"] == 1 and cache.stats.hits == 1
+    assert len(sqlite_threads) == 3 and loop_thread not in sqlite_threads
+
+
+def test_document_cache_keeps_its_size_without_listing_the_directory(tmp_path, monkeypatch):
+    cache = DocumentCache(str(tmp_path), max_bytes=10000)
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scans.append(path) or scandir(path))
+    for i in range(5):
+        cache.put(f"doc{i}", 200, {}, b"x" * 1000)
+    cache.put("doc0", 200, {}, b"x" * 1000)  # replaced, not added
+    assert not scans
+    assert cache.size() == cache._DocumentCache__bytes
+
+
+def test_document_cache_evicts_the_least_recently_used_over_max_bytes(tmp_path):
+    cache = DocumentCache(str(tmp_path), max_bytes=3500)
+    for i in range(3):
+        cache.put(f"doc{i}", 200, {}, b"x" * 1000)
+        time.sleep(0.01)
+    assert cache.get("doc0") is not None  # doc1 is the least recently used now
+    cache.put("doc3", 200, {}, b"x" * 1000)
+    assert cache.get("doc1") is None
+    assert all(cache.get(key) is not None for key in ("doc0", "doc2", "doc3"))
+    assert cache.size() <= 3500 and cache.stats.evicted == 1
+
+
+def test_document_cache_catches_up_with_other_processes(tmp_path):
+    cache = DocumentCache(str(tmp_path), max_bytes=10000)
+    other = DocumentCache(str(tmp_path), max_bytes=10 ** 9)  # e.g. in another process
+    for i in range(100):
+        other.put(f"other{i}", 200, {}, b"x" * 200)
+    for i in range(DocumentCache.RESCAN_EVERY - 1):
+        cache.put(f"doc{i}", 200, {}, b"x")
+    assert cache.size() > 10000  # the stores of `other` are not counted by `cache`...
+    cache.put("last", 200, {}, b"x")
+    assert cache.size() <= 10000  # ...until it lists the directory
+
+
+def test_async_client_does_not_touch_the_document_cache_on_the_event_loop(agent, tmp_path, monkeypatch):
+    from szamlazz import AsyncSzamlazzClient
+
+    cache = DocumentCache(str(tmp_path))
+    threads = []
+    for name in ("get", "put"):
+        method = getattr(cache, name)
+        monkeypatch.setattr(cache, name, lambda *args, method=method: threads.append(threading.get_ident()) or method(*args))
+
+    async def main():
+        async with AsyncSzamlazzClient(agent_key="KEY", document_cache=cache) as client:
+            client.url = agent.url
+            first = await client.query_invoice_pdf("E-TEST-2024-1")  # missed, then stored
+            second = await client.query_invoice_pdf("E-TEST-2024-1")  # from the cache
+            return first, second, threading.get_ident()
+
+    first, second, loop_thread = asyncio.run(main())
+    assert first.get_pdf_bytes() == second.get_pdf_bytes()
+    assert len(agent.requests) == 1 and cache.stats.hits == 1 and cache.stats.stores == 1
+    assert len(threads) == 3 and loop_thread not in threads
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from szamlazz import SzamlazzClient
+from szamlazz.coalesce import AsyncSingleFlight, SingleFlight
+
+
+PDF_ACTION = b"action-szamla_agent_pdf"
+
+
+def run_together(n: int, fn):
+    """Calls `fn()` from `n` threads at once, returns the results"""
+    results = [None] * n
+    barrier = threading.Barrier(n)
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = fn()
+        except BaseException as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_followers_share_the_leader_call():
+    flight = SingleFlight()
+    calls = []
+
+    def call():
+        calls.append(1)
+        time.sleep(0.1)
+        return object()
+
+    results = run_together(5, lambda: flight.do("key", call))
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert (flight.leaders, flight.followers) == (1, 4)
+
+
+def test_followers_get_the_leader_error():
+    flight = SingleFlight()
+
+    def call():
+        time.sleep(0.1)
+        raise ConnectionError("down")
+
+    results = run_together(3, lambda: flight.do("key", call))
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert flight.leaders == 1
+
+
+def test_calls_after_the_flight_are_made_again():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert (flight.leaders, flight.followers) == (2, 0)
+
+
+def test_follower_gives_up_after_its_timeout():
+    flight = SingleFlight()
+    started = threading.Event()
+
+    def call():
+        started.set()
+        time.sleep(0.3)
+        return "late"
+
+    leader = threading.Thread(target=flight.do, args=("key", call))
+    leader.start()
+    started.wait()
+    with pytest.raises(LookupError):
+        flight.do("key", lambda: "other", timeout=0.05, timeout_error=LookupError)
+    leader.join()
+
+
+def test_async_followers_share_the_leader_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return object()
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", call) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert (flight.leaders, flight.followers) == (1, 4)
+
+
+def test_async_call_goes_on_when_its_leader_is_cancelled():
+    flight = AsyncSingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        leader = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == "answer"
+    assert flight.leaders == 1
+
+
+def test_client_coalesces_identical_reads(agent):
+    agent.delay = 0.1
+    client = SzamlazzClient(agent_key="KEY")
+    client.url = agent.url
+    responses = run_together(4, lambda: client.query_invoice_pdf("E-TEST-2024-1"))
+    assert all(response.ok for response in responses)
+    assert agent.count(PDF_ACTION) == 1
+    assert client.single_flight.followers == 3
+
+
+def test_client_does_not_coalesce_writes(agent, invoice):
+    agent.delay = 0.1
+    client = SzamlazzClient(agent_key="KEY")
+    client.url = agent.url
+    run_together(3, lambda: client.generate_invoice(*invoice))
+    assert agent.count(b"action-xmlagentxmlfile") == 3
+
+
+def test_async_client_coalesces_identical_reads(agent):
+    from szamlazz import AsyncSzamlazzClient
+
+    agent.delay = 0.1
+
+    async def main():
+        async with AsyncSzamlazzClient(agent_key="KEY") as client:
+            client.url = agent.url
+            return await asyncio.gather(*(client.query_invoice_pdf("E-TEST-2024-1") for _ in range(4)))
+
+    assert all(response.ok for response in asyncio.run(main()))
+    assert agent.count(PDF_ACTION) == 1
@@ -0,0 +1,52 @@
+import pytest
+from lxml import etree
+
+from szamlazz import SzamlazzClient, compact, templates, xsd
+from szamlazz.models import BuyerLedger, ItemLedger
+
+
+def canonical(document: bytes) -> bytes:
+    return etree.tostring(etree.fromstring(document), method="c14n")
+
+
+def uploaded_xml(body: bytes) -> bytes:
+    """The document of a recorded multipart upload"""
+    return body.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+
+
+def invoice_document(invoice) -> bytes:
+    header, merchant, buyer, items = invoice
+    buyer = buyer._replace(buyer_ledger=BuyerLedger(buyer_identifier="V-1", continuous_performance=True))
+    items = items + [items[0]._replace(item_ledger=ItemLedger(economic_event="E", settlement_date_to="2024-01-31"))]
+    client = SzamlazzClient(agent_key="KEY")
+    data = client._invoice_template_data(client.get_basic_settings(), header, merchant, buyer, items * 3)
+    return templates.render(templates.generate_invoice, data).encode("utf-8")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64 * 1024])
+def test_streamed_compaction_is_the_compaction_of_the_document(invoice, chunk_size):
+    document = invoice_document(invoice)
+    chunks = (document[i:i + chunk_size] for i in range(0, len(document), chunk_size))
+    streamed = b"".join(compact.compact_stream(chunks, xsd.generate_invoice))
+    assert canonical(streamed) == canonical(compact.compact(document, xsd.generate_invoice).encode("utf-8"))
+    assert xsd.validate(streamed, xsd.generate_invoice)[0]
+
+
+def test_streamed_invoice_is_compacted(agent, invoice, client_of):
+    header, merchant, buyer, items = invoice
+    client = client_of(agent.url, compact=True)
+    assert client.generate_invoice(header, merchant, buyer, items).ok
+    assert client.generate_invoice(header, merchant, buyer, iter(items)).ok  # streamed
+    rendered, streamed = (uploaded_xml(body) for body in agent.requests)
+    assert b"<fuvarlevel>" not in streamed and b"\n" not in streamed
+    assert canonical(streamed) == canonical(rendered)
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_malformed_document_is_invalid_on_both_paths(agent, invoice, streamed, client_of):
+    header, merchant, buyer, items = invoice
+    client = client_of(agent.url)
+    buyer = buyer._replace(name="Kovács & Fia")  # not escaped by the template
+    with pytest.raises(xsd.ValidationError):
+        client.generate_invoice(header, merchant, buyer, iter(items) if streamed else items)
+    assert not agent.requests
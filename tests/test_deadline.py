@@ -0,0 +1,134 @@
+import asyncio
+import random
+import socket
+import time
+
+import pytest
+import requests
+
+from szamlazz import warmup, xsd
+from szamlazz.deadline import Deadline, DeadlineExceeded, Timeouts, timeouts_of
+from szamlazz.retry import RetryPolicy
+from szamlazz.throttle import ActionLimits, Throttle
+
+
+@pytest.fixture
+def unreachable():
+    """URL of a server whose connections time out: its backlog is full and it never accepts"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(0)
+    filler = socket.create_connection(server.getsockname())  # takes the only place in the backlog
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/"
+    filler.close()
+    server.close()
+
+
+def exceeded(call) -> DeadlineExceeded:
+    with pytest.raises(DeadlineExceeded) as e:
+        call()
+    return e.value
+
+
+def test_timeouts_of():
+    default = Timeouts(connect=1, read=2)
+    assert timeouts_of(None, default) == default
+    assert timeouts_of(5, default) == Timeouts(connect=1, read=2, total=5)
+    assert timeouts_of(Timeouts(read=3), default) == Timeouts(read=3)
+
+
+def test_network_timeouts_are_capped_by_the_remaining_budget():
+    deadline = Deadline(Timeouts(connect=10, read=0.1, total=1))
+    assert deadline.timeout("read") == 0.1
+    assert deadline.timeout("connect") <= 1
+    assert Deadline(Timeouts(connect=None, total=None)).timeout("connect") is None
+
+
+def test_read_phase(agent, client_of):
+    agent.delay = 0.5
+    error = exceeded(lambda: client_of(agent.url).query_invoice_pdf("E-TEST-2024-1", timeout=Timeouts(read=0.1)))
+    assert error.phase == "read" and error.timeout == 0.1
+    assert 0.1 <= error.elapsed < 0.5
+    assert isinstance(error.__cause__, requests.exceptions.ReadTimeout)
+
+
+def test_total_budget_bounds_the_read(agent, client_of):
+    agent.delay = 0.5
+    error = exceeded(lambda: client_of(agent.url).query_invoice_pdf("E-TEST-2024-1", timeout=0.2))
+    assert error.phase == "read" and error.timeout == 0.2
+    assert error.elapsed < 0.5
+
+
+def test_connect_phase(unreachable, client_of):
+    error = exceeded(lambda: client_of(unreachable).query_invoice_pdf("E-TEST-2024-1", timeout=Timeouts(connect=0.2)))
+    assert error.phase == "connect" and error.timeout == 0.2
+    assert isinstance(error.__cause__, requests.exceptions.ConnectTimeout)
+
+
+def test_throttle_phase(agent, client_of):
+    throttle = Throttle(ActionLimits(initial_concurrency=1))
+    throttle.for_action("action-szamla_agent_pdf").concurrency.acquire()  # the only slot is taken
+    client = client_of(agent.url, throttle=throttle)
+    error = exceeded(lambda: client.query_invoice_pdf("E-TEST-2024-1", timeout=0.1))
+    assert error.phase == "throttle" and error.elapsed >= 0.1
+    assert not agent.requests
+
+
+def test_retry_phase(client_of):
+    client = client_of("http://127.0.0.1:9/", retry=RetryPolicy(backoff_base=10, backoff_max=10))  # refused
+    random.seed(1)  # a backoff longer than the budget
+    error = exceeded(lambda: client.query_invoice_pdf("E-TEST-2024-1", timeout=1))
+    assert error.phase == "retry" and error.timeout == 1
+    assert error.elapsed < 1  # the backoff was not waited for
+    assert isinstance(error.__cause__, requests.exceptions.ConnectionError)
+
+
+def test_retries_share_the_budget(agent, client_of):
+    agent.statuses = [503] * 10
+    agent.delay = 0.1
+    client = client_of(agent.url, retry=RetryPolicy(max_attempts=10, backoff_base=0.001, backoff_max=0.001))
+    error = exceeded(lambda: client.query_invoice_pdf("E-TEST-2024-1", timeout=0.35))
+    assert error.phase == "read" and error.timeout == 0.35  # the last attempt only had what was left of the budget
+    assert 0.35 <= error.elapsed < 0.45
+    assert 3 <= len(agent.requests) <= 4
+
+
+def test_render_phase(invoice, client_of):
+    client = client_of("http://127.0.0.1:9/")
+    error = exceeded(lambda: client.generate_invoice(*invoice, timeout=Timeouts(total=1e-6)))
+    assert error.phase == "render" and error.timeout == 1e-6
+
+
+def test_validate_phase(invoice, monkeypatch, client_of):
+    client = client_of("http://127.0.0.1:9/")
+    validate_tree = xsd.validate_tree
+
+    def slow_validate_tree(*args):
+        time.sleep(0.2)
+        return validate_tree(*args)
+
+    warmup()  # the templates and the schemas are compiled, the render phase is short
+    monkeypatch.setattr(xsd, "validate_tree", slow_validate_tree)
+    error = exceeded(lambda: client.generate_invoice(*invoice, timeout=0.1))
+    assert error.phase == "validate"
+
+
+def test_async_phases(agent, unreachable):
+    from szamlazz import AsyncSzamlazzClient
+
+    agent.delay = 0.5
+
+    async def phase_of(url: str, **kwargs) -> str:
+        async with AsyncSzamlazzClient(agent_key="KEY", coalesce_reads=False) as client:
+            client.url = url
+            try:
+                await client.query_invoice_pdf("E-TEST-2024-1", **kwargs)
+            except DeadlineExceeded as e:
+                return e.phase
+
+    async def main():
+        return (await phase_of(agent.url, timeout=Timeouts(read=0.1)),
+                await phase_of(agent.url, timeout=0.1),
+                await phase_of(unreachable, timeout=Timeouts(connect=0.1)))
+
+    assert asyncio.run(main()) == ("read", "read", "connect")
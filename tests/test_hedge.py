@@ -0,0 +1,169 @@
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from szamlazz import SzamlazzClient
+from szamlazz.hedge import HedgePolicy, Hedger, LatencyTracker
+from szamlazz.throttle import ActionLimits, Throttle
+
+
+POLICY = HedgePolicy(initial_delay=0.05, min_delay=0.01)
+
+
+class Attempts:
+    """
+    An attempt which takes the next of `seconds` to answer (the last one for the others) and records when it started
+    """
+    def __init__(self, *seconds: float, error: BaseException = None):
+        self.seconds = seconds
+        self.error = error
+        self.started = []
+        self.__count = itertools.count()
+
+    def __call__(self):
+        n = next(self.__count)
+        self.started.append(time.monotonic())
+        time.sleep(self.seconds[min(n, len(self.seconds) - 1)])
+        if self.error is not None:
+            raise self.error
+        return n
+
+    async def coroutine(self):
+        n = next(self.__count)
+        self.started.append(time.monotonic())
+        await asyncio.sleep(self.seconds[min(n, len(self.seconds) - 1)])
+        return n
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(4) as pool:
+        yield pool
+
+
+def test_percentile_is_the_nearest_rank():
+    tracker = LatencyTracker(window=100)
+    for ms in range(1, 101):
+        tracker.record("action", ms / 1000)
+    assert tracker.percentile("action", 95) == 0.095
+    assert tracker.percentile("action", 95, min_samples=101) is None
+
+
+def test_delay_follows_the_latencies_once_known():
+    hedger = Hedger(HedgePolicy(initial_delay=1.0, min_delay=0.01, min_samples=5))
+    assert hedger.delay("action") == 1.0
+    for _ in range(5):
+        hedger.latencies.record("action", 0.2)
+    assert hedger.delay("action") == 0.2
+
+
+def test_fast_call_is_not_hedged(executor):
+    hedger = Hedger(POLICY)
+    attempts = Attempts(0.0)
+    assert hedger.send("action", attempts, executor) == 0
+    assert len(attempts.started) == 1 and hedger.hedged == 0
+
+
+def test_hedge_fires_only_after_the_delay(executor):
+    hedger = Hedger(POLICY)
+    attempts = Attempts(0.5, 0.0)
+    started = time.monotonic()
+    assert hedger.send("action", attempts, executor) == 1  # the hedge answered first
+    assert time.monotonic() - started < 0.5
+    assert attempts.started[1] - attempts.started[0] >= POLICY.initial_delay
+    assert (hedger.hedged, hedger.won) == (1, 1)
+
+
+def test_time_queued_on_a_busy_executor_does_not_trigger_a_hedge():
+    hedger = Hedger(POLICY)
+    attempts = Attempts(0.0)
+    with ThreadPoolExecutor(1) as busy:
+        busy.submit(time.sleep, 0.2)  # the client is saturated, not Számla Agent
+        assert hedger.send("action", attempts, busy) == 0
+    assert len(attempts.started) == 1 and hedger.hedged == 0
+    assert hedger.latencies.percentile("action", 100) < 0.1  # the queueing is not taken for latency either
+
+
+def test_hedges_are_capped_by_the_budget(executor):
+    hedger = Hedger(POLICY._replace(budget_ratio=0.0, budget_reserve=1))
+    first, second = Attempts(0.2, 0.0), Attempts(0.2, 0.0)
+    hedger.send("action", first, executor)
+    assert hedger.send("action", second, executor) == 0  # waited for the primary
+    assert len(first.started) == 2 and len(second.started) == 1
+    assert hedger.hedged == 1
+
+
+def test_loser_is_discarded(executor):
+    hedger = Hedger(POLICY)
+    discarded = threading.Event()
+    hedger.send("action", Attempts(0.2, 0.0), executor, discard=lambda response: discarded.set())
+    assert discarded.wait(1)
+
+
+def test_first_error_is_raised_if_both_attempts_fail(executor):
+    hedger = Hedger(POLICY)
+    with pytest.raises(ConnectionError):
+        hedger.send("action", Attempts(0.1, 0.0, error=ConnectionError("down")), executor)
+    assert hedger.hedged == 1 and hedger.won == 0
+
+
+def test_async_hedge_fires_after_the_delay_and_the_loser_is_cancelled():
+    hedger = Hedger(POLICY)
+    attempts = Attempts(0.5, 0.0)
+
+    async def main():
+        started = time.monotonic()
+        response = await hedger.asend("action", attempts.coroutine)
+        elapsed = time.monotonic() - started
+        await asyncio.sleep(0)  # the cancelled primary completes
+        return response, elapsed, len(asyncio.all_tasks())
+
+    response, elapsed, tasks = asyncio.run(main())
+    assert response == 1 and elapsed < 0.5 and tasks == 1
+    assert attempts.started[1] - attempts.started[0] >= POLICY.initial_delay
+    assert (hedger.hedged, hedger.won) == (1, 1)
+
+
+def test_client_hedges_a_slow_read(agent):
+    agent.delays = [0.5]  # the first request is slow, the hedge is not
+    client = SzamlazzClient(agent_key="KEY", hedge=POLICY, coalesce_reads=False)
+    client.url = agent.url
+    started = time.monotonic()
+    assert client.query_invoice_pdf("E-TEST-2024-1").ok
+    assert time.monotonic() - started < 0.5
+    assert agent.count(b"action-szamla_agent_pdf") == 2
+    assert client.hedger.won == 1
+    client.close()
+
+
+def test_client_never_hedges_a_write(agent, invoice):
+    agent.delay = 0.2
+    client = SzamlazzClient(agent_key="KEY", hedge=POLICY)
+    client.url = agent.url
+    assert client.generate_invoice(*invoice).ok
+    assert agent.count(b"action-xmlagentxmlfile") == 1
+    assert client.hedger.hedged == 0
+    client.close()
+
+
+def test_async_won_hedge_does_not_shrink_the_concurrency_limit(agent):
+    from szamlazz import AsyncSzamlazzClient
+
+    agent.delays = [0.5]
+    throttle = Throttle(ActionLimits(initial_concurrency=16, max_concurrency=16))
+
+    async def main():
+        async with AsyncSzamlazzClient(agent_key="KEY", hedge=POLICY, throttle=throttle, coalesce_reads=False) as client:
+            client.url = agent.url
+            response = await client.query_invoice_pdf("E-TEST-2024-1")
+            await asyncio.sleep(0.05)  # the cancelled primary hands back its slot
+            return response, client.hedger.won
+
+    response, won = asyncio.run(main())
+    assert response.ok and won == 1
+    limiter = throttle.for_action("action-szamla_agent_pdf")
+    assert limiter.concurrency.limit == 16 and limiter.concurrency.in_flight == 0
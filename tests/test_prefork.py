@@ -0,0 +1,57 @@
+import os
+import threading
+
+import pytest
+
+from szamlazz import SzamlazzClient
+from szamlazz.retry import RetryPolicy
+from szamlazz.throttle import ActionLimits, Throttle
+
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="POSIX only")
+
+
+def in_child(work) -> int:
+    """
+    Runs `work()` in a forked child process
+    :return: its exit code: 0 = done, 1 = failed, 2 = hung
+    """
+    pid = os.fork()
+    if pid == 0:
+        threading.Timer(5, os._exit, (2,)).start()
+        try:
+            work()
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+def test_child_is_not_limited_by_the_calls_the_parent_has_in_flight(agent):
+    agent.delay = 0.5
+    throttle = Throttle(ActionLimits(initial_concurrency=1, max_concurrency=1))
+    client = SzamlazzClient(agent_key="KEY", throttle=throttle, coalesce_reads=False)
+    client.url = agent.url
+    call = threading.Thread(target=client.query_invoice_pdf, args=("E-TEST-2024-1",))
+    call.start()
+    while agent.in_flight == 0:  # the only slot of the parent is taken
+        pass
+    agent.delay = 0.0
+    assert in_child(lambda: client.query_invoice_pdf("E-TEST-2024-1", timeout=2)) == 0
+    call.join()
+
+
+def test_child_does_not_inherit_held_locks(agent):
+    client = SzamlazzClient(agent_key="KEY", retry=RetryPolicy(), throttle=Throttle(ActionLimits(rate=100)),
+                            validation="sampled", coalesce_reads=False)
+    client.url = agent.url
+    held = [client._retry_budget._RetryBudget__lock, client._validator._Validator__lock,
+            client.throttle.for_action("action-szamla_agent_pdf").bucket._TokenBucket__lock]
+    for lock in held:  # as if other threads of the parent were using them when it forked
+        lock.acquire()
+    try:
+        assert in_child(lambda: client.query_invoice_pdf("E-TEST-2024-1", timeout=2)) == 0
+    finally:
+        for lock in held:
+            lock.release()
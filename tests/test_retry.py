@@ -0,0 +1,116 @@
+import re
+
+import pytest
+
+from szamlazz import SzamlazzClient
+from szamlazz.retry import RetryBudget, RetryPolicy
+
+
+FAST = dict(backoff_base=0.001, backoff_max=0.001)
+PDF_ACTION = b"action-szamla_agent_pdf"
+INVOICE_ACTION = b"action-xmlagentxmlfile"
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(backoff_base=0.5, backoff_max=2.0)
+    for attempt in range(1, 10):
+        assert 0 <= policy.backoff(attempt) <= min(2.0, 0.5 * 2 ** (attempt - 1))
+
+
+def test_budget_reserve_and_deposits():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+
+def test_read_is_retried_until_it_succeeds(agent, client_of):
+    agent.statuses = [503, 503]
+    client = client_of(agent.url, retry=RetryPolicy(max_attempts=3, **FAST))
+    response = client.query_invoice_pdf("E-TEST-2024-1")
+    assert response.ok
+    assert agent.count(PDF_ACTION) == 3
+
+
+def test_attempts_are_capped_by_max_attempts(agent, client_of):
+    agent.statuses = [503] * 10
+    client = client_of(agent.url, retry=RetryPolicy(max_attempts=3, **FAST))
+    response = client.query_invoice_pdf("E-TEST-2024-1")
+    assert response.response.status_code == 503
+    assert agent.count(PDF_ACTION) == 3
+
+
+def test_retries_stop_when_the_budget_runs_out(agent, client_of):
+    agent.statuses = [503] * 20
+    client = client_of(agent.url, retry=RetryPolicy(max_attempts=10, budget_ratio=0.0, budget_reserve=2, **FAST))
+    client.query_invoice_pdf("E-TEST-2024-1")
+    assert agent.count(PDF_ACTION) == 3  # 1 call + 2 retries of the reserve
+    client.query_invoice_pdf("E-TEST-2024-1")
+    assert agent.count(PDF_ACTION) == 4  # the budget is empty: no retry at all
+
+
+def test_non_retryable_status_is_not_retried(agent, client_of):
+    agent.statuses = [400]
+    client = client_of(agent.url, retry=RetryPolicy(**FAST))
+    assert client.query_invoice_pdf("E-TEST-2024-1").response.status_code == 400
+    assert agent.count(PDF_ACTION) == 1
+
+
+def test_write_without_idempotency_key_is_never_resent(agent, invoice, client_of):
+    agent.statuses = [503] * 5
+    client = client_of(agent.url, retry=RetryPolicy(**FAST))
+    header, merchant, buyer, _ = invoice
+    response = client.reverse_invoice(header, merchant, buyer)
+    assert response.response.status_code == 503
+    assert agent.count(b"action-szamla_agent_st") == 1
+
+
+def test_additive_credit_entry_is_never_resent(agent, client_of):
+    from szamlazz.models import Disbursement
+
+    agent.statuses = [503] * 5
+    client = client_of(agent.url, retry=RetryPolicy(**FAST))
+    client.register_credit_entry("E-TEST-2024-1", [Disbursement("2024-01-02", "átutalás", 100)], additive=True)
+    assert agent.count(b"action-szamla_agent_kifiz") == 1
+
+
+def test_custom_write_without_external_id_is_never_resent(agent, invoice, client_of):
+    from szamlazz import templates
+
+    agent.statuses = [503] * 5
+    client = client_of(agent.url, retry=RetryPolicy(**FAST))
+    template_data = client._invoice_template_data(client.get_basic_settings(), *invoice)
+    client.request_maker("action-xmlagentxmlfile", templates.generate_invoice, template_data)
+    assert agent.count(INVOICE_ACTION) == 1
+
+
+def test_invoice_is_resent_with_the_same_generated_external_id(agent, invoice, client_of):
+    agent.statuses = [503]
+    client = client_of(agent.url, retry=RetryPolicy(**FAST))
+    assert client.generate_invoice(*invoice).ok
+    keys = [re.search(rb"<szamlaKulsoAzon>([^<]+)</szamlaKulsoAzon>", body).group(1) for body in agent.requests]
+    assert len(keys) == 2 and keys[0] == keys[1]
+
+
+def test_invoice_keeps_the_given_external_id(agent, invoice, client_of):
+    client = client_of(agent.url, retry=RetryPolicy(**FAST))
+    client.generate_invoice(*invoice, external_id="ORDER-42")
+    assert b"<szamlaKulsoAzon>ORDER-42</szamlaKulsoAzon>" in agent.requests[0]
+
+
+def test_no_external_id_is_generated_without_retry_policy(agent, invoice, client_of):
+    client = client_of(agent.url)
+    client.generate_invoice(*invoice)
+    assert b"szamlaKulsoAzon" not in agent.requests[0]
+
+
+def test_refused_connection_is_retried_for_any_action(invoice, caplog):
+    client = SzamlazzClient(agent_key="KEY", retry=RetryPolicy(max_attempts=2, **FAST))
+    client.url = "http://127.0.0.1:9/"  # discard port: nothing listens there
+    header, merchant, buyer, _ = invoice
+    with caplog.at_level("WARNING", logger="szamlazz.client"), pytest.raises(Exception):
+        client.reverse_invoice(header, merchant, buyer)
+    assert "attempt #1 failed" in caplog.text and "retrying" in caplog.text
@@ -0,0 +1,86 @@
+import pytest
+
+from szamlazz import SzamlazzClient, serializers, templates
+from szamlazz.models import (Buyer, BuyerLedger, Disbursement, EmailDetails, Header, Item, ItemLedger, Merchant)
+
+
+HEADER = Header(creating_date="2024-01-02", payment_date="2024-01-02", due_date="2024-01-10", payment_type="Átutalás",
+                currency="HUF", invoice_language="hu", invoice_comment="100% <kész> & fizetve", order_number="R-1",
+                invoice_prefix="DK", invoice_number="E-TEST-2024-1")
+MERCHANT = Merchant(bank_name="OTP", bank_account_number="11111111-22222222-33333333", email_subject="Számla")
+BUYER = Buyer(name="Kovacs Bt.", zip_code="2030", city="Érd", address="Tárnoki út 23.", tax_number="12345678-1-42")
+LEDGER_BUYER = BUYER._replace(buyer_ledger=BuyerLedger(
+    accounting_date="2024-01-02", buyer_identifier="V-1", buyer_ledger_number="311", continuous_performance=True,
+    settlement_date_from="2024-01-01", settlement_date_to="2024-01-31"))
+ITEM = Item(name="Eladó izé", quantity="2.0", quantity_unit="db", unit_price="10000", vat_rate="27",
+            net_price="20000.0", vat_amount="5400.0", gross_amount="25400.0", comment_for_item="lorem ipsum")
+LEDGER_ITEM = ITEM._replace(identifier="ASD-123", margin_tax_base=10.25, item_ledger=ItemLedger(
+    economic_event="E", economic_event_tax="EA", sales_ledger_number="911", vat_ledger_number="467",
+    settlement_date_from="2024-01-01", settlement_date_to="2024-01-31"))
+EMAIL = EmailDetails(addresses="a@example.com,b@example.com", reply_to_address="c@example.com", subject="Nyugta")
+RECEIPT = {
+    "fejlec": {"hivasAzonosito": "1", "elotag": "NYGTA", "fizmod": "készpénz", "penznem": "HUF", "megjegyzes": "",
+               "pdfSablon": ""},
+    "tetelek": [{"megnevezes": "izé", "mennyiseg": 1.0, "mennyisegiEgyseg": "db", "nettoEgysegar": 100,
+                 "netto": 100, "afakulcs": "27", "afa": 27, "brutto": 127, "fokonyv_arbevetel": "911"}] * 2,
+    "kifizetesek": [],
+}
+
+# public calls of the client, one per template and branch: (template, call)
+CALLS = {
+    "generate_invoice": (templates.generate_invoice, lambda c: c.generate_invoice(HEADER, MERCHANT, BUYER, [ITEM])),
+    "generate_invoice empty": (templates.generate_invoice, lambda c: c.generate_invoice(Header(), Merchant(), Buyer(), [Item()])),
+    "generate_invoice no items": (templates.generate_invoice, lambda c: c.generate_invoice(HEADER, MERCHANT, BUYER, [])),
+    "generate_invoice ledgers": (templates.generate_invoice,
+                                 lambda c: c.generate_invoice(HEADER, MERCHANT, LEDGER_BUYER, [LEDGER_ITEM, ITEM] * 3,
+                                                              e_invoice=False, invoice_download=False)),
+    "generate_invoice external_id": (templates.generate_invoice,
+                                     lambda c: c.generate_invoice(HEADER, MERCHANT, BUYER, [ITEM], external_id="ORDER-1")),
+    "reverse_invoice": (templates.reverse_invoice, lambda c: c.reverse_invoice(HEADER, MERCHANT, BUYER)),
+    "reverse_invoice copy": (templates.reverse_invoice,
+                             lambda c: c.reverse_invoice(HEADER, MERCHANT, LEDGER_BUYER, False, False, 2)),
+    "credit_entry": (templates.credit_entry, lambda c: c.register_credit_entry(
+        "E-TEST-2024-1", [Disbursement("2024-01-03", "átutalás", 1000.0), Disbursement("2024-01-04", "kp", 1.5, "x")])),
+    "credit_entry additive": (templates.credit_entry, lambda c: c.register_credit_entry("E-TEST-2024-1", [], True)),
+    "query_invoice_pdf": (templates.query_invoice_pdf, lambda c: c.query_invoice_pdf("E-TEST-2024-1")),
+    "query_invoice_xml invoice_number": (templates.query_invoice_xml, lambda c: c.query_invoice_xml("E-TEST-2024-1")),
+    "query_invoice_xml order_number": (templates.query_invoice_xml,
+                                       lambda c: c.query_invoice_xml(order_number="R-1", pdf=False)),
+    "delete_pro_forma_invoice invoice_number": (templates.delete_pro_forma_invoice,
+                                                lambda c: c.delete_pro_forma_invoice("D-TEST-2024-1")),
+    "delete_pro_forma_invoice order_number": (templates.delete_pro_forma_invoice,
+                                              lambda c: c.delete_pro_forma_invoice(order_number="R-1")),
+    "generate_receipt": (templates.generate_receipt, lambda c: c.generate_receipt({**c.get_basic_settings(), **RECEIPT})),
+    "generate_receipt empty": (templates.generate_receipt,
+                               lambda c: c.generate_receipt({**c.get_basic_settings(), "fejlec": {}, "tetelek": []})),
+    "reverse_receipt": (templates.reverse_receipt, lambda c: c.reverse_receipt("NYGTA-2024-1")),
+    "reverse_receipt pdf_template": (templates.reverse_receipt, lambda c: c.reverse_receipt("NYGTA-2024-1", "J")),
+    "query_receipt": (templates.query_receipt, lambda c: c.query_receipt("NYGTA-2024-1", "J")),
+    "send_receipt": (templates.send_receipt, lambda c: c.send_receipt(EMAIL)),
+    "send_receipt sendAgainPreviousEmail": (templates.send_receipt, lambda c: c.send_receipt(EMAIL, True)),
+    "tax_payer": (templates.tax_payer, lambda c: c.query_taxpayer("13421739")),
+}
+
+
+def template_data(call) -> dict:
+    """The template data the client renders for `call`, which is not sent"""
+    client = SzamlazzClient(username="user", password="p%ss<word>")
+    rendered = []
+    client._call = lambda **kwargs: rendered.append(kwargs)
+    call(client)
+    return rendered[0]["template_data"]
+
+
+def test_every_builtin_template_is_covered():
+    assert {template for template, _ in CALLS.values()} == {getattr(templates, name) for name in templates._builtin_names}
+
+
+@pytest.mark.parametrize("template, call", CALLS.values(), ids=CALLS.keys())
+def test_direct_engine_renders_the_template_byte_for_byte(template, call):
+    data = template_data(call)
+    expected = templates.render(template, data)
+    assert serializers.render(template, data) == expected
+    assert "".join(serializers.generate(template, data)) == expected
+    fragments = serializers.Fragments()
+    assert serializers.render(template, data, fragments) == expected
+    assert serializers.render(template, data, fragments) == expected  # from the fragments
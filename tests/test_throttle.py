@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import requests
+
+from szamlazz import SzamlazzClient
+from szamlazz.deadline import DeadlineExceeded
+from szamlazz.throttle import ActionLimits, AdaptiveConcurrencyLimit, Throttle, TokenBucket
+
+
+def test_token_bucket_delays_beyond_the_burst():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0.0 and bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    bucket.refund()
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+
+
+def test_congestion_halves_the_limit_once_per_episode():
+    limit = AdaptiveConcurrencyLimit(ActionLimits(initial_concurrency=8))
+    tickets = [limit.try_acquire() for _ in range(3)]
+    for ticket in tickets:
+        limit.release(ticket, congested=True, latency=0.01)
+    assert limit.limit == 4
+    assert limit.in_flight == 0
+
+
+def test_success_grows_the_limit_up_to_max():
+    limit = AdaptiveConcurrencyLimit(ActionLimits(initial_concurrency=2, max_concurrency=3))
+    for _ in range(20):
+        limit.release(limit.try_acquire(), congested=False, latency=0.01)
+    assert limit.limit == 3
+
+
+def test_latency_spike_is_congestion():
+    limit = AdaptiveConcurrencyLimit(ActionLimits(initial_concurrency=8, max_concurrency=8))
+    for _ in range(AdaptiveConcurrencyLimit._LATENCY_WARMUP):
+        limit.release(limit.try_acquire(), congested=False, latency=0.01)
+    limit.release(limit.try_acquire(), congested=False, latency=1.0)
+    assert limit.limit == 4
+
+
+def test_acquire_times_out_when_the_limit_is_reached():
+    limit = AdaptiveConcurrencyLimit(ActionLimits(initial_concurrency=1))
+    assert limit.acquire() is not None
+    started = time.monotonic()
+    assert limit.acquire(timeout=0.05) is None
+    assert time.monotonic() - started >= 0.05
+    assert limit.in_flight == 1
+
+
+def test_token_is_refunded_when_no_slot_frees_up():
+    throttle = Throttle(ActionLimits(rate=1, burst=1, initial_concurrency=1)).for_action("action")
+    throttle.concurrency.acquire()
+    assert throttle.acquire(timeout=0.01) is None
+    assert throttle.bucket.reserve() == 0.0  # the token of the failed acquire is back
+
+
+def test_token_is_refunded_when_the_async_wait_is_cancelled():
+    throttle = Throttle(ActionLimits(rate=1, burst=1)).for_action("action")
+    throttle.bucket.reserve()
+
+    async def main():
+        task = asyncio.create_task(throttle.acquire_async())
+        await asyncio.sleep(0.05)  # waiting for the next token
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert throttle.bucket.reserve() < 1.0  # waits for 1 token, not for the one of the cancelled acquire too
+
+
+def test_async_acquire_is_woken_by_release():
+    limit = AdaptiveConcurrencyLimit(ActionLimits(initial_concurrency=1, max_concurrency=1))
+    ticket = limit.try_acquire()
+
+    async def main():
+        waiter = asyncio.create_task(limit.acquire_async())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        released = time.monotonic()
+        limit.release(ticket, congested=False, latency=0.01)
+        await waiter
+        return time.monotonic() - released
+
+    assert asyncio.run(main()) < 0.01
+
+
+def test_async_acquire_is_woken_by_a_release_of_another_thread():
+    limit = AdaptiveConcurrencyLimit(ActionLimits(initial_concurrency=1, max_concurrency=1))
+    ticket = limit.try_acquire()
+    threading.Timer(0.05, limit.release, (ticket, False, 0.01)).start()
+
+    async def main():
+        return await limit.acquire_async(timeout=1.0)
+
+    assert asyncio.run(main()) is not None
+    assert limit.in_flight == 1
+
+
+def test_async_acquire_times_out():
+    limit = AdaptiveConcurrencyLimit(ActionLimits(initial_concurrency=1))
+    limit.try_acquire()
+    assert asyncio.run(limit.acquire_async(timeout=0.05)) is None
+    assert limit.in_flight == 1
+
+
+def test_client_respects_the_concurrency_limit(agent):
+    agent.delay = 0.05
+    throttle = Throttle(ActionLimits(initial_concurrency=2, max_concurrency=2, latency_spike_ratio=None))
+    client = SzamlazzClient(agent_key="KEY", throttle=throttle, coalesce_reads=False)
+    client.url = agent.url
+    threads = [threading.Thread(target=client.query_invoice_pdf, args=("E-TEST-2024-1",)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(agent.requests) == 6
+    assert agent.max_in_flight == 2
+
+
+@pytest.mark.parametrize("error, congested", [
+    (requests.ConnectionError("reset"), True),
+    (requests.ReadTimeout("slow"), True),
+    (DeadlineExceeded("read", 1.0, 1.0), True),
+    (asyncio.CancelledError(), False),
+    (KeyboardInterrupt(), False),
+    (ValueError("a bug of the caller"), False),
+])
+def test_only_transport_errors_are_congestion(error, congested):
+    throttle = Throttle(ActionLimits(initial_concurrency=8)).for_action("action")
+    ticket = throttle.acquire()
+    throttle.release(ticket, 0.01, error=error)
+    assert throttle.concurrency.limit == (4 if congested else 8)
+    assert throttle.concurrency.in_flight == 0
+
+
+def test_httpx_transport_errors_are_congestion():
+    httpx = pytest.importorskip("httpx")
+    throttle = Throttle(ActionLimits(initial_concurrency=8)).for_action("action")
+    throttle.release(throttle.acquire(), 0.01, error=httpx.ConnectTimeout("slow"))
+    assert throttle.concurrency.limit == 4
@@ -0,0 +1,62 @@
+import gc
+import threading
+
+from szamlazz import xsd
+
+
+SCHEMA = """<?xml version="1.0" encoding="UTF-8"?>
+<schema xmlns="http://www.w3.org/2001/XMLSchema">
+  <element name="tetel" type="int"/>
+</schema>
+"""
+
+
+def run_in_threads(n: int, fn):
+    """Calls `fn(i)` from `n` threads at once, returns the results"""
+    results = [None] * n
+    barrier = threading.Barrier(n)
+
+    def run(i):
+        barrier.wait()
+        results[i] = fn(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_validations_keep_their_own_errors():
+    def validate(i):
+        document = f"<tetel>{i}</tetel>" if i % 2 else f"<tetel>x{i}</tetel>"
+        return [xsd.validate(document, SCHEMA) for _ in range(200)]
+
+    for i, results in enumerate(run_in_threads(8, validate)):
+        if i % 2:
+            assert all(result == (True, "None") for result in results)
+        else:
+            assert all(not valid and f"'x{i}'" in error for valid, error in results)
+
+
+def test_validate_many_reports_the_errors_of_every_document():
+    documents = [f"<tetel>{i}</tetel>" if i % 3 else f"<tetel>x{i}</tetel>" for i in range(30)]
+    results = xsd.validate_many(documents, SCHEMA, workers=4)
+    assert [result.valid for result in results] == [bool(i % 3) for i in range(30)]
+    for i, result in enumerate(results):
+        assert result.valid or (len(result.errors) == 1 and f"'x{i}'" in result.errors[0])
+
+
+def test_thread_schemas_are_dropped_with_the_evicted_schema():
+    validated = threading.Barrier(4)
+
+    def validate(i):
+        xsd.validate("<tetel>1</tetel>", SCHEMA.replace('"tetel"', f'"tetel{i}"'))
+        schemas = len(xsd._thread_state.schemas)
+        validated.wait()
+        xsd._compile_custom.cache_clear()  # evicted from the cache of the custom schemas
+        gc.collect()
+        return schemas, len(xsd._thread_state.schemas)
+
+    assert run_in_threads(4, validate) == [(1, 0)] * 4